@@ -20,7 +20,7 @@ import {
   Refresh,
   Chat
 } from '@mui/icons-material';
-import { downloadConsentPdf, validateFormData } from '../services/pdfService';
+import { downloadConsentPdf, downloadFormPdf, saveFormVersion, validateFormData } from '../services/pdfService';
 
 function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdate }) {
   const initialData = {
@@ -34,21 +34,122 @@ function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdat
   };
 
   const [data, setData] = useState(textAreaData || initialData);
-  const [buffer, setBuffer] = useState(textAreaData || initialData);
   const [activeField, setActiveField] = useState(null);
   const [aiAssistantVisible, setAiAssistantVisible] = useState(false);
   const [aiAssistantInput, setAiAssistantInput] = useState("");
   const [loading, setLoading] = useState(false);
   const [streamStarted, setStreamStarted] = useState(false);
   const [error, setError] = useState(null);
+  // Section being regenerated through /revise, if any
+  const [revisingField, setRevisingField] = useState(null);
   
   const isGeneratedRef = useRef(false);
   const textareaRefs = useRef({});
-  const processingFields = useRef(new Set());
-  const bufferQueue = useRef([]);
+  // Section text reassembled from the delta stream, flushed to state once per frame
+  const sectionsRef = useRef({ ...initialData });
+  const frameRef = useRef(null);
+  // Server-side copy of the form: its ID and the sections of the latest stored version
+  const formIdRef = useRef(null);
+  const storedSectionsRef = useRef(null);
 
   const BACKEND_URL = import.meta.env.VITE_BACKEND_URL || 'http://localhost:8000';
 
+  const flushSections = () => {
+    frameRef.current = null;
+    setData({ ...sectionsRef.current });
+  };
+
+  const scheduleFlush = () => {
+    if (frameRef.current === null) {
+      frameRef.current = requestAnimationFrame(flushSections);
+    }
+  };
+
+  const applyDelta = ({ section, offset, delta }) => {
+    const current = sectionsRef.current[section] || "";
+    if (offset > current.length) {
+      // A gap; wait for the next checkpoint to resynchronise this section
+      return;
+    }
+    sectionsRef.current[section] = current.slice(0, offset) + delta;
+    scheduleFlush();
+  };
+
+  const applyCheckpoint = ({ sections }) => {
+    sectionsRef.current = { ...sectionsRef.current, ...sections };
+    scheduleFlush();
+  };
+
+  const handleEvent = (rawEvent) => {
+    let event = "message";
+    const dataLines = [];
+    for (const line of rawEvent.split("\n")) {
+      if (line.startsWith("event:")) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith("data:")) {
+        dataLines.push(line.slice(5).trimStart());
+      }
+    }
+    if (!dataLines.length) return;
+
+    const payload = JSON.parse(dataLines.join("\n"));
+    setStreamStarted(true);
+    if (event === "delta") {
+      applyDelta(payload);
+    } else if (event === "checkpoint") {
+      applyCheckpoint(payload);
+    } else if (event === "complete") {
+      applyCheckpoint(payload);
+      if (payload.form_id) {
+        // A revision completes with only the section it regenerated
+        formIdRef.current = payload.form_id;
+        storedSectionsRef.current = { ...storedSectionsRef.current, ...payload.sections };
+      }
+      onTextAreaDataUpdate({ ...sectionsRef.current });
+    } else if (event === "error") {
+      throw new Error(payload.error);
+    }
+  };
+
+  // Reads a delta-mode SSE response (generation or revision) to the end
+  const readEvents = async (response) => {
+    if (!response.ok) {
+      const detail = await response.json().catch(() => ({}));
+      throw new Error(detail.detail || detail.error || `Request failed with status ${response.status}`);
+    }
+    if (!response.body) {
+      throw new Error("ReadableStream not supported");
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let pending = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      // Events can span network chunks; only handle the ones that are complete
+      pending += decoder.decode(value, { stream: true });
+      const events = pending.split("\n\n");
+      pending = events.pop();
+      for (const rawEvent of events) {
+        handleEvent(rawEvent);
+      }
+    }
+  };
+
+  // Stores the sections edited since the last stored version, so the server works on what the reviewer sees
+  const saveEdits = async () => {
+    const formId = formIdRef.current;
+    const edited = Object.keys(data).filter(key => data[key] !== storedSectionsRef.current[key]);
+    if (edited.length) {
+      const changes = Object.fromEntries(edited.map(key => [key, data[key]]));
+      const form = await saveFormVersion(formId, changes);
+      storedSectionsRef.current = { ...form.sections };
+    }
+  };
+
   useEffect(() => {
     const generateConsentForm = async () => {
       if (isGeneratedRef.current || !selectedFiles.length) return;
@@ -59,34 +160,9 @@ function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdat
         const response = await fetch(`${BACKEND_URL}/generate-consent-form`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ files: selectedFiles }),
+          body: JSON.stringify({ files: selectedFiles, mode: "delta" }),
         });
-
-        if (!response.body) {
-          throw new Error("ReadableStream not supported");
-        }
-
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) break;
-
-          const chunk = decoder.decode(value, { stream: true });
-          try {
-            const jsonData = JSON.parse(chunk);
-            setStreamStarted(true);
-            bufferQueue.current.push(jsonData);
-            setBuffer(prevBuffer => ({
-              ...prevBuffer,
-              ...jsonData
-            }));
-          } catch (error) {
-            console.error("Error parsing chunk:", error);
-            console.error("Chunk:", chunk);
-          }
-        }
+        await readEvents(response);
       } catch (error) {
         setError("Failed to generate consent form");
         console.error("Error generating consent form:", error);
@@ -99,87 +175,41 @@ function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdat
     generateConsentForm();
   }, [selectedFiles, BACKEND_URL]);
 
-  const processField = async (key, content, existingContent = '') => {
-    if (processingFields.current.has(key)) return;
-    processingFields.current.add(key);
-
-    try {
-      const words = content.split(' ');
-      let currentText = existingContent;
-
-      for (const word of words) {
-        if (!currentText.includes(word)) {
-          currentText += (currentText ? ' ' : '') + word;
-          setData(prev => ({
-            ...prev,
-            [key]: currentText
-          }));
-          await new Promise(r => setTimeout(r, 30));
-        }
-      }
-    } finally {
-      processingFields.current.delete(key);
-    }
-  };
-
-  useEffect(() => {
-    const updateFields = async () => {
-      const currentBuffer = { ...buffer };
-      const currentData = { ...data };
-      const updatePromises = [];
-
-      for (const key of Object.keys(initialData)) {
-        if (currentBuffer[key] && currentBuffer[key] !== currentData[key]) {
-          updatePromises.push(processField(key, currentBuffer[key], currentData[key]));
-        }
-      }
-
-      await Promise.all(updatePromises);
-
-      while (bufferQueue.current.length > 0) {
-        const nextUpdate = bufferQueue.current.shift();
-        if (nextUpdate) {
-          setBuffer(prev => ({
-            ...prev,
-            ...nextUpdate
-          }));
-        }
-      }
-    };
-
-    updateFields();
-  }, [buffer]);
-
   const handleAiAssistantSubmit = async (e) => {
     e.preventDefault();
+    const formId = formIdRef.current;
+    if (!formId || revisingField) {
+      return;
+    }
+    const section = activeField;
+    const previous = data[section];
     try {
+      setRevisingField(section);
+      await saveEdits();
+      // Only this section is regenerated and streamed; the others keep the reviewer's text
+      sectionsRef.current = { ...data, [section]: "" };
       const response = await fetch(`${BACKEND_URL}/revise`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
-          field: activeField,
-          content: data[activeField],
-          question: aiAssistantInput,
+          form_id: formId,
+          section,
+          instructions: aiAssistantInput,
         }),
       });
-
-      const result = await response.json();
-      if (result && result[activeField]) {
-        setData(prevData => ({
-          ...prevData,
-          [activeField]: result[activeField],
-        }));
-        onTextAreaDataUpdate(prevData => ({
-          ...prevData,
-          [activeField]: result[activeField],
-        }));
-      }
+      await readEvents(response);
 
       setAiAssistantInput("");
       setAiAssistantVisible(false);
     } catch (error) {
-      setError("Failed to process AI assistant request");
+      // Put back the text the section had before
+      sectionsRef.current = { ...data, [section]: previous };
+      scheduleFlush();
+      setError(error.message || "Failed to process AI assistant request");
       console.error("Error with AI assistant:", error);
+    } finally {
+      setRevisingField(null);
+      setStreamStarted(false);
     }
   };
 
@@ -194,7 +224,14 @@ function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdat
         return;
       }
   
-      await downloadConsentPdf(data);
+      const formId = formIdRef.current;
+      if (!formId) {
+        await downloadConsentPdf(data);
+        return;
+      }
+      // Only edits made since the last stored version are sent; otherwise export renders the stored copy
+      await saveEdits();
+      await downloadFormPdf(formId);
     } catch (error) {
       setError(error.message || 'Failed to download PDF');
     } finally {
@@ -245,6 +282,7 @@ function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdat
                           multiline
                           minRows={4}
                           value={data[field.key]}
+                          disabled={revisingField === field.key}
                           onChange={(e) => {
                             const newData = {
                               ...data,
@@ -274,12 +312,18 @@ function ConsentFormComponent({ selectedFiles, textAreaData, onTextAreaDataUpdat
                               <TextField
                                 fullWidth
                                 size="small"
-                                placeholder="Ask AI assistant"
+                                placeholder="Reviewer instructions (leave empty to regenerate)"
                                 value={aiAssistantInput}
                                 onChange={(e) => setAiAssistantInput(e.target.value)}
+                                disabled={!!revisingField}
                               />
-                              <Button type="submit" variant="contained" startIcon={<Chat />}>
-                                Ask
+                              <Button
+                                type="submit"
+                                variant="contained"
+                                startIcon={revisingField === field.key ? <CircularProgress size={16} /> : <Chat />}
+                                disabled={!formIdRef.current || !!revisingField}
+                              >
+                                {aiAssistantInput.trim() ? "Revise" : "Regenerate"}
                               </Button>
                             </Box>
                           </Paper>
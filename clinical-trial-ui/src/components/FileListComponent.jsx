@@ -28,9 +28,9 @@ function FileListComponent({ files, onFilesSelected }) {
               <input
                 type="checkbox"
                 onChange={() => handleFileSelection(file)}
-                disabled={file.status !== 'processed'}
+                disabled={file.status !== 'indexed'}
               />
-              {file.name} {file.status !== 'processed' && '(Processing)'}
+              {file.name} {file.status === 'failed' ? '(Failed)' : file.status !== 'indexed' && '(Processing)'}
             </label>
           </li>
         ))}
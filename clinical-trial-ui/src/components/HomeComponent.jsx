@@ -264,10 +264,10 @@ function HomeComponent({ onFilesSelected, onFormOptionSelected }) {
                         <Button
                           variant="outlined"
                           onClick={() => handleFilesSelection([file])}
-                          disabled={file.status !== 'processed'}
+                          disabled={file.status !== 'indexed'}
                           sx={buttonStyle}
                         >
-                          {file.status === 'processed' ? 'Select' : 'Processing...'}
+                          {file.status === 'indexed' ? 'Select' : file.status === 'failed' ? 'Failed' : 'Processing...'}
                         </Button>
                       }
                     >
@@ -62,6 +62,58 @@ const formatContentForPdf = (formData) => {
   return formatted;
 };
 
+const saveBlob = (blob, filename) => {
+  const url = window.URL.createObjectURL(blob);
+  const link = document.createElement('a');
+  link.href = url;
+  link.setAttribute('download', filename);
+  document.body.appendChild(link);
+  link.click();
+
+  // Cleanup
+  setTimeout(() => {
+    document.body.removeChild(link);
+    window.URL.revokeObjectURL(url);
+  }, 100);
+};
+
+// Stores reviewer edits as a new version of a server-side form
+export const saveFormVersion = async (formId, sections) => {
+  const response = await fetch(`${import.meta.env.VITE_BACKEND_URL}/forms/${formId}`, {
+    method: 'PUT',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ sections }),
+  });
+
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`Failed to save form: ${errorText}`);
+  }
+  return response.json();
+};
+
+// Exports a server-side form; the browser revalidates its cached copy with the ETag (304 if unchanged)
+export const downloadFormPdf = async (formId) => {
+  try {
+    const response = await fetch(`${import.meta.env.VITE_BACKEND_URL}/forms/${formId}/pdf`, {
+      headers: { 'Accept': 'application/pdf' },
+    });
+
+    if (!response.ok) {
+      const errorText = await response.text();
+      throw new Error(`Failed to generate PDF: ${errorText}`);
+    }
+
+    const timestamp = new Date().toISOString().split('T')[0];
+    saveBlob(await response.blob(), `consent_form_${timestamp}.pdf`);
+    return true;
+  } catch (error) {
+    console.error('Error downloading PDF:', error);
+    throw error;
+  }
+};
+
+// Renders the given text directly, for forms the server does not have stored
 export const downloadConsentPdf = async (formData) => {
   try {
     // Format the content for PDF generation
@@ -81,24 +133,11 @@ export const downloadConsentPdf = async (formData) => {
       throw new Error(`Failed to generate PDF: ${errorText}`);
     }
 
-    const blob = await response.blob();
-    const url = window.URL.createObjectURL(blob);
-    const link = document.createElement('a');
     const timestamp = new Date().toISOString().split('T')[0];
-    link.href = url;
-    link.setAttribute('download', `consent_form_${timestamp}.pdf`);
-    document.body.appendChild(link);
-    link.click();
-    
-    // Cleanup
-    setTimeout(() => {
-      document.body.removeChild(link);
-      window.URL.revokeObjectURL(url);
-    }, 100);
-
+    saveBlob(await response.blob(), `consent_form_${timestamp}.pdf`);
     return true;
   } catch (error) {
     console.error('Error downloading PDF:', error);
     throw error;
   }
-};
\ No newline at end of file
+};
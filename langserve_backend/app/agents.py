@@ -1,12 +1,14 @@
-from typing import TypedDict, Annotated, Dict, Any, Optional, AsyncGenerator
+from typing import TypedDict, Annotated, Dict, Any, List, Optional
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import MessageGraph, add_messages
 from langchain_core.runnables import RunnableConfig
-from langchain.callbacks import AsyncIteratorCallbackHandler
+from langgraph.types import StreamWriter
+import time
 import asyncio
 import logging 
 
 from .queries import (
+    SECTION_QUERIES,
     summary_query,
     background_query,
     number_of_participants_query,
@@ -16,7 +18,16 @@ from .queries import (
     benefits_query
 )
 
+from .config import Config
 from .rag_builder import RagBuilder
+from .section_cache import SectionCache
+from .metrics import GENERATIONS_IN_FLIGHT, SECTION_SECONDS, SECTIONS
+from .streaming import BoundedTokenHandler, coalesce_tokens
+from .templates import (
+    rag_prompt_template,
+    shared_context_system_template,
+    shared_context_question_template,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -29,11 +40,32 @@ class AgentState(TypedDict):
     alt_procedures: Annotated[str, add_messages]
     risks: Annotated[str, add_messages]
     benefits: Annotated[str, add_messages]
+    # Set by shared_context_node in shared-context mode
+    shared_context: str
+    shared_prefix_tokens: int
 
 class ClinicalTrialGraph:
-    def __init__(self, rag_builder: RagBuilder, files: list[str] = []):
-        logger.warning(f"Creating ClinicalTrialGraph with files: {files}")
-        self.rag_chain = rag_builder.rag_chain if len(files) == 0 else rag_builder.get_rag_with_filters(files)
+    """
+    Consent-form graph with one streaming node per section.
+
+    The graph is compiled once and shared by every request. The documents to
+    generate from are passed per run through ``config["configurable"]``:
+
+        files: Document titles to restrict retrieval to; all documents if empty.
+        document_hashes: Content hashes of ``files``, part of every section cache key.
+        regenerate: Skip cached sections and generate everything again (results are still cached).
+        request_id: Identifies the request to the LLM scheduler, which shares capacity fairly between requests.
+        llm_priority: "interactive" (default) or "batch"; interactive calls are scheduled first.
+        context_mode: "per_section" retrieves for each section; "shared" retrieves once for the
+            form and sends the context as a prompt prefix that is identical for every section.
+            Defaults to RAG_CONTEXT_MODE.
+        revision_instructions, revision_draft: Set by ``astream_section`` to revise a section's
+            draft following reviewer instructions instead of writing it from scratch.
+    """
+
+    def __init__(self, rag_builder: RagBuilder, section_cache: Optional[SectionCache] = None):
+        self.rag_builder = rag_builder
+        self.section_cache = section_cache
         self.compiled_graph = self._build_graph()
 
     def _build_graph(self):
@@ -50,10 +82,12 @@ class ClinicalTrialGraph:
             ("benefits_node", "benefits")
         ]
         
-        # Add nodes and connect them to START and END
+        # Every section starts after the (optional) shared retrieval and ends at END
+        workflow.add_node("shared_context_node", self.shared_context_node)
+        workflow.add_edge(START, "shared_context_node")
         for node_name, state_key in nodes:
             workflow.add_node(node_name, getattr(self, node_name))
-            workflow.add_edge(START, node_name)
+            workflow.add_edge("shared_context_node", node_name)
             workflow.add_edge(node_name, END)
 
         # Set the entry point
@@ -61,59 +95,217 @@ class ClinicalTrialGraph:
 
         return workflow.compile()
 
-    async def streaming_node(self, state: AgentState, field: str, query: str) -> AsyncGenerator[Dict, None]:
-        callback = AsyncIteratorCallbackHandler()
-        runnable = self.rag_chain.with_config(callbacks=[callback])
-        task = asyncio.create_task(runnable.ainvoke({"question": query()}))
-        
-        current_content = ""
-        async for token in callback.aiter():
-            current_content += token
-          
-            # Yield the entire current content for the field, simulating overwriting
-            yield {field: current_content}
-        
-        await task
+    async def shared_context_node(self, state: AgentState, config: RunnableConfig) -> Dict:
+        """ In shared-context mode, retrieve and pack the context for all sections at once. """
+        configurable = config.get("configurable", {})
+        if configurable.get("context_mode", Config.RAG_CONTEXT_MODE) != "shared":
+            # Nodes must write a channel; sections then retrieve their own context
+            return {"shared_prefix_tokens": 0}
+        files = configurable.get("files") or []
+        context, prefix_tokens = await self.rag_builder.abuild_shared_context(
+            files, [query() for query in SECTION_QUERIES.values()]
+        )
+        logger.info(f"Shared context for {files}: {prefix_tokens} prefix tokens")
+        return {"shared_context": context, "shared_prefix_tokens": prefix_tokens}
+
+    async def streaming_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter, field: str, query: str) -> str:
+        """
+        Generate one section, reporting its text as it is produced.
+
+        Tokens are coalesced into deltas of up to ``stream_flush_chars`` characters or
+        ``stream_flush_ms`` milliseconds (from the run config, defaulting to the
+        STREAM_FLUSH_* settings). Each delta is sent as ``{"section", "offset", "delta"}``,
+        where ``offset`` is the length of the section text before it, to the async
+        ``delta_sink`` in the run config, or to the custom stream ``writer`` without
+        one. Returns the full text.
+        """
+        configurable = config.get("configurable", {})
+        files = configurable.get("files") or []
+        document_hashes = configurable.get("document_hashes")
+        delta_sink = configurable.get("delta_sink")
+        instructions = configurable.get("revision_instructions")
+        started = time.perf_counter()
+
+        async def send(offset: int, delta: str):
+            event = {"section": field, "offset": offset, "delta": delta}
+            if delta_sink:
+                # Waits while the client is behind; the model stream is throttled in turn
+                await delta_sink(event)
+            else:
+                writer(event)
+
+        question = query()
+        shared_context = state.get("shared_context")
+        prompt_template = (
+            shared_context_system_template + shared_context_question_template
+            if shared_context is not None else rag_prompt_template
+        )
+        cache_key = None
+        # A revision depends on the draft and the instructions, so it is neither read from nor written to the cache
+        if self.section_cache and document_hashes is not None and not instructions:
+            cache_key = SectionCache.key(
+                document_hashes,
+                question,
+                prompt_template,
+                Config.OPENAI_MODEL_NAME,
+                self.rag_builder.context_settings(shared=shared_context is not None),
+            )
+            cached = None if configurable.get("regenerate") else await asyncio.to_thread(self.section_cache.get, cache_key)
+            if cached is not None:
+                # Nothing that determines the text has changed; replay the finished section at once
+                await send(0, cached)
+                SECTIONS.inc(source="cache")
+                return cached
+
+        if instructions:
+            # The section's own retrieval, usually still in the retrieval cache from generating it
+            rag_chain = self.rag_builder.get_revision_chain(files)
+            chain_input = {
+                "question": question,
+                "draft": configurable.get("revision_draft") or "",
+                "instructions": instructions,
+            }
+        elif shared_context is not None:
+            rag_chain = self.rag_builder.shared_context_chain
+            chain_input = {"context": shared_context, "question": question}
+        else:
+            rag_chain = self.rag_builder.rag_chain if len(files) == 0 else self.rag_builder.get_rag_with_filters(files)
+            chain_input = {"question": question}
+        callback = BoundedTokenHandler(Config.STREAM_MAX_PENDING_EVENTS)
+        # request_id and llm_priority in the run config drive the LLM scheduler's ordering
+        task = asyncio.create_task(
+            rag_chain.ainvoke(chain_input, config={"callbacks": [callback], "configurable": configurable})
+        )
+
+        pieces = []
+        offset = 0
+        try:
+            async for delta in coalesce_tokens(
+                callback.queue,
+                task,
+                configurable.get("stream_flush_chars", Config.STREAM_FLUSH_CHARS),
+                configurable.get("stream_flush_ms", Config.STREAM_FLUSH_MS) / 1000,
+            ):
+                if not pieces:
+                    SECTION_SECONDS.observe(time.perf_counter() - started, section=field, phase="first_token")
+                await send(offset, delta)
+                pieces.append(delta)
+                offset += len(delta)
+            await task
+        finally:
+            if not task.done():
+                # The request went away mid-section; stop generating
+                task.cancel()
 
-    async def summary_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "summary", summary_query):
-            yield {"summary": [update["summary"]]}
+        content = "".join(pieces)
+        SECTION_SECONDS.observe(time.perf_counter() - started, section=field, phase="total")
+        SECTIONS.inc(source="revised" if instructions else "generated")
+        if cache_key:
+            await asyncio.to_thread(self.section_cache.put, cache_key, field, content)
+        return content
 
-    async def background_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "background", background_query):
-            print(f"Received update: {update}")
+    async def summary_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"summary": [await self.streaming_node(state, config, writer, "summary", summary_query)]}
 
-            yield {"background": [update["background"]]}
+    async def background_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"background": [await self.streaming_node(state, config, writer, "background", background_query)]}
 
-    async def number_of_participants_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "number_of_participants", number_of_participants_query):
-            yield {"number_of_participants": [update["number_of_participants"]]}
+    async def number_of_participants_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"number_of_participants": [await self.streaming_node(state, config, writer, "number_of_participants", number_of_participants_query)]}
 
-    async def study_procedures_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "study_procedures", study_procedures_query):
-            yield {"study_procedures": [update["study_procedures"]]}
+    async def study_procedures_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"study_procedures": [await self.streaming_node(state, config, writer, "study_procedures", study_procedures_query)]}
 
-    async def alt_procedures_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "alt_procedures", alt_procedures_query):
-            yield {"alt_procedures": [update["alt_procedures"]]}
+    async def alt_procedures_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"alt_procedures": [await self.streaming_node(state, config, writer, "alt_procedures", alt_procedures_query)]}
 
-    async def risks_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "risks", risks_query):
-            yield {"risks": [update["risks"]]}
+    async def risks_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"risks": [await self.streaming_node(state, config, writer, "risks", risks_query)]}
 
-    async def benefits_node(self, state: AgentState) -> AsyncGenerator[Dict, None]:
-        async for update in self.streaming_node(state, "benefits", benefits_query):
-            yield {"benefits": [update["benefits"]]}
+    async def benefits_node(self, state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict:
+        return {"benefits": [await self.streaming_node(state, config, writer, "benefits", benefits_query)]}
 
-    async def astream(self, config: Optional[RunnableConfig] = None):
+    async def astream(self, config: Optional[RunnableConfig] = None, max_pending_events: int = Config.STREAM_MAX_PENDING_EVENTS):
+        """
+        Run the graph, yielding ``(mode, chunk)`` pairs: section deltas as "custom"
+        chunks and each finished section as an "updates" chunk.
+
+        Events pass through a queue of at most ``max_pending_events``; when the
+        caller reads slowly the section nodes wait instead of buffering output.
+        """
         targets = {
             "summary": "",
             "background": "",
             "number_of_participants": "",
             "study_procedures": "",
-            "alternatives": "",
+            "alt_procedures": "",
             "risks": "",
             "benefits": ""
         }
-        async for update in self.compiled_graph.astream(targets, config, stream_mode="updates"):
-            yield update
\ No newline at end of file
+
+        async def run(config: RunnableConfig):
+            async for update in self.compiled_graph.astream(targets, config, stream_mode="updates"):
+                yield update
+
+        async for item in self._stream_events(run, config, max_pending_events):
+            yield item
+
+    async def astream_section(
+        self,
+        section: str,
+        config: Optional[RunnableConfig] = None,
+        draft: Optional[str] = None,
+        instructions: Optional[str] = None,
+        max_pending_events: int = Config.STREAM_MAX_PENDING_EVENTS,
+    ):
+        """
+        Run the node of one section alone, streaming like ``astream``.
+
+        Without ``instructions`` the section is generated again from scratch; with
+        them, ``draft`` is revised following the instructions. Either way the
+        section retrieves its own context, and only its LLM call is made.
+        """
+        node = f"{section}_node"
+        if section not in SECTION_QUERIES:
+            raise ValueError(f"Unknown section: {section}")
+        config = dict(config or {})
+        config["configurable"] = {
+            **config.get("configurable", {}),
+            "revision_instructions": instructions or None,
+            "revision_draft": draft,
+        }
+
+        async def run(config: RunnableConfig):
+            # Graph nodes are plain coroutines; deltas go to the delta sink, so no writer is needed
+            yield {node: await getattr(self, node)({}, config, None)}
+
+        async for item in self._stream_events(run, config, max_pending_events):
+            yield item
+
+    async def _stream_events(self, run, config: Optional[RunnableConfig], max_pending_events: int):
+        """ Drive ``run(config)``, yielding its deltas and updates through one bounded queue. """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending_events)
+        config = dict(config or {})
+        config["configurable"] = {
+            **config.get("configurable", {}),
+            "delta_sink": lambda event: queue.put(("custom", event)),
+        }
+
+        async def produce():
+            try:
+                async for update in run(config):
+                    await queue.put(("updates", update))
+            except Exception as e:
+                await queue.put(("error", e))
+            await queue.put(None)
+
+        task = asyncio.create_task(produce())
+        GENERATIONS_IN_FLIGHT.inc()
+        try:
+            while (item := await queue.get()) is not None:
+                if item[0] == "error":
+                    raise item[1]
+                yield item
+        finally:
+            GENERATIONS_IN_FLIGHT.dec()
+            task.cancel()
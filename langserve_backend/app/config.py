@@ -5,26 +5,89 @@ class Config:
     OPENAI_API_KEY = config('OPENAI_API_KEY')
     COLLECTION_NAME = config('COLLECTION_NAME')
     QDRANT_URL = config('QDRANT_URL')
+    # memory: throwaway in-process collection, local: embedded on-disk storage, server: QDRANT_URL
+    QDRANT_MODE = config('QDRANT_MODE', default='local')
+    QDRANT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), config('QDRANT_PATH', default='qdrant_data'))
+    # HNSW graph and search settings, tuned for searches filtered to a few protocols
+    QDRANT_HNSW_M = config('QDRANT_HNSW_M', default=16, cast=int)
+    QDRANT_HNSW_EF_CONSTRUCT = config('QDRANT_HNSW_EF_CONSTRUCT', default=128, cast=int)
+    QDRANT_HNSW_PAYLOAD_M = config('QDRANT_HNSW_PAYLOAD_M', default=16, cast=int)
+    QDRANT_FULL_SCAN_THRESHOLD_KB = config('QDRANT_FULL_SCAN_THRESHOLD_KB', default=10000, cast=int)
+    QDRANT_SEARCH_HNSW_EF = config('QDRANT_SEARCH_HNSW_EF', default=128, cast=int)
+    # none | scalar (int8) | binary; originals can move to disk and be read only for rescoring
+    QDRANT_QUANTIZATION = config('QDRANT_QUANTIZATION', default='none')
+    QDRANT_VECTORS_ON_DISK = config('QDRANT_VECTORS_ON_DISK', default=False, cast=bool)
+    QDRANT_OVERSAMPLING = config('QDRANT_OVERSAMPLING', default=2.0, cast=float)
+    QDRANT_RESCORE = config('QDRANT_RESCORE', default=True, cast=bool)
     OPENAI_MODEL_NAME = config('OPENAI_MODEL_NAME')
     OPENAI_EMBEDDING_MODEL_NAME = config('OPENAI_EMBEDDING_MODEL_NAME')
-    OPENAI_EMBEDDING_MODEL_DIMENSION = config('OPENAI_EMBEDDING_MODEL_DIMENSION')
+    OPENAI_EMBEDDING_MODEL_DIMENSION = config('OPENAI_EMBEDDING_MODEL_DIMENSION', cast=int)
     LANGCHAIN_PROJECT = config('LANGCHAIN_PROJECT')
     LANGCHAIN_TRACING_V2 = config('LANGCHAIN_TRACING_V2')
     LANGCHAIN_ENDPOINT = config('LANGCHAIN_ENDPOINT')    
     UPLOAD_FOLDER = f"{os.path.dirname(os.path.abspath(__file__))}/{config('UPLOAD_FOLDER')}"
     PROCESSED_FOLDER = f"{os.path.dirname(os.path.abspath(__file__))}/{config('PROCESSED_FOLDER')}"
     CACHE_DIR = f"{os.path.dirname(os.path.abspath(__file__))}/{config('CACHE_DIR')}"
+    # Legacy JSON status file, imported into STATUS_DB_FILE on first start
     DB_FILE = f"{os.path.dirname(os.path.abspath(__file__))}/{config('DB_FILE')}"
-    CHUNK_SIZE=config('CHUNK_SIZE')
-    CHUNK_OVERLAP=config('CHUNK_OVERLAP')
+    STATUS_DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), config('STATUS_DB_FILE', default='file_status.db'))
+    EMBEDDING_CACHE_MAX_MB = config('EMBEDDING_CACHE_MAX_MB', default=512, cast=int)
+    MAX_UPLOAD_FILE_MB = config('MAX_UPLOAD_FILE_MB', default=100, cast=int)
+    MAX_UPLOAD_REQUEST_MB = config('MAX_UPLOAD_REQUEST_MB', default=500, cast=int)
+    # Files ingested concurrently, processes used for PDF parsing/chunking, and retries per file
+    INGEST_WORKERS = config('INGEST_WORKERS', default=4, cast=int)
+    INGEST_PARSE_PROCESSES = config('INGEST_PARSE_PROCESSES', default=os.cpu_count() or 1, cast=int)
+    INGEST_MAX_RETRIES = config('INGEST_MAX_RETRIES', default=3, cast=int)
+    # A job whose status record has not been touched for this long is taken to be abandoned by its worker
+    INGEST_CLAIM_LEASE_SECONDS = config('INGEST_CLAIM_LEASE_SECONDS', default=120, cast=float)
+    # Pages parsed and chunked per step, and chunks embedded and upserted per request
+    INGEST_PAGE_WINDOW = config('INGEST_PAGE_WINDOW', default=16, cast=int)
+    EMBED_BATCH_SIZE = config('EMBED_BATCH_SIZE', default=64, cast=int)
+    # Embed-and-upsert batches of one document in flight at once
+    EMBED_CONCURRENCY = config('EMBED_CONCURRENCY', default=4, cast=int)
+    # Processes rendering consent-form PDFs, and rendered PDFs kept in memory
+    PDF_RENDER_PROCESSES = config('PDF_RENDER_PROCESSES', default=2, cast=int)
+    PDF_CACHE_MAX_ENTRIES = config('PDF_CACHE_MAX_ENTRIES', default=64, cast=int)
+    RETRIEVAL_CACHE_SIZE = config('RETRIEVAL_CACHE_SIZE', default=256, cast=int)
+    # Bounds how long other uvicorn workers can serve search results from before a re-ingestion
+    RETRIEVAL_CACHE_TTL_SECONDS = config('RETRIEVAL_CACHE_TTL_SECONDS', default=300, cast=float)
+    # Context packing: candidates retrieved per section, similarity cutoffs and prompt token budget
+    RAG_CANDIDATE_K = config('RAG_CANDIDATE_K', default=15, cast=int)
+    RAG_MIN_SCORE = config('RAG_MIN_SCORE', default=0.2, cast=float)
+    RAG_SCORE_MARGIN = config('RAG_SCORE_MARGIN', default=0.15, cast=float)
+    RAG_MIN_K = config('RAG_MIN_K', default=3, cast=int)
+    RAG_CONTEXT_TOKEN_BUDGET = config('RAG_CONTEXT_TOKEN_BUDGET', default=6000, cast=int)
+    # "per_section" or "shared" (one retrieval per form, sent as a cacheable prompt prefix)
+    RAG_CONTEXT_MODE = config('RAG_CONTEXT_MODE', default='per_section')
+    RAG_SHARED_CONTEXT_TOKEN_BUDGET = config('RAG_SHARED_CONTEXT_TOKEN_BUDGET', default=16000, cast=int)
+    RAG_CHAIN_CACHE_SIZE = config('RAG_CHAIN_CACHE_SIZE', default=32, cast=int)
+    # Seconds between full-text checkpoint events in the delta streaming protocol
+    STREAM_CHECKPOINT_SECONDS = config('STREAM_CHECKPOINT_SECONDS', default=5.0, cast=float)
+    # Token coalescing: a delta is sent after this many characters or milliseconds
+    STREAM_FLUSH_CHARS = config('STREAM_FLUSH_CHARS', default=256, cast=int)
+    STREAM_FLUSH_MS = config('STREAM_FLUSH_MS', default=50, cast=int)
+    # Unread tokens per section and events per request before generation is throttled
+    STREAM_MAX_PENDING_EVENTS = config('STREAM_MAX_PENDING_EVENTS', default=64, cast=int)
+    # Shared LLM scheduler: concurrent calls, per-minute budgets (0 = unlimited) and retries
+    LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=16, cast=int)
+    LLM_REQUESTS_PER_MINUTE = config('LLM_REQUESTS_PER_MINUTE', default=500, cast=int)
+    LLM_TOKENS_PER_MINUTE = config('LLM_TOKENS_PER_MINUTE', default=200000, cast=int)
+    LLM_OUTPUT_TOKENS_ESTIMATE = config('LLM_OUTPUT_TOKENS_ESTIMATE', default=1000, cast=int)
+    LLM_MAX_RETRIES = config('LLM_MAX_RETRIES', default=5, cast=int)
+    LLM_RETRY_BASE_SECONDS = config('LLM_RETRY_BASE_SECONDS', default=1.0, cast=float)
+    LLM_RETRY_MAX_SECONDS = config('LLM_RETRY_MAX_SECONDS', default=30.0, cast=float)
+    SECTION_CACHE_DB_FILE = os.path.join(CACHE_DIR, 'sections.db')
+    SECTION_CACHE_MAX_ENTRIES = config('SECTION_CACHE_MAX_ENTRIES', default=5000, cast=int)
+    # Generated forms and their versions, kept for export and review until FORM_TTL_HOURS after the last change
+    FORM_STORE_DB_FILE = os.path.join(CACHE_DIR, 'forms.db')
+    FORM_TTL_HOURS = config('FORM_TTL_HOURS', default=168, cast=float)
+    FORM_MAX_VERSIONS = config('FORM_MAX_VERSIONS', default=50, cast=int)
+    CHUNK_SIZE=config('CHUNK_SIZE', cast=int)
+    CHUNK_OVERLAP=config('CHUNK_OVERLAP', cast=int)
 
     @staticmethod
     def ensure_directories():
+        """ Create the upload, processed and cache folders; called on server startup. """
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(Config.PROCESSED_FOLDER, exist_ok=True)
         os.makedirs(Config.CACHE_DIR, exist_ok=True)
-
-# Ensure directories are created when the module is imported
-Config.ensure_directories()
-
-    
\ No newline at end of file
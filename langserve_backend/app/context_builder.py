@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from .config import Config
+from .pdf_loader_chunker import get_encoding
+
+# Separates packed passages in the prompt context
+PASSAGE_SEPARATOR = "\n\n---\n\n"
+
+
+@dataclass
+class Passage:
+    """ One or more adjacent chunks of a document, merged into a single run of text. """
+    document_title: str
+    first_chunk: int
+    last_chunk: int
+    text: str
+    score: float
+
+
+def overlap_length(previous: str, following: str, probe_chars: int = 64) -> int:
+    """
+    Return the length of the longest suffix of ``previous`` that is a prefix of ``following``.
+
+    Adjacent chunks share CHUNK_OVERLAP tokens of identical text, so the start of the
+    following chunk is looked up in the previous one and the match verified to its end.
+    """
+    probe = following[:probe_chars]
+    if not probe:
+        return 0
+    start = previous.find(probe, max(0, len(previous) - len(following) - probe_chars))
+    while start != -1:
+        tail = previous[start:]
+        if following.startswith(tail):
+            return len(tail)
+        start = previous.find(probe, start + 1)
+    return 0
+
+
+def merge_adjacent(documents: List[Document]) -> List[Passage]:
+    """ Merge chunks with consecutive ``chunk_index`` from the same document, dropping their overlap. """
+    keyed = sorted(
+        documents,
+        key=lambda doc: (doc.metadata.get("document_title", ""), doc.metadata.get("chunk_index", -1)),
+    )
+    passages: List[Passage] = []
+    for doc in keyed:
+        title = doc.metadata.get("document_title", "")
+        chunk_index = doc.metadata.get("chunk_index")
+        score = doc.metadata.get("score", 0.0)
+        last = passages[-1] if passages else None
+        if (
+            last is not None
+            and chunk_index is not None
+            and last.document_title == title
+            and chunk_index == last.last_chunk
+        ):
+            # The same chunk retrieved twice (e.g. under two filters)
+            last.score = max(last.score, score)
+            continue
+        if (
+            last is not None
+            and chunk_index is not None
+            and last.document_title == title
+            and chunk_index == last.last_chunk + 1
+        ):
+            overlap = overlap_length(last.text, doc.page_content)
+            # Chunks cut at a break share no text; keep them apart as the break did
+            last.text += doc.page_content[overlap:] if overlap else "\n" + doc.page_content
+            last.last_chunk = chunk_index
+            last.score = max(last.score, score)
+            continue
+        index = chunk_index if chunk_index is not None else -1
+        passages.append(Passage(title, index, index, doc.page_content, score))
+    return passages
+
+
+class ContextBuilder:
+    """
+    Turns retrieved chunks into a prompt context that fits a token budget.
+
+    Chunks scoring below ``min_score``, or more than ``score_margin`` below the best
+    chunk, are dropped, keeping at least ``min_k`` (adaptive k). Adjacent chunks of a
+    document are merged so their shared overlap is sent (and counted) once. Chunks
+    are packed best-first until ``token_budget`` tokens are used and written out in
+    document order. Retrievers that do not report scores keep every chunk.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = Config.RAG_CONTEXT_TOKEN_BUDGET,
+        min_score: float = Config.RAG_MIN_SCORE,
+        score_margin: float = Config.RAG_SCORE_MARGIN,
+        min_k: int = Config.RAG_MIN_K,
+        model_name: str = Config.OPENAI_MODEL_NAME,
+    ):
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.score_margin = score_margin
+        self.min_k = min_k
+        self.model_name = model_name
+
+    def settings(self) -> Dict[str, float]:
+        """ The settings that decide which chunks end up in a context. """
+        return {
+            "token_budget": self.token_budget,
+            "min_score": self.min_score,
+            "score_margin": self.score_margin,
+            "min_k": self.min_k,
+        }
+
+    def select(self, documents: List[Document]) -> List[Document]:
+        """ Apply the score cutoff and adaptive k, best first. """
+        if not documents or any("score" not in doc.metadata for doc in documents):
+            return list(documents)
+        ranked = sorted(documents, key=lambda doc: doc.metadata["score"], reverse=True)
+        cutoff = max(self.min_score, ranked[0].metadata["score"] - self.score_margin)
+        kept = [doc for doc in ranked if doc.metadata["score"] >= cutoff]
+        return kept if len(kept) >= self.min_k else ranked[:self.min_k]
+
+    def pack(self, documents: List[Document], token_budget: Optional[int] = None) -> List[Passage]:
+        """
+        Choose chunks best-first within the token budget and merge them into passages.
+
+        A chunk next to one already chosen only costs the tokens it does not share
+        with it. Returns the passages in document order.
+        """
+        budget = self.token_budget if token_budget is None else token_budget
+        encoding = get_encoding(self.model_name)
+        separator_tokens = len(encoding.encode(PASSAGE_SEPARATOR))
+        chosen: Dict[Tuple[str, int], Document] = {}
+        used = 0
+        for position, doc in enumerate(documents):
+            title = doc.metadata.get("document_title", "")
+            chunk_index = doc.metadata.get("chunk_index", -1 - position)
+            if (title, chunk_index) in chosen:
+                continue
+            cost = len(encoding.encode(doc.page_content, disallowed_special=())) + separator_tokens
+            previous = chosen.get((title, chunk_index - 1))
+            following = chosen.get((title, chunk_index + 1))
+            for left, right in ((previous, doc), (doc, following)):
+                if left is not None and right is not None:
+                    shared = overlap_length(left.page_content, right.page_content)
+                    shared_text = right.page_content[:shared]
+                    cost -= len(encoding.encode(shared_text, disallowed_special=())) + separator_tokens
+            if used + cost <= budget:
+                chosen[(title, chunk_index)] = doc
+                used += cost
+            elif not chosen:
+                # Even the best chunk is over budget; send as much of it as fits
+                tokens = encoding.encode(doc.page_content, disallowed_special=())
+                chosen[(title, chunk_index)] = Document(
+                    page_content=encoding.decode(tokens[:budget]), metadata=doc.metadata
+                )
+                used = budget
+        return merge_adjacent(list(chosen.values()))
+
+    def build(self, documents: List[Document]) -> str:
+        passages = self.pack(self.select(documents))
+        return PASSAGE_SEPARATOR.join(passage.text for passage in passages)
@@ -0,0 +1,177 @@
+import os
+import asyncio
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed, size-bounded on-disk cache in front of an embedding model.
+
+    Document vectors are stored as float32 files under
+    ``<cache_dir>/embeddings/<model_name>/`` keyed by the SHA-256 of the chunk text,
+    so re-uploading a protocol (or an amendment sharing most of its text) only
+    sends the chunks that have never been embedded to the underlying model. The
+    least recently used entries are evicted once the cache grows past ``max_bytes``.
+
+    Query vectors are served from the same store. Queries that are known up front
+    (the consent-form section prompts) can be embedded in one batch with
+    ``precompute_queries`` and are then pinned in memory, so retrieval for them
+    never waits on the embedding API. Because keys are derived from the model name
+    and the exact text, editing a prompt or switching models simply misses the
+    cache and the new vector is computed on demand.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache_dir: str, max_bytes: int):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.cache_dir = os.path.join(cache_dir, "embeddings", model_name.replace("/", "_"))
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._pinned_queries: Dict[str, List[float]] = {}
+        self._load_index()
+
+    def _load_index(self):
+        """ Rebuild the LRU order from the files on disk, oldest access first. """
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".bin"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        logging.info(f"Embedding cache for {self.model_name}: {len(self._entries)} entries, {self._total_bytes} bytes")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _read(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                vector = array("f")
+                vector.frombytes(f.read())
+            # Touch the file so the LRU order survives a restart
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+        return vector.tolist()
+
+    def _write(self, key: str, vector: List[float]):
+        data = array("f", vector).tobytes()
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def _evict(self):
+        """ Drop least recently used entries until the cache fits in max_bytes. Caller holds the lock. """
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _lookup(self, texts: List[str]):
+        """ Split texts into cached vectors and the unique texts that still need embedding. """
+        vectors: Dict[str, List[float]] = {}
+        missing: List[str] = []
+        missing_keys = set()
+        for text in texts:
+            key = self._key(text)
+            if key in vectors or key in missing_keys:
+                continue
+            vector = self._read(key)
+            if vector is None:
+                missing.append(text)
+                missing_keys.add(key)
+            else:
+                vectors[key] = vector
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return vectors, missing
+
+    def _store(self, vectors: Dict[str, List[float]], texts: List[str], embedded: List[List[float]]):
+        for text, vector in zip(texts, embedded):
+            key = self._key(text)
+            vectors[key] = vector
+            self._write(key, vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._lookup(texts)
+        if missing:
+            self._store(vectors, missing, self.underlying.embed_documents(missing))
+        return [vectors[self._key(text)] for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # One file per vector is read and written; that I/O runs in a thread, off the event loop
+        vectors, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            embedded = await self.underlying.aembed_documents(missing)
+            await asyncio.to_thread(self._store, vectors, missing, embedded)
+        return [vectors[self._key(text)] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        if key in self._pinned_queries:
+            with self._lock:
+                self.hits += 1
+            return self._pinned_queries[key]
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        if key in self._pinned_queries:
+            with self._lock:
+                self.hits += 1
+            return self._pinned_queries[key]
+        return (await self.aembed_documents([text]))[0]
+
+    def precompute_queries(self, texts: List[str]):
+        """ Embed the given queries in a single batch and pin their vectors in memory. """
+        for text, vector in zip(texts, self.embed_documents(texts)):
+            self._pinned_queries[self._key(text)] = vector
+
+    async def aprecompute_queries(self, texts: List[str]):
+        for text, vector in zip(texts, await self.aembed_documents(texts)):
+            self._pinned_queries[self._key(text)] = vector
+
+    def stats(self) -> Dict[str, int]:
+        """ Return hit/miss counters and the current size of the cache. """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "pinned_queries": len(self._pinned_queries),
+                "bytes": self._total_bytes,
+            }
@@ -1,24 +1,261 @@
 import os
 import json
-from threading import Lock
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from fastapi import UploadFile
 from .config import Config
 
+# Ingestion job states, in the order a file moves through them
+QUEUED = 'queued'
+PARSING = 'parsing'
+EMBEDDING = 'embedding'
+INDEXED = 'indexed'
+FAILED = 'failed'
+IN_PROGRESS_STATES = (QUEUED, PARSING, EMBEDDING)
+# States in which a worker is processing the file and keeps its record fresh
+ACTIVE_STATES = (PARSING, EMBEDDING)
+
+# Uploads are copied to disk in pieces of this size
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+class UploadTooLarge(Exception):
+    """ Raised when an upload exceeds the configured per-file or per-request size limit. """
+
+# Columns of the files table besides the filename primary key
+COLUMNS = (
+    'status',
+    'content_hash',
+    'size_bytes',
+    'page_count',
+    'pages_processed',
+    'chunk_count',
+    'chunks_indexed',
+    'progress',
+    'chunks_per_second',
+    'attempts',
+    'error',
+    'parse_seconds',
+    'embed_seconds',
+    'created_at',
+    'updated_at',
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued',
+    content_hash TEXT,
+    size_bytes INTEGER,
+    page_count INTEGER,
+    pages_processed INTEGER,
+    chunk_count INTEGER,
+    chunks_indexed INTEGER,
+    progress REAL,
+    chunks_per_second REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    parse_seconds REAL,
+    embed_seconds REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_content_hash ON files (content_hash);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+"""
+
+# Columns added after the first release, created on databases that predate them
+ADDED_COLUMNS = {
+    'chunks_indexed': 'INTEGER',
+    'progress': 'REAL',
+    'chunks_per_second': 'REAL',
+}
+
 class FileHandler():
-    def __init__(self):
-        # Lock for thread-safe file access
-        self.file_status_lock = Lock()
-        self.DB_FILE = Config.DB_FILE
-
-    def load_file_status(self):
-        with self.file_status_lock:
-            if os.path.exists(self.DB_FILE):
-                with open(self.DB_FILE, 'r') as f:
-                    file_status = json.load(f)
-            else:
-                file_status = {}
-        return file_status
-
-    def save_file_status(self, file_status):
-        with self.file_status_lock:
-            with open(self.DB_FILE, 'w') as f:
-                json.dump(file_status, f)
\ No newline at end of file
+    """
+    Row-per-file status store backed by SQLite in WAL mode.
+
+    Every update is a single UPSERT transaction, so concurrent ingestion jobs and
+    several uvicorn workers can update different files without losing each
+    other's changes. A legacy JSON status file (DB_FILE) is imported on first use.
+    """
+
+    def __init__(self, db_path: str = Config.STATUS_DB_FILE, legacy_json_path: str = Config.DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+            existing = {row['name'] for row in connection.execute('PRAGMA table_info(files)')}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    connection.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+        self._import_legacy_json(legacy_json_path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return this thread's connection, opening it on first use. """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _import_legacy_json(self, json_path: str):
+        if not os.path.exists(json_path):
+            return
+        with self._connection() as connection:
+            if connection.execute('SELECT 1 FROM files LIMIT 1').fetchone():
+                return
+        with open(json_path, 'r') as f:
+            records = json.load(f)
+        for filename, record in records.items():
+            # The first JSON format stored a bare status string per file
+            if not isinstance(record, dict):
+                if record == 'processed':
+                    record = {'status': INDEXED}
+                elif record == 'processing':
+                    record = {'status': QUEUED}
+                else:
+                    record = {'status': FAILED, 'error': str(record)}
+            self.update_file(filename, **{k: v for k, v in record.items() if k in COLUMNS})
+        os.replace(json_path, f"{json_path}.migrated")
+
+    def _record(self, row: sqlite3.Row) -> dict:
+        return {key: row[key] for key in COLUMNS if row[key] is not None}
+
+    def load_file_status(self) -> Dict[str, str]:
+        """ Return the status of every tracked file, keyed by filename. """
+        rows = self._connection().execute('SELECT filename, status FROM files ORDER BY filename')
+        return {row['filename']: row['status'] for row in rows}
+
+    def list_files(self) -> Dict[str, dict]:
+        """ Return the full status record of every tracked file, keyed by filename. """
+        rows = self._connection().execute('SELECT * FROM files ORDER BY filename')
+        return {row['filename']: self._record(row) for row in rows}
+
+    def get_file(self, filename: str) -> Optional[dict]:
+        row = self._connection().execute('SELECT * FROM files WHERE filename = ?', (filename,)).fetchone()
+        return self._record(row) if row else None
+
+    def update_file(self, filename: str, **fields) -> dict:
+        """ Atomically merge fields into a file's status record, creating it if needed. """
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown file status fields: {sorted(unknown)}")
+        now = time.time()
+        created_at = fields.pop('created_at', now)
+        fields['updated_at'] = now
+        columns = list(fields)
+        assignments = ', '.join(f"{column} = excluded.{column}" for column in columns)
+        with self._connection() as connection:
+            connection.execute(
+                f"INSERT INTO files (filename, created_at, {', '.join(columns)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in columns)}) "
+                f"ON CONFLICT (filename) DO UPDATE SET {assignments}",
+                (filename, created_at, *fields.values()),
+            )
+        return self.get_file(filename)
+
+    def claim_file(
+        self, filename: str, status: str, from_states: Tuple[str, ...], stale_before: float = 0.0, **fields
+    ) -> bool:
+        """
+        Atomically move a file to ``status`` if it is in one of ``from_states``.
+
+        A file in an active state whose record was last updated before ``stale_before``
+        can be claimed as well: the worker that held it has stopped. A file without a
+        record is created. Returns whether this caller got the file, so of several
+        workers (or processes) trying to claim the same job only one proceeds.
+        """
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown file status fields: {sorted(unknown)}")
+        now = time.time()
+        fields = {'status': status, **fields, 'updated_at': now}
+        columns = list(fields)
+        assignments = ', '.join(f"{column} = excluded.{column}" for column in columns)
+        with self._connection() as connection:
+            cursor = connection.execute(
+                f"INSERT INTO files (filename, created_at, {', '.join(columns)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in columns)}) "
+                f"ON CONFLICT (filename) DO UPDATE SET {assignments} "
+                f"WHERE files.status IN ({', '.join('?' for _ in from_states)}) "
+                f"OR (files.status IN ({', '.join('?' for _ in ACTIVE_STATES)}) AND files.updated_at < ?)",
+                (filename, now, *fields.values(), *from_states, *ACTIVE_STATES, stale_before),
+            )
+            return cursor.rowcount == 1
+
+    def find_by_hash(self, content_hash: str) -> Optional[Tuple[str, dict]]:
+        """ Return the (filename, record) of an indexed or in-progress file with the given content hash, if any. """
+        states = (INDEXED, *IN_PROGRESS_STATES)
+        row = self._connection().execute(
+            f"SELECT * FROM files WHERE content_hash = ? AND status IN ({', '.join('?' for _ in states)}) "
+            f"ORDER BY status = ? DESC LIMIT 1",
+            (content_hash, *states, INDEXED),
+        ).fetchone()
+        return (row['filename'], self._record(row)) if row else None
+
+    def get_content_hashes(self, filenames: List[str]) -> Optional[List[str]]:
+        """
+        Return the content hash of every given file, or None if any of them is unknown.
+
+        Files recorded before hashes were stored are hashed from the upload folder once.
+        """
+        hashes = []
+        for filename in filenames:
+            record = self.get_file(filename) or {}
+            content_hash = record.get('content_hash')
+            if content_hash is None:
+                file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
+                if not os.path.exists(file_path):
+                    return None
+                digest = hashlib.sha256()
+                with open(file_path, 'rb') as f:
+                    while chunk := f.read(UPLOAD_CHUNK_BYTES):
+                        digest.update(chunk)
+                content_hash = digest.hexdigest()
+                self.update_file(filename, content_hash=content_hash)
+            hashes.append(content_hash)
+        return hashes
+
+    async def save_upload(self, upload: UploadFile, max_bytes: int) -> Tuple[str, str, int]:
+        """
+        Stream an upload to a temporary file next to its final path in the upload folder.
+
+        The file is read in UPLOAD_CHUNK_BYTES pieces, hashed with SHA-256 and written
+        off the event loop as the bytes arrive. Raises UploadTooLarge as soon as more
+        than max_bytes have been read.
+
+        Returns:
+            Tuple[str, str, int]: Temporary file path, hex content hash and size in bytes.
+        """
+        file_path = os.path.join(Config.UPLOAD_FOLDER, os.path.basename(upload.filename))
+        # Unique, so uploads of the same filename in one or several requests do not share it
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+
+        def write_chunk(buffer, chunk: bytes):
+            digest.update(chunk)
+            buffer.write(chunk)
+
+        buffer = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"{upload.filename} exceeds the upload size limit of {max_bytes} bytes")
+                await asyncio.to_thread(write_chunk, buffer, chunk)
+        except BaseException:
+            await asyncio.to_thread(buffer.close)
+            os.remove(tmp_path)
+            raise
+        await asyncio.to_thread(buffer.close)
+        return tmp_path, digest.hexdigest(), size
+
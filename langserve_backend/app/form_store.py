@@ -0,0 +1,130 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from .config import Config
+from .pdf_renderer import content_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS form_versions (
+    form_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    sections TEXT NOT NULL,
+    content_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    files TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (form_id, version)
+);
+CREATE INDEX IF NOT EXISTS form_versions_expires_at ON form_versions (expires_at);
+"""
+
+
+class FormStore:
+    """
+    Generated consent forms, kept server-side so they can be fetched and exported by ID.
+
+    Every change (generation, reviewer edit, revision) adds an immutable version; a
+    form's versions share one expiry, ``ttl_seconds`` after its latest version, and
+    expired forms are deleted on the next write. Beyond ``max_versions`` the oldest
+    versions of a form are dropped. Stored in SQLite (WAL mode) under CACHE_DIR so
+    forms survive restarts and are shared between uvicorn workers.
+    """
+
+    def __init__(
+        self,
+        db_path: str = Config.FORM_STORE_DB_FILE,
+        ttl_seconds: float = Config.FORM_TTL_HOURS * 3600,
+        max_versions: int = Config.FORM_MAX_VERSIONS,
+    ):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_versions = max_versions
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return this thread's connection, opening it on first use. """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def new_form_id() -> str:
+        return uuid.uuid4().hex
+
+    def add_version(
+        self,
+        form_id: str,
+        sections: Dict[str, str],
+        source: str,
+        files: Optional[List[str]] = None,
+    ) -> dict:
+        """
+        Store ``sections`` as the next version of a form, creating the form if needed.
+
+        ``source`` records what produced the version ("generated", "edited" or
+        "revised"); ``files`` defaults to the source documents of the previous version.
+        """
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._connection() as connection:
+            connection.execute('DELETE FROM form_versions WHERE expires_at < ?', (now,))
+            latest = connection.execute(
+                'SELECT version, files FROM form_versions WHERE form_id = ? ORDER BY version DESC LIMIT 1',
+                (form_id,),
+            ).fetchone()
+            version = latest['version'] + 1 if latest else 1
+            if files is None:
+                files = json.loads(latest['files']) if latest else []
+            connection.execute(
+                'INSERT INTO form_versions (form_id, version, sections, content_key, source, files, created_at, expires_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (form_id, version, json.dumps(sections), content_key(sections), source, json.dumps(files), now, expires_at),
+            )
+            connection.execute('UPDATE form_versions SET expires_at = ? WHERE form_id = ?', (expires_at, form_id))
+            connection.execute(
+                'DELETE FROM form_versions WHERE form_id = ? AND version <= ?',
+                (form_id, version - self.max_versions),
+            )
+        return self.get(form_id, version)
+
+    def get(self, form_id: str, version: Optional[int] = None) -> Optional[dict]:
+        """ Return a version of a form (the latest by default), or None if unknown or expired. """
+        query = 'SELECT * FROM form_versions WHERE form_id = ? AND expires_at >= ?'
+        params = [form_id, time.time()]
+        if version is not None:
+            query += ' AND version = ?'
+            params.append(version)
+        row = self._connection().execute(query + ' ORDER BY version DESC LIMIT 1', params).fetchone()
+        if row is None:
+            return None
+        return {
+            'form_id': row['form_id'],
+            'version': row['version'],
+            'sections': json.loads(row['sections']),
+            'content_key': row['content_key'],
+            'source': row['source'],
+            'files': json.loads(row['files']),
+            'created_at': row['created_at'],
+            'expires_at': row['expires_at'],
+        }
+
+    def versions(self, form_id: str) -> List[dict]:
+        """ Return the version number, source and creation time of every stored version of a form. """
+        rows = self._connection().execute(
+            'SELECT version, source, created_at FROM form_versions WHERE form_id = ? AND expires_at >= ? '
+            'ORDER BY version',
+            (form_id, time.time()),
+        )
+        return [dict(row) for row in rows]
@@ -0,0 +1,379 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, List, Optional, Set
+
+from langchain_core.documents import Document
+
+from .config import Config
+from .filehandler import (
+    FileHandler,
+    QUEUED,
+    PARSING,
+    EMBEDDING,
+    INDEXED,
+    FAILED,
+    IN_PROGRESS_STATES,
+    ACTIVE_STATES,
+)
+from .metrics import INGESTED_CHUNKS, INGESTION_JOBS, INGESTION_QUEUE_DEPTH, STAGE_SECONDS
+from .pdf_loader_chunker import (
+    ChunkStreamState,
+    chunk_pdf_pages,
+    pdf_page_count,
+)
+from .qdrant_retriever import QdrantRetrieverClient
+
+logger = logging.getLogger(__name__)
+
+
+class BatchIndexer:
+    """
+    Embeds and upserts the chunks of one document in batches of ``batch_size``,
+    with up to ``concurrency`` batches in flight.
+
+    Chunks passed to ``add`` are collected into full batches across calls, and
+    ``add`` returns as soon as those are started, waiting only while the limit is
+    reached, so the caller can prepare more chunks meanwhile. Batches are upserted
+    without waiting for Qdrant to apply them, except the last one, which ``finish``
+    upserts with ``wait=True`` after the others: once it returns, every point of
+    the document is searchable. A failed batch is raised from the next ``add`` or
+    from ``finish``.
+    """
+
+    def __init__(
+        self,
+        retriever_client: QdrantRetrieverClient,
+        batch_size: int = Config.EMBED_BATCH_SIZE,
+        concurrency: int = Config.EMBED_CONCURRENCY,
+        on_batch_indexed: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.retriever_client = retriever_client
+        self.batch_size = batch_size
+        self.on_batch_indexed = on_batch_indexed
+        self.in_flight = asyncio.Semaphore(concurrency)
+        self.tasks: List[asyncio.Task] = []
+        self.pending: List[Document] = []
+        self.indexed = 0
+        self.embed_seconds = 0.0
+
+    async def add(self, docs: List[Document]):
+        self.pending.extend(docs)
+        # Keep the tail back, so the final batch is never empty
+        while len(self.pending) > self.batch_size:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            await self.in_flight.acquire()
+            self._raise_failed()
+            self.tasks.append(asyncio.create_task(self._index(batch)))
+        self._raise_failed()
+
+    async def finish(self):
+        """ Wait for every batch, then upsert the remaining chunks as the consistency barrier. """
+        await asyncio.gather(*self.tasks)
+        if self.pending:
+            await self.in_flight.acquire()
+            batch, self.pending = self.pending, []
+            await self._index(batch, wait=True)
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def _index(self, batch: List[Document], wait: bool = False):
+        started = time.perf_counter()
+        try:
+            await self.retriever_client.aupsert_documents(batch, wait=wait)
+        finally:
+            self.in_flight.release()
+        self.embed_seconds += time.perf_counter() - started
+        self.indexed += len(batch)
+        INGESTED_CHUNKS.inc(len(batch))
+        if self.on_batch_indexed:
+            await self.on_batch_indexed()
+
+    def _raise_failed(self):
+        for task in self.tasks:
+            if task.done() and not task.cancelled() and task.exception():
+                raise task.exception()
+
+
+class IngestionQueue:
+    """
+    Bounded ingestion pipeline for uploaded PDFs.
+
+    Jobs are persisted as file status records, so anything still queued, parsing or
+    embedding when the backend stops is picked up again on the next start. PDF
+    parsing and chunking run in a process pool so they use every core without
+    holding the GIL of the serving process; embedding and upsert run as async
+    tasks on the event loop. At most ``workers`` files are ingested at once and a
+    failed job is retried with exponential backoff up to ``max_retries`` times.
+
+    Each document is streamed through the pipeline ``page_window`` pages at a time:
+    pages are parsed and chunked, and the finished chunks are embedded and upserted
+    in batches of ``embed_batch_size`` by a BatchIndexer, up to ``embed_concurrency``
+    batches at once while the next window is parsed. Memory is bounded by the window
+    and the batches in flight, and the first chunks are searchable before the last
+    page has been parsed. Progress (fraction complete, chunks/s) is recorded on the
+    file's status record as batches finish.
+
+    Several uvicorn workers each run a queue over the same status database, so a
+    worker claims a job atomically (``FileHandler.claim_file``) before running it
+    and only one of them ingests a file. While a job runs its record is touched
+    every quarter of ``claim_lease_seconds``; a job whose record is older than the
+    lease was abandoned by a stopped worker and can be claimed again.
+    """
+
+    def __init__(
+        self,
+        file_handler: FileHandler,
+        retriever_client: QdrantRetrieverClient,
+        workers: int = Config.INGEST_WORKERS,
+        parse_processes: int = Config.INGEST_PARSE_PROCESSES,
+        max_retries: int = Config.INGEST_MAX_RETRIES,
+        page_window: int = Config.INGEST_PAGE_WINDOW,
+        embed_batch_size: int = Config.EMBED_BATCH_SIZE,
+        embed_concurrency: int = Config.EMBED_CONCURRENCY,
+        claim_lease_seconds: float = Config.INGEST_CLAIM_LEASE_SECONDS,
+    ):
+        self.file_handler = file_handler
+        self.retriever_client = retriever_client
+        self.workers = workers
+        self.parse_processes = parse_processes
+        self.max_retries = max_retries
+        self.page_window = page_window
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.claim_lease_seconds = claim_lease_seconds
+        self.queue: Optional[asyncio.Queue] = None
+        self.process_pool: Optional[ProcessPoolExecutor] = None
+        self.worker_tasks: List[asyncio.Task] = []
+        # Delayed requeues (retries and lease checks), kept so they are not garbage-collected
+        self.requeue_tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """ Start the worker pool and resume any jobs left over from a previous run. """
+        self.queue = asyncio.Queue()
+        self.process_pool = self._create_process_pool()
+        self.worker_tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        INGESTION_QUEUE_DEPTH.set_function(self.queue_depth)
+        logger.info(f"Ingestion started with {self.workers} workers and {self.parse_processes} parse processes")
+        await self.reconcile()
+
+    def _create_process_pool(self) -> ProcessPoolExecutor:
+        # Spawned workers do not inherit the server's threads, locks or Qdrant client
+        return ProcessPoolExecutor(
+            max_workers=self.parse_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def stop(self):
+        tasks = [*self.worker_tasks, *self.requeue_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.worker_tasks = []
+        self.requeue_tasks.clear()
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+
+    async def enqueue(self, filename: str, source_path: Optional[str] = None, **fields) -> bool:
+        """
+        Queue an uploaded file for ingestion, recording any extra fields (e.g. content hash).
+
+        ``source_path`` is moved to the file's place in the upload folder once the job
+        is claimed, so a file that is being ingested is never replaced under its job.
+        Returns False, leaving ``source_path`` in place, if a file with the same name
+        is being ingested.
+        """
+        claimed = await asyncio.to_thread(
+            self.file_handler.claim_file, filename, QUEUED, (QUEUED, INDEXED, FAILED),
+            stale_before=time.time() - self.claim_lease_seconds, attempts=0, error=None, **fields
+        )
+        if not claimed:
+            return False
+        if source_path:
+            await asyncio.to_thread(os.replace, source_path, os.path.join(Config.UPLOAD_FOLDER, filename))
+        await self.queue.put(filename)
+        return True
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    async def reconcile(self):
+        """
+        Align the status records with the documents actually present in the collection.
+
+        Documents found in the collection are marked indexed. Files whose job was
+        interrupted, or that are marked indexed but have no points (e.g. the
+        collection was recreated), are queued again from the upload folder. Files
+        indexed with no chunks (no extractable text) are left as they are.
+
+        Runs at startup, so a job left parsing or embedding was held by the stopped
+        server; it is reset to queued and resumes at once rather than after its lease.
+        """
+        records = await asyncio.to_thread(self.file_handler.list_files)
+        indexed_titles = await asyncio.to_thread(self.retriever_client.get_indexed_document_titles)
+        logger.info(f"Reconciling {len(records)} tracked files with {len(indexed_titles)} indexed documents")
+
+        for filename, record in records.items():
+            status = record['status']
+            if status == INDEXED and (filename in indexed_titles or record.get('chunk_count') == 0):
+                continue
+            if status in IN_PROGRESS_STATES or status == INDEXED:
+                if os.path.exists(os.path.join(Config.UPLOAD_FOLDER, filename)):
+                    logger.info(f"Resuming ingestion of {filename} (was {status})")
+                    if status != QUEUED:
+                        await asyncio.to_thread(self.file_handler.update_file, filename, status=QUEUED)
+                    await self.queue.put(filename)
+                else:
+                    await asyncio.to_thread(
+                        self.file_handler.update_file,
+                        filename, status=FAILED, error='not indexed and uploaded file is missing',
+                    )
+        for title in indexed_titles:
+            if title not in records:
+                await asyncio.to_thread(self.file_handler.update_file, title, status=INDEXED)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            filename = await self.queue.get()
+            try:
+                if await self._claim(filename):
+                    await self._run_job(filename)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._handle_failure(filename, e)
+            finally:
+                self.queue.task_done()
+
+    async def _claim(self, filename: str) -> bool:
+        """ Take a queued job for this worker; False if another worker has it or it is no longer queued. """
+        claimed = await asyncio.to_thread(
+            self.file_handler.claim_file, filename, PARSING, (QUEUED,),
+            stale_before=time.time() - self.claim_lease_seconds, progress=0.0, chunks_indexed=0,
+        )
+        if claimed:
+            return True
+        record = await asyncio.to_thread(self.file_handler.get_file, filename) or {}
+        if record.get('status') in ACTIVE_STATES:
+            # Held by another worker, or by one that stopped: look again once its lease can have expired
+            self._requeue_later(filename, self.claim_lease_seconds)
+        return False
+
+    def _requeue_later(self, filename: str, delay: float):
+        async def requeue():
+            await asyncio.sleep(delay)
+            await self.queue.put(filename)
+
+        task = asyncio.create_task(requeue())
+        self.requeue_tasks.add(task)
+        task.add_done_callback(self.requeue_tasks.discard)
+
+    async def _keep_claim(self, filename: str):
+        """ Touch the record of a running job so other workers do not take it as abandoned. """
+        while True:
+            await asyncio.sleep(self.claim_lease_seconds / 4)
+            await asyncio.to_thread(self.file_handler.update_file, filename)
+
+    async def _run_job(self, filename: str):
+        heartbeat = asyncio.create_task(self._keep_claim(filename))
+        try:
+            await self._ingest(filename)
+        finally:
+            heartbeat.cancel()
+
+    async def _ingest(self, filename: str):
+        file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
+        loop = asyncio.get_running_loop()
+
+        page_count = await loop.run_in_executor(self.process_pool, pdf_page_count, file_path)
+        record = await asyncio.to_thread(self.file_handler.update_file, filename, page_count=page_count)
+        # Re-uploads replace the previous points; unchanged chunks come from the embedding cache
+        await asyncio.to_thread(self.retriever_client.delete_document, filename)
+
+        state = ChunkStreamState(document_title=filename, content_hash=record.get('content_hash'))
+        job_started = time.perf_counter()
+        progress = {'chunks': 0, 'pages': 0, 'parse_seconds': 0.0}
+
+        async def report(**fields):
+            chunks, indexed = progress['chunks'], indexer.indexed
+            # Pages parsed so far, scaled by the share of their chunks already upserted
+            fraction = progress['pages'] / page_count if page_count else 1.0
+            if chunks:
+                fraction *= indexed / chunks
+            await asyncio.to_thread(self.file_handler.update_file, filename, **{
+                'chunk_count': chunks,
+                'chunks_indexed': indexed,
+                'pages_processed': progress['pages'],
+                'progress': round(fraction, 4),
+                'chunks_per_second': round(indexed / max(time.perf_counter() - job_started, 1e-6), 2),
+                'parse_seconds': progress['parse_seconds'],
+                'embed_seconds': indexer.embed_seconds,
+                **fields,
+            })
+
+        indexer = BatchIndexer(
+            self.retriever_client, self.embed_batch_size, self.embed_concurrency, on_batch_indexed=report
+        )
+        try:
+            for start_page in range(0, page_count, self.page_window):
+                end_page = min(start_page + self.page_window, page_count)
+                started = time.perf_counter()
+                load_seconds, chunk_seconds = state.load_seconds, state.chunk_seconds
+                docs, state = await loop.run_in_executor(
+                    self.process_pool, chunk_pdf_pages, file_path, start_page, end_page, state, end_page == page_count
+                )
+                progress['parse_seconds'] += time.perf_counter() - started
+                STAGE_SECONDS.observe(state.load_seconds - load_seconds, stage="pdf_load")
+                STAGE_SECONDS.observe(state.chunk_seconds - chunk_seconds, stage="chunk")
+                progress['chunks'] += len(docs)
+                progress['pages'] = end_page
+                await report(status=EMBEDDING)
+                # Returns once full batches are in flight; they are embedded while the next window is parsed
+                await indexer.add(docs)
+            await indexer.finish()
+        finally:
+            indexer.cancel()
+
+        # Searches that ran while the document was partially indexed may have been cached
+        self.retriever_client.invalidate_document(filename)
+        await report(status=INDEXED, error=None, progress=1.0)
+        INGESTION_JOBS.inc(outcome="indexed")
+        logger.info(f"Indexed {filename}: {page_count} pages, {progress['chunks']} chunks in "
+                    f"{time.perf_counter() - job_started:.1f}s. Embedding cache stats: "
+                    f"{self.retriever_client.embebedding_model.stats()}")
+
+    async def _handle_failure(self, filename: str, error: Exception):
+        if isinstance(error, BrokenProcessPool):
+            # A parse process died (e.g. out of memory); later jobs need a fresh pool
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = self._create_process_pool()
+
+        record = await asyncio.to_thread(self.file_handler.get_file, filename) or {}
+        attempts = record.get('attempts', 0) + 1
+        if attempts > self.max_retries:
+            logger.error(f"Ingestion of {filename} failed after {attempts} attempts: {error}")
+            await asyncio.to_thread(
+                self.file_handler.update_file, filename, status=FAILED, attempts=attempts, error=str(error)
+            )
+            INGESTION_JOBS.inc(outcome="failed")
+            # Chunks upserted before the failure would otherwise stay searchable
+            try:
+                await asyncio.to_thread(self.retriever_client.delete_document, filename)
+            except Exception as e:
+                logger.error(f"Could not remove the partial points of {filename}: {e}")
+            return
+
+        delay = 2 ** attempts
+        logger.warning(f"Ingestion of {filename} failed (attempt {attempts}), retrying in {delay}s: {error}")
+        await asyncio.to_thread(
+            self.file_handler.update_file, filename, status=QUEUED, attempts=attempts, error=str(error)
+        )
+        INGESTION_JOBS.inc(outcome="retry")
+        self._requeue_later(filename, delay)
@@ -0,0 +1,316 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import openai
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from .config import Config
+from .pdf_loader_chunker import get_encoding
+from .metrics import LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Scheduling classes, most urgent first; chosen per run with configurable["llm_priority"]
+PRIORITIES = {"interactive": 0, "batch": 1}
+DEFAULT_PRIORITY = "interactive"
+
+# Errors worth retrying when the provider is rate limiting or briefly unavailable
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """ Continuously refilled per-minute budget; a limit of 0 means unlimited. """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: int, now: float) -> float:
+        """ Seconds until ``amount`` can be taken; requests larger than the budget wait for a full bucket. """
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: int, now: float):
+        if self.capacity > 0:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: int):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass(order=True)
+class _Waiter:
+    sort_key: tuple
+    future: asyncio.Future = field(compare=False)
+    tokens: int = field(compare=False)
+    priority: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control for chat model calls.
+
+    At most ``max_concurrency`` calls run at once and admissions stay within the
+    ``requests_per_minute`` and ``tokens_per_minute`` budgets (0 disables a limit).
+    Token usage is estimated from the prompt plus ``output_tokens_estimate`` on
+    admission and corrected with the actual output when the call finishes.
+
+    Waiting calls are ordered by priority ("interactive" before "batch"), then
+    round-robin across requests: the n-th call of every request is admitted
+    before any request's (n+1)-th, so one consent form's seven sections cannot
+    starve another's. A call that fails with a rate-limit or server error before
+    producing any output is retried with full-jitter exponential backoff, and a
+    429 pauses all admissions for the backoff delay.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = Config.LLM_MAX_CONCURRENCY,
+        requests_per_minute: int = Config.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = Config.LLM_TOKENS_PER_MINUTE,
+        output_tokens_estimate: int = Config.LLM_OUTPUT_TOKENS_ESTIMATE,
+        max_retries: int = Config.LLM_MAX_RETRIES,
+        retry_base_seconds: float = Config.LLM_RETRY_BASE_SECONDS,
+        retry_max_seconds: float = Config.LLM_RETRY_MAX_SECONDS,
+        model_name: str = Config.OPENAI_MODEL_NAME,
+    ):
+        self.max_concurrency = max_concurrency
+        self.output_tokens_estimate = output_tokens_estimate
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.model_name = model_name
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(tokens_per_minute)
+        self._heap: List[_Waiter] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        # Calls admitted so far and calls not yet finished, per request
+        self._served: Dict[str, int] = {}
+        self._outstanding: Dict[str, int] = {}
+        self.admitted = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._heap if not waiter.future.done())
+
+    def stats(self) -> Dict[str, Any]:
+        waiting = [waiter for waiter in self._heap if not waiter.future.done()]
+        return {
+            "queued": len(waiting),
+            "queued_by_priority": {
+                priority: sum(1 for waiter in waiting if waiter.priority == priority) for priority in PRIORITIES
+            },
+            "running": self._running,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.admitted, 4) if self.admitted else 0.0,
+        }
+
+    def _count_tokens(self, input: Any) -> int:
+        text = input.to_string() if hasattr(input, "to_string") else str(input)
+        return len(get_encoding(self.model_name).encode(text, disallowed_special=()))
+
+    async def _acquire(self, request_id: str, priority: str, tokens: int):
+        loop = asyncio.get_running_loop()
+        served = self._served.get(request_id, 0)
+        self._served[request_id] = served + 1
+        waiter = _Waiter(
+            sort_key=(PRIORITIES[priority], served, next(self._sequence)),
+            future=loop.create_future(),
+            tokens=tokens,
+            priority=priority,
+            enqueued_at=time.monotonic(),
+        )
+        heapq.heappush(self._heap, waiter)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just as the caller went away; hand the slot back
+                self._running -= 1
+                self._dispatch()
+            raise
+
+    def _dispatch(self):
+        """ Admit waiters in order while a slot and both budgets allow it. """
+        now = time.monotonic()
+        while self._heap and self._running < self.max_concurrency:
+            waiter = self._heap[0]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            delay = max(
+                self._paused_until - now,
+                self._request_bucket.wait_time(1, now),
+                self._token_bucket.wait_time(waiter.tokens, now),
+            )
+            if delay > 0:
+                self._schedule_wakeup(delay)
+                return
+            heapq.heappop(self._heap)
+            self._request_bucket.consume(1, now)
+            self._token_bucket.consume(waiter.tokens, now)
+            self._running += 1
+            self.admitted += 1
+            self.total_wait_seconds += now - waiter.enqueued_at
+            STAGE_SECONDS.observe(now - waiter.enqueued_at, stage="llm_queue")
+            waiter.future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float):
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._wakeup is not None and not self._wakeup.cancelled() and self._wakeup.when() <= when:
+            return
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = loop.call_at(when, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _release(self):
+        self._running -= 1
+        self._dispatch()
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        backoff = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt))
+        return max(backoff, retry_after or 0.0)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+    async def astream(self, llm: Runnable, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> AsyncIterator[Any]:
+        """ Stream ``llm`` on ``input`` once admitted, retrying failures that happen before the first chunk. """
+        configurable = (config or {}).get("configurable", {})
+        priority = configurable.get("llm_priority") or DEFAULT_PRIORITY
+        if priority not in PRIORITIES:
+            priority = DEFAULT_PRIORITY
+        # Calls outside a request are each scheduled as their own request
+        request_id = configurable.get("request_id") or f"call-{next(self._sequence)}"
+        prompt_tokens = self._count_tokens(input)
+        estimate = prompt_tokens + self.output_tokens_estimate
+
+        self._outstanding[request_id] = self._outstanding.get(request_id, 0) + 1
+        attempt = 0
+        try:
+            while True:
+                await self._acquire(request_id, priority, estimate)
+                LLM_TOKENS.inc(prompt_tokens, direction="in")
+                admitted_at = time.perf_counter()
+                pieces = []
+                delay = None
+                stream = llm.astream(input, config, **kwargs)
+                try:
+                    async for chunk in stream:
+                        if not pieces:
+                            LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - admitted_at)
+                        pieces.append(getattr(chunk, "content", "") or "")
+                        yield chunk
+                    return
+                except Exception as e:
+                    if pieces or attempt >= self.max_retries or not self._is_retryable(e):
+                        self.failed += 1
+                        raise
+                    attempt += 1
+                    self.retries += 1
+                    delay = self._retry_delay(attempt, e)
+                    if getattr(e, "status_code", None) == 429:
+                        self.rate_limited += 1
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    logger.warning(f"LLM call for {request_id} failed ({e}); retry {attempt} in {delay:.1f}s")
+                finally:
+                    # Close the model stream before handing its slot to the next call
+                    await stream.aclose()
+                    self._release()
+                    output_text = "".join(str(piece) for piece in pieces)
+                    output_tokens = len(get_encoding(self.model_name).encode(output_text, disallowed_special=()))
+                    LLM_TOKENS.inc(output_tokens, direction="out")
+                    # Settle the estimate: return what was not used, or charge the overrun (the level may go negative)
+                    unused = estimate - prompt_tokens - output_tokens
+                    if unused >= 0:
+                        self._token_bucket.refund(unused)
+                    else:
+                        self._token_bucket.consume(-unused, time.monotonic())
+                await asyncio.sleep(delay)
+        finally:
+            self._outstanding[request_id] -= 1
+            if not self._outstanding[request_id]:
+                del self._outstanding[request_id]
+                self._served.pop(request_id, None)
+
+
+class ScheduledChatModel(Runnable):
+    """
+    Runnable that routes a chat model's async calls through an LLMScheduler.
+
+    Used in place of the model in LCEL chains. Tokens still reach callback
+    handlers as they stream; synchronous calls bypass the scheduler.
+    """
+
+    def __init__(self, llm: Runnable, scheduler: LLMScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+
+    @property
+    def InputType(self):
+        return self.llm.InputType
+
+    @property
+    def OutputType(self):
+        return self.llm.OutputType
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> Any:
+        return self.llm.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> Any:
+        result = None
+        async for chunk in self.astream(input, config, **kwargs):
+            result = chunk if result is None else result + chunk
+        return result
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs) -> AsyncIterator[Any]:
+        async for chunk in self.scheduler.astream(self.llm, input, config, **kwargs):
+            yield chunk
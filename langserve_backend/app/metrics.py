@@ -0,0 +1,265 @@
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-minute generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A named metric with a fixed set of label names, one series per label combination.
+
+    Updates take a per-metric lock and touch a dict entry, so instrumenting a hot
+    path costs about a microsecond. Values are per process; with several uvicorn
+    workers each one reports its own.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """ A value that goes up and down, or is read from ``function`` when scraped. """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """ Report ``function()`` at scrape time; only for gauges without labels. """
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            yield f"{self.name} {_format_value(self._function())}"
+            return
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: count per bucket (the last one is +Inf), sum and count
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][index] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe the wall time of the block, also when it raises. """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            series = {key: (list(counts), list(totals)) for key, (counts, totals) in self._series.items()}
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for key, (counts, (total, count)) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {_format_value(count)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """ Every registered metric in the Prometheus text exposition format (version 0.0.4). """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "consent_stage_seconds",
+    "Time spent per pipeline stage: pdf_load, chunk, embed, qdrant_upsert, retrieval, "
+    "shared_retrieval, context_build, llm_queue, pdf_render.",
+    ("stage",),
+))
+SECTION_SECONDS = REGISTRY.register(Histogram(
+    "consent_section_seconds",
+    "Consent-form section generation: time to first token and total time, per section.",
+    ("section", "phase"),
+))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    "consent_llm_first_token_seconds",
+    "Time from admission by the LLM scheduler to the first streamed chunk of a chat model call.",
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "consent_llm_tokens_total",
+    "Chat model tokens sent (in) and generated (out), counted with the model's tokenizer.",
+    ("direction",),
+))
+SECTIONS = REGISTRY.register(Counter(
+    "consent_sections_total",
+    "Consent-form sections produced, by source (generated, cache or revised).",
+    ("source",),
+))
+INGESTED_CHUNKS = REGISTRY.register(Counter(
+    "consent_ingested_chunks_total",
+    "Chunks embedded and upserted into Qdrant.",
+))
+INGESTION_JOBS = REGISTRY.register(Counter(
+    "consent_ingestion_jobs_total",
+    "Finished ingestion jobs by outcome (indexed, retry, failed).",
+    ("outcome",),
+))
+RETRIEVAL_CACHE_EVENTS = REGISTRY.register(Counter(
+    "consent_retrieval_cache_events_total",
+    "Filtered-search cache lookups (hit, miss) and entries dropped (invalidated, expired).",
+    ("event",),
+))
+PDF_REQUESTS = REGISTRY.register(Counter(
+    "consent_pdf_requests_total",
+    "Consent-form PDF requests by how they were served (rendered, cached, not_modified).",
+    ("result",),
+))
+GENERATIONS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "consent_generations_in_flight",
+    "Consent-form generations currently streaming.",
+))
+INGESTION_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "consent_ingestion_queue_depth",
+    "Files waiting for an ingestion worker.",
+))
+LLM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "consent_llm_queue_depth",
+    "Chat model calls waiting for the LLM scheduler.",
+))
+RETRIEVAL_CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "consent_retrieval_cache_entries",
+    "Filtered-search results held in this worker's retrieval cache.",
+))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "consent_llm_in_flight",
+    "Chat model calls admitted by the LLM scheduler and not yet finished.",
+))
+
+
+def render() -> str:
+    return REGISTRY.render()
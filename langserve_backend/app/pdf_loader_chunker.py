@@ -1,15 +1,266 @@
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import accumulate
 import logging
+import os
+import re
+import time
 
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_core.documents import Document
+import pymupdf
 import tiktoken
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from .config import Config
+from .metrics import STAGE_SECONDS
+
+# Preferred places to end a chunk, strongest first
+PARAGRAPH_BREAK = re.compile(rb"\n\s*\n")
+SENTENCE_END = re.compile(rb"[.!?][\"')\]]*(?=\s)")
+LINE_BREAK = re.compile(rb"\n")
+WORD_BREAK = re.compile(rb"\s")
+
+
+def char_boundary(data: bytes, offset: int, forward: bool = False) -> int:
+    """ Move a byte offset off UTF-8 continuation bytes (0b10xxxxxx) to the nearest character start. """
+    step = 1 if forward else -1
+    while 0 < offset < len(data) and data[offset] & 0xC0 == 0x80:
+        offset += step
+    return offset
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str) -> tiktoken.Encoding:
+    """ Return the (cached) tiktoken encoding for a model, falling back to cl100k_base. """
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenChunker:
+    """
+    Split text into token windows of ``chunk_size`` with ``chunk_overlap`` tokens of overlap.
+
+    The text is encoded once; windows are cut on token offsets and each end is snapped
+    back to the nearest paragraph, sentence, line or word boundary within the last
+    ``snap_tokens`` tokens of the window, so chunks rarely end mid-sentence.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = Config.CHUNK_SIZE,
+        chunk_overlap: int = Config.CHUNK_OVERLAP,
+        model_name: str = Config.OPENAI_MODEL_NAME,
+        snap_tokens: Optional[int] = None,
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.snap_tokens = snap_tokens if snap_tokens is not None else max(chunk_overlap, chunk_size // 10)
+        self.encoding = get_encoding(model_name)
+
+    def split_text(self, text: str) -> List[str]:
+        """ Split text into token-bounded chunks. """
+        data = text.encode("utf-8")
+        chunks = []
+        for start, end in self.split_offsets(data):
+            chunk = data[start:end].decode("utf-8").strip()
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def split_offsets(self, data: bytes) -> List[Tuple[int, int]]:
+        """
+        Return the (start, end) UTF-8 byte offsets of every chunk of data.
+
+        Offsets are computed in bytes because token byte lengths are cheap to obtain,
+        whereas mapping tokens back to character offsets is not. A token can end inside
+        a multibyte character, so every offset is moved to a character boundary.
+        """
+        chunks, _ = self._split(data, final=True)
+        return chunks
+
+    def _split(self, data: bytes, final: bool) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Cut data into chunk windows and return them with the number of bytes consumed.
+
+        Unless ``final`` is set, a trailing window that is not yet full is left
+        unconsumed so that it can be completed by text that arrives later.
+        """
+        tokens = self.encoding.encode(data.decode("utf-8"), disallowed_special=())
+        if not tokens:
+            return [], len(data) if final else 0
+        # Byte offset at which every token starts, plus a sentinel for the end of the data
+        offsets = list(accumulate(map(len, self.encoding.decode_tokens_bytes(tokens)), initial=0))
+
+        chunks = []
+        start = 0
+        start_byte = 0
+        total = len(tokens)
+        while start < total:
+            end = start + self.chunk_size
+            if end >= total:
+                if not final:
+                    return chunks, start_byte
+                end = total
+            else:
+                end = self._snap_end(data, offsets, start, end)
+            # Ends move back so a chunk stays within its window; the next start moves
+            # forward, but never past this end, so no character is skipped
+            end_byte = max(start_byte, char_boundary(data, offsets[end]))
+            chunks.append((start_byte, end_byte))
+            if end >= total:
+                break
+            next_start = self._snap_start(data, offsets, start, end)
+            start_byte = min(char_boundary(data, offsets[next_start], forward=True), end_byte)
+            # The next window is counted from the token its first character starts in
+            start = max(start + 1, bisect_right(offsets, start_byte) - 1)
+        return chunks, len(data)
+
+    def feed(
+        self, state: "ChunkStreamState", pages: Iterable[Tuple[int, str]], final: bool = False
+    ) -> Tuple[List[Document], "ChunkStreamState"]:
+        """
+        Add pages to a streaming chunk state and return the chunks that are now complete.
+
+        Only the unfinished tail of the text (less than one chunk) is carried in the
+        state, so memory is bounded by the pages fed in one call rather than by the
+        size of the document. Pass ``final=True`` with the last pages to flush the tail.
+        """
+        for page_number, text in pages:
+            state.page_marks.append((len(state.data), page_number))
+            state.data += text.encode("utf-8")
+
+        spans, consumed = self._split(state.data, final)
+        mark_offsets = [offset for offset, _ in state.page_marks]
+        documents = []
+        for start, end in spans:
+            chunk = state.data[start:end].decode("utf-8").lstrip()
+            # Attribute the chunk to the page its first non-blank character is on
+            start = end - len(chunk.encode("utf-8"))
+            chunk = chunk.rstrip()
+            if not chunk:
+                continue
+            first_page = state.page_marks[max(bisect_right(mark_offsets, start) - 1, 0)][1]
+            last_page = state.page_marks[max(bisect_left(mark_offsets, end) - 1, 0)][1]
+            metadata = {
+                "chunk_index": state.next_chunk_index,
+                "document_title": state.document_title,
+                "page": first_page,
+                "page_end": last_page,
+            }
+            if state.content_hash:
+                metadata["content_hash"] = state.content_hash
+            documents.append(Document(page_content=chunk, metadata=metadata))
+            state.next_chunk_index += 1
+
+        # Drop the consumed bytes, keeping the page the remaining tail starts on
+        state.data = state.data[consumed:]
+        marks = [(offset - consumed, page) for offset, page in state.page_marks]
+        index = max(bisect_right([offset for offset, _ in marks], 0) - 1, 0)
+        state.page_marks = [(max(offset, 0), page) for offset, page in marks[index:]]
+        return documents, state
+
+    def _snap_end(self, data: bytes, offsets: List[int], start: int, end: int) -> int:
+        """ Move a window end back to the strongest boundary within the snap region. """
+        low = offsets[max(start + 1, end - self.snap_tokens)]
+        high = offsets[end]
+        for pattern in (PARAGRAPH_BREAK, SENTENCE_END, LINE_BREAK, WORD_BREAK):
+            position = None
+            for match in pattern.finditer(data, low, high):
+                position = match.end()
+            if position is not None:
+                snapped = bisect_left(offsets, position)
+                if start < snapped <= end:
+                    return snapped
+        return end
+
+    def _snap_start(self, data: bytes, offsets: List[int], start: int, end: int) -> int:
+        """ Start the next window chunk_overlap tokens back, moved forward to a sentence start. """
+        overlap_start = max(start + 1, end - self.chunk_overlap)
+        low = offsets[overlap_start]
+        high = offsets[end]
+        for pattern in (PARAGRAPH_BREAK, SENTENCE_END):
+            match = pattern.search(data, low, high)
+            if match:
+                return max(overlap_start, min(end, bisect_left(offsets, match.end())))
+        return overlap_start
+
+
+@dataclass
+class ChunkStreamState:
+    """ Picklable carry-over between TokenChunker.feed calls for one document. """
+    document_title: str
+    # Hash of the uploaded file, stored on every chunk so points can be filtered by version
+    content_hash: Optional[str] = None
+    data: bytes = b""
+    # (byte offset in data, page number) for every page that starts in or before data
+    page_marks: List[Tuple[int, int]] = field(default_factory=list)
+    next_chunk_index: int = 0
+    # Time spent parsing pages and chunking them so far, reported by the ingestion process
+    load_seconds: float = 0.0
+    chunk_seconds: float = 0.0
+
+
+def pdf_page_count(file_path: str) -> int:
+    with pymupdf.open(file_path) as pdf:
+        return pdf.page_count
+
+
+def load_pdf_pages(file_path: str, start_page: int = 0, end_page: Optional[int] = None) -> List[Tuple[int, str]]:
+    """ Extract the text of pages [start_page, end_page) as (page number, text) pairs. """
+    with pymupdf.open(file_path) as pdf:
+        end_page = pdf.page_count if end_page is None else min(end_page, pdf.page_count)
+        return [(number, pdf[number].get_text()) for number in range(start_page, end_page)]
+
+
+def chunk_pdf_pages(
+    file_path: str, start_page: int, end_page: int, state: ChunkStreamState, final: bool
+) -> Tuple[List[Document], ChunkStreamState]:
+    """
+    Parse a window of pages and feed it to the chunker; runs in the ingestion process pool.
+
+    Metrics recorded here would stay in the pool process, so parse and chunk times
+    are added to the state for the caller to record.
+    """
+    started = time.perf_counter()
+    pages = load_pdf_pages(file_path, start_page, end_page)
+    loaded = time.perf_counter()
+    documents, state = TokenChunker().feed(state, pages, final)
+    state.load_seconds += loaded - started
+    state.chunk_seconds += time.perf_counter() - loaded
+    return documents, state
+
+
+def iter_pdf_chunks(file_path: str, page_window: int = Config.INGEST_PAGE_WINDOW) -> Iterator[Document]:
+    """
+    Lazily parse a PDF ``page_window`` pages at a time and yield its chunks as they complete.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        page_window (int): Number of pages parsed and held in memory at once.
+
+    Yields:
+        Document: Text chunks with chunk index, document title and page metadata.
+    """
+    chunker = TokenChunker()
+    state = ChunkStreamState(document_title=os.path.basename(file_path))
+    page_count = pdf_page_count(file_path)
+    logging.info(f"Number of pages: {page_count}")
+    for start_page in range(0, page_count, page_window):
+        end_page = min(start_page + page_window, page_count)
+        with STAGE_SECONDS.time(stage="pdf_load"):
+            pages = load_pdf_pages(file_path, start_page, end_page)
+        with STAGE_SECONDS.time(stage="chunk"):
+            documents, state = chunker.feed(state, pages, final=end_page == page_count)
+        yield from documents
+
 
 def pdf_load_chunk(file_path: str) -> List[Document]:
     """
-    Load a PDF file, concatenate its pages, and split the content into chunks.
+    Load a PDF file and split its content into chunks.
 
     Args:
         file_path (str): Path to the PDF file.
@@ -17,36 +268,6 @@ def pdf_load_chunk(file_path: str) -> List[Document]:
     Returns:
         List[Document]: List of Document objects containing the text chunks.
     """
-    # Load PDF pages
-    loader = PyMuPDFLoader(file_path)
-    separate_pages = loader.load()
-    logging.info(f"Number of separate pages: {len(separate_pages)}")
-
-    # Concatenate all pages into a single document string
-    document_string = "".join(page.page_content for page in separate_pages)
-    logging.info(f"Length of the document string: {len(document_string)}")
-
-    # Define a function to calculate the length of text in tokens
-    def tiktoken_len(text: str) -> int:
-        tokens = tiktoken.encoding_for_model(Config.OPENAI_MODEL_NAME).encode(text)
-        return len(tokens)
-
-    # Split the document string into chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000,
-        chunk_overlap=200,
-        length_function=tiktoken_len
-    )
-    text_chunks = text_splitter.split_text(document_string)
-    logging.info(f"Number of chunks: {len(text_chunks)}")
-
-    # Create Document objects for each chunk
-    documents = []
-    for index, chunk in enumerate(text_chunks):
-        documents.append(Document(
-            page_content=chunk,
-            metadata={"chunk_index": index, "document_title": file_path.split("/")[-1]}
-        ))
-    logging.info(f"Length of document: {len(documents)}")
-
+    documents = list(iter_pdf_chunks(file_path))
+    logging.info(f"Number of chunks: {len(documents)}")
     return documents
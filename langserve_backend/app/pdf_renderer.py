@@ -0,0 +1,242 @@
+import re
+import json
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from .config import Config
+from .metrics import PDF_REQUESTS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Consent-form sections in document order, with their PDF headings
+CONSENT_FORM_SECTIONS: List[Tuple[str, str]] = [
+    ("summary", "SUMMARY"),
+    ("background", "BACKGROUND"),
+    ("number_of_participants", "NUMBER OF PARTICIPANTS"),
+    ("study_procedures", "STUDY PROCEDURES"),
+    ("alt_procedures", "ALTERNATIVE PROCEDURES"),
+    ("risks", "RISKS"),
+    ("benefits", "BENEFITS"),
+]
+
+SIGNATURE_TEXT = """
+        Parent/Guardian Name: _______________________________
+
+        Signature: _______________________________ Date: ____________
+
+        Person Obtaining Consent: _______________________________
+
+        Signature: _______________________________ Date: ____________
+        """
+
+# Bump when the layout changes, so cached PDFs of the old layout are not served
+LAYOUT_VERSION = 2
+
+
+# Built once per render process; styles are read-only while rendering. ReportLab is
+# imported here rather than at module level, since only render processes use it.
+@lru_cache(maxsize=None)
+def _styles() -> Dict[str, Any]:
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    sample = getSampleStyleSheet()
+    return {
+        "title": sample["Heading1"],
+        "section_title": ParagraphStyle(
+            'SectionTitle',
+            parent=sample['Heading2'],
+            fontSize=12,
+            leading=14,
+            spaceBefore=12,
+            spaceAfter=6,
+            textColor=colors.black,
+            fontName='Helvetica-Bold'
+        ),
+        "normal_text": ParagraphStyle(
+            'NormalText',
+            parent=sample['Normal'],
+            fontSize=10,
+            leading=14,
+            spaceBefore=6,
+            spaceAfter=6,
+            fontName='Helvetica'
+        ),
+    }
+
+
+
+def clean_text_for_pdf(text: str) -> str:
+    if not text:
+        return ""
+
+    # Line breaks, paragraphs and list items of the generated text become paragraph breaks
+    cleaned = re.sub(r'<br\s*/?>', '\n', text, flags=re.IGNORECASE)
+    cleaned = re.sub(r'<li>', '• ', cleaned)
+    cleaned = re.sub(r'</li>|</?[uo]l>|</?p>', '\n', cleaned)
+    # Remove remaining HTML tags and normalize whitespace within lines
+    cleaned = re.sub(r'<[^>]+>', '', cleaned)
+    paragraphs = [re.sub(r'\s+', ' ', line).strip() for line in cleaned.split('\n')]
+
+    return '\n\n'.join(p for p in paragraphs if p)
+
+
+def content_key(content: Dict[str, str]) -> str:
+    """ Hash of the section texts (and the layout version) that determine the rendered PDF. """
+    sections = [content.get(field) or "" for field, _ in CONSENT_FORM_SECTIONS]
+    payload = json.dumps([LAYOUT_VERSION, sections])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_consent_pdf(content: Dict[str, str]) -> bytes:
+    """ Lay out the consent form sections as a letter-size PDF and return its bytes. """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    styles = _styles()
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        title="Consent Form",
+        leftMargin=72,  # 1 inch margins
+        rightMargin=72,
+        topMargin=72,
+        bottomMargin=72
+    )
+    story = [Paragraph("CLINICAL TRIAL CONSENT FORM", styles["title"]), Spacer(1, 20)]
+
+    for field, title in CONSENT_FORM_SECTIONS:
+        text = content.get(field) or ""
+        if not text:
+            continue
+        story.append(Paragraph(title, styles["section_title"]))
+        for paragraph in clean_text_for_pdf(text).split('\n\n'):
+            if not paragraph.strip():
+                continue
+            try:
+                story.append(Paragraph(paragraph.strip(), styles["normal_text"]))
+            except Exception as e:
+                logger.warning(f"Rendering paragraph as plain text: {e}")
+                # Stray '&' or '<' break ReportLab's markup parser
+                story.append(Paragraph(escape(paragraph.strip()), styles["normal_text"]))
+        story.append(Spacer(1, 12))
+
+    story.append(Spacer(1, 30))
+    story.append(Paragraph("SIGNATURES", styles["section_title"]))
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(SIGNATURE_TEXT, styles["normal_text"]))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+class PdfRenderer:
+    """
+    Renders consent-form PDFs off the event loop, with an in-memory LRU cache.
+
+    ReportLab layout is pure Python and holds the GIL, so forms are rendered in a
+    process pool of ``processes`` workers rather than in threads. Rendered PDFs are
+    kept for the ``max_entries`` most recently downloaded section contents, keyed
+    by ``content_key``; concurrent requests for the same content share one render.
+    """
+
+    def __init__(self, processes: int = Config.PDF_RENDER_PROCESSES, max_entries: int = Config.PDF_CACHE_MAX_ENTRIES):
+        self.processes = processes
+        self.max_entries = max_entries
+        self.process_pool: Optional[ProcessPoolExecutor] = None
+        self.cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self.in_progress: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _create_process_pool(self) -> ProcessPoolExecutor:
+        # Spawned workers do not inherit the server's threads, locks or clients
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def stop(self):
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+
+    def get_cached(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            pdf = self.cache.get(key)
+            if pdf is not None:
+                self.cache.move_to_end(key)
+            return pdf
+
+    def _put(self, key: str, pdf: bytes):
+        with self._lock:
+            self.cache[key] = pdf
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    async def render(self, content: Dict[str, str]) -> Tuple[str, bytes]:
+        """ Return the content key and PDF bytes of a consent form, rendering it if not cached. """
+        key = content_key(content)
+        pdf = self.get_cached(key)
+        if pdf is not None:
+            self.hits += 1
+            PDF_REQUESTS.inc(result="cached")
+            return key, pdf
+        task = self.in_progress.get(key)
+        if task is not None:
+            self.hits += 1
+            PDF_REQUESTS.inc(result="cached")
+        else:
+            self.misses += 1
+            PDF_REQUESTS.inc(result="rendered")
+            task = asyncio.create_task(self._render_and_cache(key, content))
+            # Retrieved here so a failure nobody is waiting for any more is not logged as unhandled
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.in_progress[key] = task
+        # The render is shared: a request that goes away leaves it running for the others
+        return key, await asyncio.shield(task)
+
+    async def _render_and_cache(self, key: str, content: Dict[str, str]) -> bytes:
+        try:
+            with STAGE_SECONDS.time(stage="pdf_render"):
+                pdf = await self._render_in_pool(content)
+            self._put(key, pdf)
+            return pdf
+        finally:
+            del self.in_progress[key]
+
+    async def _render_in_pool(self, content: Dict[str, str]) -> bytes:
+        if self.process_pool is None:
+            self.process_pool = self._create_process_pool()
+        # Only the section texts cross the process boundary
+        sections = {field: content.get(field) or "" for field, _ in CONSENT_FORM_SECTIONS}
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.process_pool, render_consent_pdf, sections)
+        except BrokenProcessPool:
+            # A render process died (e.g. out of memory); later renders need a fresh pool
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+            self.process_pool = None
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.cache),
+                'bytes': sum(len(pdf) for pdf in self.cache.values()),
+                'rendering': len(self.in_progress),
+            }
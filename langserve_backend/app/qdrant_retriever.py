@@ -1,7 +1,16 @@
-from typing import List
+import uuid
+import asyncio
+import logging
+from threading import Lock
+from typing import Any, Dict, List, Set
 from langchain_qdrant import QdrantVectorStore
 from langchain_openai import OpenAIEmbeddings
-from langchain_core.vectorstores import VectorStoreRetriever
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from qdrant_client import QdrantClient
 from qdrant_client.http.exceptions import UnexpectedResponse
 from qdrant_client.http.models import (
@@ -11,49 +20,313 @@ from qdrant_client.http.models import (
     Filter,
     FieldCondition,
     MatchValue,
+    PointStruct,
+    HnswConfigDiff,
+    KeywordIndexParams,
+    KeywordIndexType,
+    SearchParams,
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Disabled,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParamsDiff,
 )
 from .config import Config
+from .embedding_cache import CachedEmbeddings
+from .metrics import STAGE_SECONDS
+from .retrieval_cache import CachedFilteredRetriever, RetrievalCache
 # from dotenv import load_dotenv
 
 # load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Payload fields filtered on: the document a chunk belongs to and the version of its file
+PAYLOAD_INDEX_FIELDS = ("metadata.document_title", "metadata.content_hash")
+# The tenant field: filtered retrieval restricts searches to a few documents
+TENANT_FIELD = "metadata.document_title"
+
+
+class ScoredRetriever(BaseRetriever):
+    """ Similarity search that records each chunk's similarity in ``metadata["score"]``. """
+
+    vectorstore: QdrantVectorStore
+    search_kwargs: Dict[str, Any] = {}
+
+    @staticmethod
+    def _with_scores(results) -> List[Document]:
+        return [
+            Document(page_content=doc.page_content, metadata={**doc.metadata, "score": score}, id=doc.id)
+            for doc, score in results
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with STAGE_SECONDS.time(stage="retrieval"):
+            results = self.vectorstore.similarity_search_with_score(query, **self.search_kwargs)
+        return self._with_scores(results)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with STAGE_SECONDS.time(stage="retrieval"):
+            results = await self.vectorstore.asimilarity_search_with_score(query, **self.search_kwargs)
+        return self._with_scores(results)
+
+
 class QdrantRetrieverClient:
     def __init__(self, collection_name: str = Config.COLLECTION_NAME):
         """ Initialize the Qdrant client and create the collection if it does not exist. """
-        print(f"Qdrant Collection Name: {Config.COLLECTION_NAME}")
-        # self.client = QdrantClient(url=Config.QDRANT_URL)
-        self.client = QdrantClient(":memory:")
-        self.embebedding_model = OpenAIEmbeddings(model=Config.OPENAI_EMBEDDING_MODEL_NAME)
+        logger.info(f"Qdrant Collection Name: {Config.COLLECTION_NAME}")
+        self.client = self._create_client()
+        self.embebedding_model = CachedEmbeddings(
+            OpenAIEmbeddings(model=Config.OPENAI_EMBEDDING_MODEL_NAME),
+            model_name=Config.OPENAI_EMBEDDING_MODEL_NAME,
+            cache_dir=Config.CACHE_DIR,
+            max_bytes=Config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+        )
         self.collection_name = collection_name
         self.qdrant_vectorstore = None
+        self.retrieval_cache = RetrievalCache()
+        # The embedded Qdrant is not safe for concurrent writes; a server orders them itself
+        self._write_lock = Lock()
 
         if not self.client.collection_exists(collection_name=self.collection_name):
-            print(
+            logger.info(
                 f"Collection '{self.collection_name}' does not exist. Creating new collection."
             )
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config=VectorParams(
-                    size=Config.OPENAI_EMBEDDING_MODEL_DIMENSION, distance=Distance.COSINE
+                    size=Config.OPENAI_EMBEDDING_MODEL_DIMENSION,
+                    distance=Distance.COSINE,
+                    on_disk=Config.QDRANT_VECTORS_ON_DISK,
                 ),
+                hnsw_config=self._hnsw_config(),
+                quantization_config=self._quantization_config(),
+            )
+        else:
+            self._validate_vector_size()
+            if Config.QDRANT_MODE == "server":
+                self._migrate_hnsw_config()
+                self._migrate_quantization()
+        # The embedded (local and memory) Qdrant searches by brute force and ignores payload indexes
+        if Config.QDRANT_MODE == "server":
+            self._ensure_payload_indexes()
+
+    @staticmethod
+    def _create_client() -> QdrantClient:
+        """ Create the Qdrant client for the configured QDRANT_MODE. """
+        if Config.QDRANT_MODE == "server":
+            logger.info(f"Connecting to Qdrant server at {Config.QDRANT_URL}")
+            return QdrantClient(url=Config.QDRANT_URL)
+        if Config.QDRANT_MODE == "memory":
+            logger.info("Using in-memory Qdrant storage; the collection is lost on restart")
+            return QdrantClient(":memory:")
+        logger.info(f"Using local Qdrant storage at {Config.QDRANT_PATH}")
+        return QdrantClient(path=Config.QDRANT_PATH)
+
+    @staticmethod
+    def _hnsw_config() -> HnswConfigDiff:
+        """
+        HNSW settings for searches restricted to a few protocols.
+
+        payload_m adds graph links within each indexed keyword value, so a filter on one
+        document stays connected instead of falling back to a scan of the whole graph;
+        filters matching fewer than full_scan_threshold KB of vectors are answered
+        exactly from the payload index.
+        """
+        return HnswConfigDiff(
+            m=Config.QDRANT_HNSW_M,
+            ef_construct=Config.QDRANT_HNSW_EF_CONSTRUCT,
+            payload_m=Config.QDRANT_HNSW_PAYLOAD_M,
+            full_scan_threshold=Config.QDRANT_FULL_SCAN_THRESHOLD_KB,
+        )
+
+    def _migrate_hnsw_config(self):
+        """ Apply changed HNSW settings to an existing collection; Qdrant rebuilds the index in the background. """
+        wanted = self._hnsw_config()
+        current = self.client.get_collection(self.collection_name).config.hnsw_config
+        if any(getattr(current, name, None) != value for name, value in wanted.model_dump(exclude_none=True).items()):
+            logger.info(f"Updating HNSW config of collection '{self.collection_name}' to {wanted}")
+            self.client.update_collection(collection_name=self.collection_name, hnsw_config=wanted)
+
+    @staticmethod
+    def _quantization_config():
+        """
+        Compressed copy of the vectors kept in RAM for QDRANT_QUANTIZATION.
+
+        scalar stores one int8 per dimension (4x smaller), binary one bit (32x smaller,
+        best with oversampling). Originals stay on disk when QDRANT_VECTORS_ON_DISK is
+        set and are only read to rescore the oversampled candidates.
+        """
+        if Config.QDRANT_QUANTIZATION == "scalar":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if Config.QDRANT_QUANTIZATION == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def _migrate_quantization(self):
+        """ Bring an existing collection to the configured quantization and vector storage. """
+        config = self.client.get_collection(self.collection_name).config
+        wanted = self._quantization_config()
+        current = config.quantization_config
+        vectors_on_disk = bool(getattr(config.params.vectors, "on_disk", False))
+        if type(current) is type(wanted) and vectors_on_disk == Config.QDRANT_VECTORS_ON_DISK:
+            return
+        logger.info(
+            f"Migrating collection '{self.collection_name}' to quantization={Config.QDRANT_QUANTIZATION}, "
+            f"vectors on_disk={Config.QDRANT_VECTORS_ON_DISK}; Qdrant re-optimizes segments in the background"
+        )
+        self.client.update_collection(
+            collection_name=self.collection_name,
+            vectors_config={"": VectorParamsDiff(on_disk=Config.QDRANT_VECTORS_ON_DISK)},
+            quantization_config=wanted if wanted is not None else Disabled.DISABLED,
+        )
+
+    def _ensure_payload_indexes(self):
+        """ Create the keyword payload indexes used by filtered search and deletes, if missing. """
+        payload_schema = self.client.get_collection(self.collection_name).payload_schema or {}
+        for field_name in PAYLOAD_INDEX_FIELDS:
+            if field_name in payload_schema:
+                continue
+            logger.info(f"Creating payload index on {field_name}")
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                # is_tenant stores each document's points together, which suits per-protocol filters;
+                # Qdrant optimizes storage for one tenant key, so only the document title gets it
+                field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=field_name == TENANT_FIELD),
+                wait=True,
+            )
+
+    def get_indexed_document_titles(self) -> Set[str]:
+        """ Return the distinct document titles that have points in the collection. """
+        titles = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=["metadata.document_title"],
+                with_vectors=False,
+            )
+            for point in points:
+                title = (point.payload or {}).get("metadata", {}).get("document_title")
+                if title:
+                    titles.add(title)
+            if offset is None:
+                return titles
+
+    def invalidate_document(self, document_title: str):
+        """ Drop cached search results that may include chunks of the given document. """
+        self.retrieval_cache.invalidate_documents([document_title])
+
+    def delete_document(self, document_title: str):
+        """ Remove every point that belongs to the given document. """
+        self.invalidate_document(document_title)
+        self._delete(
+            Filter(
+                must=[
+                    FieldCondition(
+                        key="metadata.document_title",
+                        match=MatchValue(value=document_title)
+                    )
+                ]
+            )
+        )
+
+    def _delete(self, points_selector: Filter):
+        if Config.QDRANT_MODE == "server":
+            self.client.delete(collection_name=self.collection_name, points_selector=points_selector)
+            return
+        with self._write_lock:
+            self.client.delete(collection_name=self.collection_name, points_selector=points_selector)
+
+    def _validate_vector_size(self):
+        """ Check an existing collection against the embedding dimension, without an embedding request. """
+        size = self.client.get_collection(self.collection_name).config.params.vectors.size
+        if size != Config.OPENAI_EMBEDDING_MODEL_DIMENSION:
+            raise ValueError(
+                f"Collection '{self.collection_name}' has {size}-dimensional vectors, but "
+                f"OPENAI_EMBEDDING_MODEL_DIMENSION is {Config.OPENAI_EMBEDDING_MODEL_DIMENSION}"
             )
 
     def get_vectorstore(self) -> QdrantVectorStore:
         if not self.qdrant_vectorstore:
+            # The collection is checked in __init__; the vectorstore's own check embeds a dummy text
             self.qdrant_vectorstore = QdrantVectorStore(
-                client=self.client, collection_name=self.collection_name, embedding=self.embebedding_model
+                client=self.client,
+                collection_name=self.collection_name,
+                embedding=self.embebedding_model,
+                validate_collection_config=False,
             )
         return self.qdrant_vectorstore
 
-    def get_retriever(self) -> VectorStoreRetriever:
-        """ Create and return a VectorStoreRetriever. """
-        qdrant_vectorstore = self.get_vectorstore()
-        return qdrant_vectorstore.as_retriever()
+    async def aupsert_documents(self, docs: List[Document], wait: bool = False) -> List[str]:
+        """
+        Embed documents in one embedding request and upsert them as points.
+
+        Points use the vectorstore's payload layout, so they are searched like those
+        written by add_documents. With ``wait=False`` Qdrant acknowledges the batch
+        once it is in its write-ahead log; an upsert with ``wait=True`` issued after
+        it returns only when every earlier update has been applied.
+        """
+        vectorstore = self.get_vectorstore()
+        with STAGE_SECONDS.time(stage="embed"):
+            vectors = await self.embebedding_model.aembed_documents([doc.page_content for doc in docs])
+        points = [
+            PointStruct(
+                id=uuid.uuid4().hex,
+                vector=vector,
+                payload={
+                    vectorstore.content_payload_key: doc.page_content,
+                    vectorstore.metadata_payload_key: doc.metadata,
+                },
+            )
+            for doc, vector in zip(docs, vectors)
+        ]
+        with STAGE_SECONDS.time(stage="qdrant_upsert"):
+            await asyncio.to_thread(self._upsert, points, wait)
+        return [point.id for point in points]
+
+    def _upsert(self, points: List[PointStruct], wait: bool):
+        if Config.QDRANT_MODE == "server":
+            self.client.upsert(collection_name=self.collection_name, points=points, wait=wait)
+            return
+        with self._write_lock:
+            self.client.upsert(collection_name=self.collection_name, points=points, wait=wait)
 
-    def get_retriever_with_filter(self, document_titles: List[str]) -> VectorStoreRetriever:
-        """ Create and return a VectorStoreRetriever with a filter applied. """
+    def get_retriever(self) -> ScoredRetriever:
+        """ Create and return a retriever over every document. """
+        return ScoredRetriever(
+            vectorstore=self.get_vectorstore(),
+            search_kwargs={'k': Config.RAG_CANDIDATE_K, 'search_params': self._search_params()},
+        )
+
+    @staticmethod
+    def _search_params() -> SearchParams:
+        quantization = None
+        if Config.QDRANT_QUANTIZATION != "none":
+            # Search the quantized vectors for oversampling * k candidates, then rescore them exactly
+            quantization = QuantizationSearchParams(
+                rescore=Config.QDRANT_RESCORE, oversampling=Config.QDRANT_OVERSAMPLING
+            )
+        return SearchParams(hnsw_ef=Config.QDRANT_SEARCH_HNSW_EF, quantization=quantization)
+
+    def get_retriever_with_filter(self, document_titles: List[str]) -> CachedFilteredRetriever:
+        """ Create and return a retriever with a filter applied, behind the retrieval cache. """
         qdrant_vectorstore = self.get_vectorstore()
-        print(f"Filtering by document titles: {document_titles}")
-        retriever = qdrant_vectorstore.as_retriever(
+        logger.debug(f"Filtering by document titles: {document_titles}")
+        retriever = ScoredRetriever(
+            vectorstore=qdrant_vectorstore,
             search_kwargs={
                 'filter': Filter(
                     must=[
@@ -63,7 +336,11 @@ class QdrantRetrieverClient:
                         )
                     ]
                 ),
-                'k': 15,                                       
-            }
+                # Candidates only; the context builder keeps what is relevant and fits the budget
+                'k': Config.RAG_CANDIDATE_K,
+                'search_params': self._search_params(),
+            },
+        )
+        return CachedFilteredRetriever(
+            retriever=retriever, cache=self.retrieval_cache, document_titles=document_titles
         )
-        return retriever
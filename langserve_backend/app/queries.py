@@ -134,4 +134,15 @@ def benefits_query():
     All the information of study benefits should be specific to this protocol.
 
     """
-    return benefits_query
\ No newline at end of file
+    return benefits_query
+
+# Consent-form sections, in display order, and the query that generates each one
+SECTION_QUERIES = {
+    "summary": summary_query,
+    "background": background_query,
+    "number_of_participants": number_of_participants_query,
+    "study_procedures": study_procedures_query,
+    "alt_procedures": alt_procedures_query,
+    "risks": risks_query,
+    "benefits": benefits_query,
+}
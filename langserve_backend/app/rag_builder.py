@@ -1,31 +1,159 @@
+from collections import OrderedDict
 from operator import itemgetter
+from threading import Lock
+import asyncio
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
 
 from langchain.schema.output_parser import StrOutputParser
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 
-from .templates import rag_prompt_template
+from .templates import (
+    rag_prompt_template,
+    revision_prompt_template,
+    shared_context_system_template,
+    shared_context_question_template,
+)
 from .config import Config
 from .qdrant_retriever import QdrantRetrieverClient
+from .llm_scheduler import LLMScheduler, ScheduledChatModel
+from .context_builder import ContextBuilder, PASSAGE_SEPARATOR
+from .pdf_loader_chunker import get_encoding
+from .metrics import STAGE_SECONDS
 
 
 class RagBuilder:
-    def __init__(self, retriever_client: QdrantRetrieverClient = None):        
+    def __init__(
+        self,
+        retriever_client: QdrantRetrieverClient = None,
+        filtered_chain_cache_size: int = Config.RAG_CHAIN_CACHE_SIZE,
+        llm_scheduler: LLMScheduler = None,
+        context_builder: ContextBuilder = None,
+    ):
         self.retriever_client = retriever_client if retriever_client else QdrantRetrieverClient()
         self.retriever = self.retriever_client.get_retriever()
-        self.llm = ChatOpenAI(model=Config.OPENAI_MODEL_NAME, streaming=True, temperature=0)
+        # Every chain shares one scheduler, so concurrency and rate limits hold across requests
+        self.llm_scheduler = llm_scheduler if llm_scheduler else LLMScheduler()
+        self.llm = ScheduledChatModel(
+            ChatOpenAI(model=Config.OPENAI_MODEL_NAME, streaming=True, temperature=0),
+            self.llm_scheduler,
+        )
+        # Trims retrieved chunks to the relevant ones that fit the per-section token budget
+        self.context_builder = context_builder if context_builder else ContextBuilder()
         self.rag_prompt = ChatPromptTemplate.from_template(rag_prompt_template)
         self.rag_chain = self.__build_chain()
+        # Reviewer revisions of one section: retrieval as for generation, plus the draft and instructions
+        self.revision_prompt = ChatPromptTemplate.from_template(revision_prompt_template)
+        self.revision_chain = self.__build_revision_chain()
+        # Shared-context mode: the context is retrieved once per form and passed in as input
+        self.shared_context_prompt = ChatPromptTemplate.from_messages([
+            ("system", shared_context_system_template),
+            ("human", shared_context_question_template),
+        ])
+        self.shared_context_chain = self.shared_context_prompt | self.llm | StrOutputParser()
+        # Filtered chains by document set, least recently used first
+        self.filtered_chain_cache_size = filtered_chain_cache_size
+        self._filtered_chains = OrderedDict()
+        self._filtered_chains_lock = Lock()
+
+    def __build_chain(self, retriever=None):
+        context = itemgetter("question") | (retriever or self.retriever) | RunnableLambda(self._build_context)
+        return (
+            {"context": context, "question": itemgetter("question")}
+            | self.rag_prompt | self.llm | StrOutputParser()
+        )
+
+    def __build_revision_chain(self, retriever=None):
+        context = itemgetter("question") | (retriever or self.retriever) | RunnableLambda(self._build_context)
+        return (
+            {
+                "context": context,
+                "question": itemgetter("question"),
+                "draft": itemgetter("draft"),
+                "instructions": itemgetter("instructions"),
+            }
+            | self.revision_prompt | self.llm | StrOutputParser()
+        )
+
+    def context_settings(self, shared: bool = False) -> Dict[str, float]:
+        """ Retrieval and packing settings that determine a section's context, for cache keys. """
+        settings = {**self.context_builder.settings(), "candidate_k": Config.RAG_CANDIDATE_K}
+        if shared:
+            settings["shared_token_budget"] = Config.RAG_SHARED_CONTEXT_TOKEN_BUDGET
+        return settings
+
+    def _build_context(self, documents: List[Document]) -> str:
+        with STAGE_SECONDS.time(stage="context_build"):
+            return self.context_builder.build(documents)
+
+    def get_rag_with_filters(self, files: List[str]):
+        """ Return the RAG chain restricted to the given documents, reusing the one built for the same set. """
+        return self._get_filtered_chain("rag", files, self.__build_chain)
+
+    def get_revision_chain(self, files: List[str]):
+        """ Return the revision chain, restricted to the given documents unless there are none. """
+        if len(files) == 0:
+            return self.revision_chain
+        return self._get_filtered_chain("revision", files, self.__build_revision_chain)
+
+    def _get_filtered_chain(self, kind: str, files: List[str], build):
+        titles = tuple(sorted(set(files)))
+        key = (kind, titles)
+        with self._filtered_chains_lock:
+            chain = self._filtered_chains.get(key)
+            if chain is not None:
+                self._filtered_chains.move_to_end(key)
+                return chain
+        # Filtered retrievers share the client's retrieval cache, so a revision reuses the section's search
+        retriever = self.retriever_client.get_retriever_with_filter(list(titles))
+        chain = build(retriever)
+        with self._filtered_chains_lock:
+            self._filtered_chains[key] = chain
+            while len(self._filtered_chains) > self.filtered_chain_cache_size:
+                self._filtered_chains.popitem(last=False)
+        return chain
+
+    async def abuild_shared_context(self, files: List[str], questions: List[str]) -> Tuple[str, int]:
+        """
+        Retrieve once for a whole form and pack one context for every question.
+
+        Each question's hits are cut with the context builder's score cutoff and
+        adaptive k, then the union is deduplicated by chunk and packed within
+        RAG_SHARED_CONTEXT_TOKEN_BUDGET. Ties are broken by document order, so the
+        same hits always give a byte-identical context.
+
+        Returns:
+            Tuple[str, int]: The context and the token count of the system message it makes.
+        """
+        retriever = self.retriever if len(files) == 0 else self.retriever_client.get_retriever_with_filter(sorted(set(files)))
+        with STAGE_SECONDS.time(stage="shared_retrieval"):
+            results = await asyncio.gather(*(retriever.ainvoke(question) for question in questions))
+
+        with STAGE_SECONDS.time(stage="context_build"):
+            return self._pack_shared_context(results)
+
+    def _pack_shared_context(self, results: List[List[Document]]) -> Tuple[str, int]:
+        union = {}
+        for documents in results:
+            for doc in self.context_builder.select(documents):
+                chunk_index = doc.metadata.get("chunk_index")
+                key = (doc.metadata.get("document_title", ""), chunk_index if chunk_index is not None else doc.page_content)
+                if key not in union or doc.metadata.get("score", 0.0) > union[key].metadata.get("score", 0.0):
+                    union[key] = doc
+        ranked = sorted(
+            union.values(),
+            key=lambda doc: (
+                -doc.metadata.get("score", 0.0),
+                doc.metadata.get("document_title", ""),
+                doc.metadata.get("chunk_index", -1),
+            ),
+        )
+        passages = self.context_builder.pack(ranked, Config.RAG_SHARED_CONTEXT_TOKEN_BUDGET)
+        context = PASSAGE_SEPARATOR.join(passage.text for passage in passages)
 
-    def __build_chain(self):
-            return (
-                {"context": itemgetter("question") | self.retriever, "question": itemgetter("question")}
-                | self.rag_prompt | self.llm | StrOutputParser()
-            )
-    
-    def get_rag_with_filters(self, files):
-         retriever = self.retriever_client.get_retriever_with_filter(files)
-         return (
-                {"context": itemgetter("question") | retriever, "question": itemgetter("question")}
-                | self.rag_prompt | self.llm | StrOutputParser()
-            )        
+        system_message = shared_context_system_template.format(context=context)
+        prefix_tokens = len(get_encoding(Config.OPENAI_MODEL_NAME).encode(system_message, disallowed_special=()))
+        return context, prefix_tokens
@@ -0,0 +1,103 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class ComponentUnavailable(Exception):
+    """ Raised when a component is used before it has started. """
+
+    def __init__(self, name: str, status: str):
+        super().__init__(f"{name} is {status}")
+        self.name = name
+        self.status = status
+
+
+class Components:
+    """
+    Server components that are started in the background after the app begins serving.
+
+    Each component is created by an async factory; ``start`` records its status
+    (pending, starting, ready or failed), the last error and how long it took, and
+    retries a failing factory with exponential backoff up to ``max_retry_seconds``,
+    so a dependency that is down at boot (e.g. the Qdrant server) is picked up once
+    it comes back instead of failing the process. Optional components do not
+    affect ``ready``.
+    """
+
+    def __init__(self, max_retry_seconds: float = 30.0):
+        self.max_retry_seconds = max_retry_seconds
+        self.created_at = time.perf_counter()
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._values: Dict[str, Any] = {}
+
+    def add(self, name: str, required: bool = True):
+        self._components[name] = {
+            "status": PENDING,
+            "required": required,
+            "attempts": 0,
+            "error": None,
+            "seconds": None,
+            "ready_after_seconds": None,
+        }
+
+    async def start(self, name: str, factory: Callable[[], Awaitable[Any]], retry: bool = True) -> Any:
+        """ Create a component with ``factory`` and return it, retrying until it succeeds unless ``retry`` is off. """
+        component = self._components[name]
+        delay = 1.0
+        while True:
+            component["status"] = STARTING
+            component["attempts"] += 1
+            started = time.perf_counter()
+            try:
+                value = await factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                component["status"] = FAILED
+                component["error"] = str(e)
+                if not retry:
+                    logger.warning(f"Component {name} failed to start: {e}")
+                    return None
+                logger.warning(f"Component {name} failed to start, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+                continue
+            self._values[name] = value
+            component.update(
+                status=READY,
+                error=None,
+                seconds=round(time.perf_counter() - started, 3),
+                ready_after_seconds=round(time.perf_counter() - self.created_at, 3),
+            )
+            logger.info(f"Component {name} ready in {component['seconds']}s")
+            return value
+
+    def get(self, name: str) -> Any:
+        """ Return a started component, or raise ComponentUnavailable. """
+        if name not in self._values:
+            component = self._components.get(name)
+            raise ComponentUnavailable(name, component["status"] if component else "unknown")
+        return self._values[name]
+
+    def optional(self, name: str) -> Optional[Any]:
+        return self._values.get(name)
+
+    def ready(self) -> bool:
+        return all(
+            component["status"] == READY for component in self._components.values() if component["required"]
+        )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "uptime_seconds": round(time.perf_counter() - self.created_at, 3),
+            "components": {name: dict(component) for name, component in self._components.items()},
+        }
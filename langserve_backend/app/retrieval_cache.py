@@ -0,0 +1,142 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .config import Config
+from .metrics import RETRIEVAL_CACHE_EVENTS
+
+CacheKey = Tuple[Tuple[str, ...], str]
+
+
+class RetrievalCache:
+    """
+    Bounded LRU cache of filtered search results keyed by (sorted document titles, query).
+
+    Every entry is indexed by the documents it was filtered on, so re-ingesting or
+    deleting any one of them drops all results that could include its chunks. The
+    cache is per process and only the worker that ran the ingestion invalidates its
+    own, so entries also expire ``ttl_seconds`` after they were stored: that bounds
+    how long another worker can serve results from before a re-ingestion.
+    """
+
+    def __init__(
+        self, max_entries: int = Config.RETRIEVAL_CACHE_SIZE, ttl_seconds: float = Config.RETRIEVAL_CACHE_TTL_SECONDS
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.expired = 0
+        # Bumped on every invalidation so searches that raced with one are not cached
+        self.generation = 0
+        self._lock = Lock()
+        # Search results and the monotonic time they were stored at
+        self._entries: "OrderedDict[CacheKey, Tuple[List[Document], float]]" = OrderedDict()
+        self._keys_by_title: Dict[str, Set[CacheKey]] = {}
+
+    @staticmethod
+    def _key(document_titles: Iterable[str], query: str) -> CacheKey:
+        return tuple(sorted(set(document_titles))), query
+
+    def get(self, document_titles: Iterable[str], query: str) -> Optional[List[Document]]:
+        key = self._key(document_titles, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                self.expired += 1
+                RETRIEVAL_CACHE_EVENTS.inc(event="expired")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                RETRIEVAL_CACHE_EVENTS.inc(event="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            RETRIEVAL_CACHE_EVENTS.inc(event="hit")
+            return list(entry[0])
+
+    def put(self, document_titles: Iterable[str], query: str, documents: List[Document], generation: int):
+        """ Cache a search result, unless an invalidation happened since ``generation`` was read. """
+        key = self._key(document_titles, query)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (list(documents), time.monotonic())
+            self._entries.move_to_end(key)
+            for title in key[0]:
+                self._keys_by_title.setdefault(title, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_documents(self, document_titles: Iterable[str]):
+        """ Drop every cached result that was filtered on any of the given documents. """
+        with self._lock:
+            self.generation += 1
+            for title in document_titles:
+                for key in list(self._keys_by_title.get(title, ())):
+                    self._remove(key)
+                    self.invalidated += 1
+                    RETRIEVAL_CACHE_EVENTS.inc(event="invalidated")
+
+    def _remove(self, key: CacheKey):
+        """ Remove an entry and its title index references. Caller holds the lock. """
+        self._entries.pop(key, None)
+        for title in key[0]:
+            keys = self._keys_by_title.get(title)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_title[title]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidated": self.invalidated,
+                "expired": self.expired,
+                "entries": len(self._entries),
+            }
+
+
+class CachedFilteredRetriever(BaseRetriever):
+    """ Retriever that answers from a RetrievalCache before running the filtered search. """
+
+    retriever: BaseRetriever
+    cache: RetrievalCache
+    document_titles: List[str]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        generation = self.cache.generation
+        documents = self.cache.get(self.document_titles, query)
+        if documents is None:
+            documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.put(self.document_titles, query, documents, generation)
+        return documents
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        generation = self.cache.generation
+        documents = self.cache.get(self.document_titles, query)
+        if documents is None:
+            documents = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.put(self.document_titles, query, documents, generation)
+        return documents
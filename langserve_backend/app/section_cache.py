@@ -0,0 +1,86 @@
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from .config import Config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    key TEXT PRIMARY KEY,
+    section TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sections_last_used ON sections (last_used);
+"""
+
+
+class SectionCache:
+    """
+    Persistent cache of generated consent-form sections.
+
+    A section is keyed by everything that determines its text at temperature 0:
+    the content hashes of the source documents, the section query, the RAG prompt
+    template, the chat model name and the retrieval and context-packing settings. Entries live in SQLite (WAL mode) under
+    CACHE_DIR so they survive restarts and are shared between uvicorn workers;
+    the least recently used entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, db_path: str = Config.SECTION_CACHE_DB_FILE, max_entries: int = Config.SECTION_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return this thread's connection, opening it on first use. """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(
+        document_hashes: List[str], query: str, prompt_template: str, model_name: str, context_settings: Dict[str, float]
+    ) -> str:
+        payload = json.dumps(
+            [sorted(document_hashes), query, prompt_template, model_name, context_settings], sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connection() as connection:
+            row = connection.execute('SELECT content FROM sections WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute('UPDATE sections SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, section: str, content: str):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO sections (key, section, content, created_at, last_used) VALUES (?, ?, ?, ?, ?)',
+                (key, section, content, now, now),
+            )
+            connection.execute(
+                'DELETE FROM sections WHERE key IN '
+                '(SELECT key FROM sections ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._connection().execute('SELECT COUNT(*) FROM sections').fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
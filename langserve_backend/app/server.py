@@ -1,38 +1,116 @@
 from typing import AsyncGenerator
-from threading import Thread
+from contextlib import asynccontextmanager
 import os
-import time
+import uuid
+import asyncio
+import logging
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi import UploadFile, File
 from fastapi.responses import JSONResponse
 from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
+from fastapi.responses import PlainTextResponse
 import json
 
-from langserve import add_routes
-
-from reportlab.pdfgen import canvas
-from io import BytesIO
-import markdown2
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-
-from app.qdrant_retriever import QdrantRetrieverClient
-
 from app.config import Config
-from app.agents import ClinicalTrialGraph
-from app.rag_builder import RagBuilder
-from app.filehandler import FileHandler
-from app.pdf_loader_chunker import pdf_load_chunk
-from langchain_core.messages import HumanMessage
+from app.filehandler import FileHandler, UploadTooLarge, INDEXED
+from app.pdf_renderer import PdfRenderer
+from app.form_store import FormStore
+from app import metrics
+from app.queries import SECTION_QUERIES
+from app.readiness import Components, ComponentUnavailable
+from app.section_cache import SectionCache
+
+logger = logging.getLogger(__name__)
+
+# Started in the background by the lifespan hook, in this order; only query_embeddings is optional
+components = Components()
+for name in ("file_status", "form_store", "section_cache", "vector_store", "ingestion", "generation"):
+    components.add(name)
+components.add("query_embeddings", required=False)
+# Render processes are spawned on the first download
+pdf_renderer = PdfRenderer()
+
+
+def create_retriever_client():
+    # Qdrant, LangChain and OpenAI clients are imported here, off the import path of the app
+    from app.qdrant_retriever import QdrantRetrieverClient
+    retriever_client = QdrantRetrieverClient()
+    metrics.RETRIEVAL_CACHE_ENTRIES.set_function(lambda: len(retriever_client.retrieval_cache))
+    return retriever_client
+
+def create_consent_form_graph(retriever_client, section_cache: SectionCache):
+    from app.agents import ClinicalTrialGraph
+    from app.rag_builder import RagBuilder
+
+    rag_builder = RagBuilder(retriever_client)
+    metrics.LLM_QUEUE_DEPTH.set_function(rag_builder.llm_scheduler.queue_depth)
+    metrics.LLM_IN_FLIGHT.set_function(lambda: rag_builder.llm_scheduler.stats()["running"])
+    # Compiled once; the documents to generate from are passed per request in the run config
+    return ClinicalTrialGraph(rag_builder, section_cache)
+
+async def start_ingestion(file_handler: FileHandler, retriever_client):
+    from app.ingestion import IngestionQueue
+
+    ingestion_queue = IngestionQueue(file_handler, retriever_client)
+    try:
+        await ingestion_queue.start()
+    except Exception:
+        await ingestion_queue.stop()
+        raise
+    return ingestion_queue
+
+async def precompute_section_query_embeddings(retriever_client):
+    """ Embed the constant section queries in one batch so form generation skips that round-trip. """
+    # Not required: if this fails, each query is embedded (and cached) on first use instead
+    await retriever_client.embebedding_model.aprecompute_queries(
+        [query() for query in SECTION_QUERIES.values()]
+    )
+    return True
+
+async def warm_up():
+    """ Start every component, retrying those whose dependencies are not up yet. """
+    file_handler = await components.start("file_status", lambda: asyncio.to_thread(FileHandler))
+    await components.start("form_store", lambda: asyncio.to_thread(FormStore))
+    section_cache = await components.start("section_cache", lambda: asyncio.to_thread(SectionCache))
+    retriever_client = await components.start("vector_store", lambda: asyncio.to_thread(create_retriever_client))
+    await asyncio.gather(
+        components.start("ingestion", lambda: start_ingestion(file_handler, retriever_client)),
+        components.start(
+            "generation", lambda: asyncio.to_thread(create_consent_form_graph, retriever_client, section_cache)
+        ),
+        components.start(
+            "query_embeddings", lambda: precompute_section_query_embeddings(retriever_client), retry=False
+        ),
+    )
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Serve at once and start the components in the background.
+
+    /health answers immediately; /ready reports each component's state and turns
+    200 once the required ones are up. Endpoints that need a component that is
+    still starting answer 503 with Retry-After.
+    """
+    Config.ensure_directories()
+    warm_up_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+        ingestion_queue = components.optional("ingestion")
+        if ingestion_queue:
+            await ingestion_queue.stop()
+        pdf_renderer.stop()
+
+app = FastAPI(lifespan=lifespan)
 load_dotenv()
 app.add_middleware(
     CORSMiddleware,
@@ -44,10 +122,12 @@ app.add_middleware(
 )
 
 
-file_handler = FileHandler()
-qdrant_retriever_client = QdrantRetrieverClient()
-rag_builder = RagBuilder(qdrant_retriever_client)
-clinical_trial_agents = ClinicalTrialGraph(rag_builder)
+def require(name: str):
+    """ Return a started component, or fail the request with 503 while it is starting. """
+    try:
+        return components.get(name)
+    except ComponentUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Service starting: {e}", headers={"Retry-After": "5"})
 
 
 @app.get("/")
@@ -59,114 +139,231 @@ async def redirect_root_to_docs():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """ Warm-up state of every component; 503 until the required ones are ready. """
+    return JSONResponse(components.report(), status_code=200 if components.ready() else 503)
+
+@app.get("/llm-scheduler")
+async def llm_scheduler_stats():
+    """ Queue depth, concurrency and retry counters of the shared LLM scheduler. """
+    return require("generation").rag_builder.llm_scheduler.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """ Stage latencies, token counts and queue gauges of this worker process, in Prometheus text format. """
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/upload")
 async def upload_files(files: list[UploadFile] = File(...)):
-    file_status = file_handler.load_file_status()
+    file_handler = require("file_status")
+    ingestion_queue = require("ingestion")
+    max_file_bytes = Config.MAX_UPLOAD_FILE_MB * 1024 * 1024
+    remaining_bytes = Config.MAX_UPLOAD_REQUEST_MB * 1024 * 1024
     saved_files = []
-    for file in files:
-        file_path = os.path.join(Config.UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        saved_files.append(file_path)
-        # Mark file as processing
-        file_status[file.filename] = 'processing'
-    file_handler.save_file_status(file_status)
-
-    # We need to start the processing here 
-    def process_files():
-        time.sleep(5)
-        file_status = file_handler.load_file_status()
-        vectorstore = qdrant_retriever_client.get_vectorstore()
-        for file_path in saved_files:
-            try:
-                docs = pdf_load_chunk(file_path)
-                vectorstore.add_documents(docs)
-                file_status[os.path.basename(file_path)] = 'processed'
-            except Exception as e:
-                file_status[os.path.basename(file_path)] = f'error: {str(e)}'
-        file_handler.save_file_status(file_status)
-
-    Thread(target=process_files).start()
-    return JSONResponse({'message': 'Files uploaded and processing started.'})
+    try:
+        for file in files:
+            tmp_path, content_hash, size = await file_handler.save_upload(file, min(max_file_bytes, remaining_bytes))
+            saved_files.append((os.path.basename(file.filename), tmp_path, content_hash, size))
+            remaining_bytes -= size
+    except UploadTooLarge as e:
+        for _, tmp_path, _, _ in saved_files:
+            os.remove(tmp_path)
+        return JSONResponse({'error': str(e)}, status_code=413)
+
+    results = []
+    # Content hashes queued by this request, so identical files in one upload are ingested once
+    queued_hashes = {}
+    for filename, tmp_path, content_hash, size in saved_files:
+        if content_hash in queued_hashes:
+            os.remove(tmp_path)
+            results.append({'name': filename, 'status': 'already queued', 'existing_file': queued_hashes[content_hash]})
+            continue
+        existing = await asyncio.to_thread(file_handler.find_by_hash, content_hash)
+        if existing:
+            # Identical content is already indexed or being ingested; skip ingesting it again
+            os.remove(tmp_path)
+            status = 'already processed' if existing[1]['status'] == INDEXED else 'already queued'
+            results.append({'name': filename, 'status': status, 'existing_file': existing[0]})
+            continue
+        queued = await ingestion_queue.enqueue(
+            filename, source_path=tmp_path, content_hash=content_hash, size_bytes=size
+        )
+        if not queued:
+            # The file it would replace is being ingested; the upload can be repeated once that is done
+            os.remove(tmp_path)
+            results.append({'name': filename, 'status': 'in progress', 'error': 'a file with this name is being processed'})
+            continue
+        queued_hashes[content_hash] = filename
+        results.append({'name': filename, 'status': 'queued'})
+
+    return JSONResponse({'message': 'Files uploaded and processing started.', 'files': results})
 
 @app.get("/existing-files")
 async def get_existing_files():
-    file_status = file_handler.load_file_status()
-    files = [{'name': filename, 'status': status} for filename, status in file_status.items()]
+    file_status = await asyncio.to_thread(require("file_status").list_files)
+    files = [{'name': filename, **record} for filename, record in file_status.items()]
     return JSONResponse({'files': files})
 
 @app.post("/generate-consent-form")
 async def generate_consent_form(request: Request):
+    from app.streaming import SSE_HEADERS, delta_events, snapshot_events
+
+    consent_form_graph = require("generation")
+    file_handler = require("file_status")
+    form_store = require("form_store")
     request_data = await request.json()
     files = request_data.get("files", [])
     file_names = [f["name"] for f in files if f.get("name")]
-    print(f"Generating consent form for files: {file_names}")
-    graph = ClinicalTrialGraph(rag_builder, file_names)
-    
-    async def response_generator():
-        combined_output = {
-            "summary": "",
-            "background": "",
-            "number_of_participants": "",
-            "study_procedures": "",
-            "alt_procedures": "",
-            "risks": "",
-            "benefits": ""
+    # Set by reviewers to force fresh generation instead of replaying cached sections
+    regenerate = bool(request_data.get("regenerate", False))
+    logger.info(f"Generating consent form for files: {file_names}")
+    # Legacy records may have their uploaded file hashed here, so this runs in a thread
+    document_hashes = await asyncio.to_thread(file_handler.get_content_hashes, file_names) if file_names else None
+    run_config = {
+        "configurable": {
+            "files": file_names,
+            "document_hashes": document_hashes,
+            "regenerate": regenerate,
+            "request_id": uuid.uuid4().hex,
+            # Scripted pre-generation can pass "batch" to yield to coordinators in the UI
+            "llm_priority": request_data.get("priority", "interactive"),
+            "context_mode": request_data.get("context_mode", Config.RAG_CONTEXT_MODE),
         }
-        try:
-            async for update in graph.astream():
-                # print(f"Received update: {json.dumps(update)}")
-                for key, value in update.items():
-                    if isinstance(value, dict):
-                        for sub_key, sub_value in value.items():
-                            combined_output[sub_key] = sub_value[0] if isinstance(sub_value, list) and sub_value else sub_value
-                    else:
-                        combined_output[key] = value[0] if isinstance(value, list) and value else value
-                # print(f"{json.dumps(combined_output)}")
-                # Yield the current state of combined_output
-                yield json.dumps(combined_output)
-        except Exception as e:
-            yield json.dumps({'error': str(e)})
-        
-        # Yield the final combined output
-        yield json.dumps(combined_output)
+    }
+    
+    # The finished form is stored under this ID for export (GET /forms/{id}/pdf) and review
+    form_id = form_store.new_form_id()
+
+    async def store_form(sections: dict) -> dict:
+        form = await asyncio.to_thread(form_store.add_version, form_id, sections, "generated", file_names)
+        return {"form_id": form_id, "version": form["version"]}
+
+    # "delta" (SSE events) or "snapshot" (the full form as JSON after every token, for older clients)
+    mode = request_data.get("mode", "delta")
+    graph_stream = consent_form_graph.astream(run_config)
+    if mode == "snapshot":
+        events = snapshot_events(graph_stream, SECTION_QUERIES, on_complete=store_form)
+    else:
+        events = delta_events(graph_stream, SECTION_QUERIES, on_complete=store_form)
 
     return StreamingResponse(
-        response_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
-        }
+        events, media_type="text/event-stream", headers={**SSE_HEADERS, "X-Form-Id": form_id}
     )
 
+def etag_matches(request: Request, etag: str) -> bool:
+    """ True if the request's If-None-Match lists ``etag`` (weak or strong) or is ``*``. """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+def get_stored_form(form_id: str, version: int | None) -> dict:
+    form = require("form_store").get(form_id, version)
+    if form is None:
+        raise HTTPException(status_code=404, detail="Form not found or expired")
+    return form
+
+# Stored forms may get new versions; clients revalidate with the ETag before reusing a copy
+FORM_CACHE_HEADERS = {"Cache-Control": "private, no-cache"}
+
+@app.get("/forms/{form_id}")
+async def get_form(form_id: str, request: Request, version: int | None = None):
+    """ A stored consent form (the latest version unless ``version`` is given) and its version history. """
+    form = await asyncio.to_thread(get_stored_form, form_id, version)
+    etag = f'"{form_id}.{form["version"]}"'
+    headers = {**FORM_CACHE_HEADERS, "ETag": etag}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    form["versions"] = await asyncio.to_thread(require("form_store").versions, form_id)
+    return JSONResponse(form, headers=headers)
+
+@app.put("/forms/{form_id}")
+async def update_form(form_id: str, request: Request):
+    """ Store reviewer edits (``{"sections": {...}}``) as a new version of a form. """
+    request_data = await request.json()
+    sections = request_data.get("sections")
+    if not isinstance(sections, dict):
+        return JSONResponse({"error": "No sections provided"}, status_code=400)
+    latest = await asyncio.to_thread(get_stored_form, form_id, None)
+    form = await asyncio.to_thread(
+        require("form_store").add_version, form_id, {**latest["sections"], **sections}, "edited"
+    )
+    return JSONResponse(form, headers={**FORM_CACHE_HEADERS, "ETag": f'"{form_id}.{form["version"]}"'})
+
+@app.get("/forms/{form_id}/pdf")
+async def download_form_pdf(form_id: str, request: Request, version: int | None = None):
+    """ The PDF of a stored consent form; 304 without rendering if the client has the same content. """
+    form = await asyncio.to_thread(get_stored_form, form_id, version)
+    # Versions with identical sections share a PDF, so the ETag is the content key
+    etag = f'"{form["content_key"]}"'
+    headers = {**FORM_CACHE_HEADERS, "ETag": etag}
+    if etag_matches(request, etag):
+        metrics.PDF_REQUESTS.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+    _, pdf = await pdf_renderer.render(form["sections"])
+    headers["Content-Disposition"] = f'attachment; filename=consent_form_v{form["version"]}.pdf'
+    return Response(content=pdf, media_type='application/pdf', headers=headers)
+
 @app.post("/revise")
-async def revise():
-    return JSONResponse({'status': 'accepted'})
-
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse, JSONResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from io import BytesIO
-import re
-
-def clean_text_for_pdf(text: str) -> str:
-    if not text:
-        return ""
-    
-    # Remove HTML tags and normalize whitespace
-    cleaned = re.sub(r'<[^>]+>', '', text)
-    cleaned = re.sub(r'\s+', ' ', cleaned)
-    cleaned = cleaned.strip()
-    
-    # Split into paragraphs and filter empty lines
-    paragraphs = [p.strip() for p in cleaned.split('\n') if p.strip()]
-    
-    return '\n\n'.join(paragraphs)
+async def revise(request: Request):
+    """
+    Regenerate one section of a stored form and stream only that section.
+
+    Body: ``{"form_id", "section", "instructions"}``. With reviewer ``instructions``
+    the section's latest stored text is revised following them; without, the
+    section is generated again. Only that section's node runs, and the result is
+    stored as a new "revised" version with the other sections unchanged. Streams
+    the same events as /generate-consent-form, for the one section.
+    """
+    from app.streaming import SSE_HEADERS, delta_events, snapshot_events
+
+    consent_form_graph = require("generation")
+    file_handler = require("file_status")
+    form_store = require("form_store")
+    request_data = await request.json()
+    form_id = request_data.get("form_id")
+    section = request_data.get("section")
+    if not form_id:
+        return JSONResponse({"error": "No form_id provided"}, status_code=400)
+    if section not in SECTION_QUERIES:
+        return JSONResponse({"error": f"Unknown section: {section}"}, status_code=400)
+    form = await asyncio.to_thread(get_stored_form, form_id, None)
+    files = form["files"]
+    document_hashes = await asyncio.to_thread(file_handler.get_content_hashes, files) if files else None
+    run_config = {
+        "configurable": {
+            "files": files,
+            "document_hashes": document_hashes,
+            "regenerate": True,
+            "request_id": uuid.uuid4().hex,
+            "llm_priority": request_data.get("priority", "interactive"),
+        }
+    }
+
+    async def store_revision(sections: dict) -> dict:
+        # Merged into the latest version, so edits stored while the section streamed are kept
+        latest = await asyncio.to_thread(form_store.get, form_id) or form
+        revised = await asyncio.to_thread(
+            form_store.add_version, form_id, {**latest["sections"], **sections}, "revised"
+        )
+        return {"form_id": form_id, "version": revised["version"], "section": section}
+
+    graph_stream = consent_form_graph.astream_section(
+        section,
+        run_config,
+        draft=form["sections"].get(section) or "",
+        instructions=(request_data.get("instructions") or "").strip() or None,
+    )
+    if request_data.get("mode", "delta") == "snapshot":
+        events = snapshot_events(graph_stream, [section], on_complete=store_revision)
+    else:
+        events = delta_events(graph_stream, [section], on_complete=store_revision)
+
+    return StreamingResponse(
+        events, media_type="text/event-stream", headers={**SSE_HEADERS, "X-Form-Id": form_id}
+    )
 
 @app.post("/download-consent-pdf")
 async def download_consent_pdf(request: Request):
@@ -175,119 +372,18 @@ async def download_consent_pdf(request: Request):
         if not data or 'data' not in data:
             return JSONResponse({"error": "No data provided"}, status_code=400)
 
-        content = data['data']
-        buffer = BytesIO()
-        
-        # Set up the PDF document
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=letter,
-            title="Consent Form",
-            leftMargin=72,  # 1 inch margins
-            rightMargin=72,
-            topMargin=72,
-            bottomMargin=72
-        )
-        
-        styles = getSampleStyleSheet()
-        
-        # Customize styles
-        section_title_style = ParagraphStyle(
-            'SectionTitle',
-            parent=styles['Heading2'],
-            fontSize=12,
-            leading=14,
-            spaceBefore=12,
-            spaceAfter=6,
-            textColor=colors.black,
-            fontName='Helvetica-Bold'
-        )
-        
-        normal_text_style = ParagraphStyle(
-            'NormalText',
-            parent=styles['Normal'],
-            fontSize=10,
-            leading=14,
-            spaceBefore=6,
-            spaceAfter=6,
-            fontName='Helvetica'
-        )
-
-        story = []
-
-        def add_section(title: str, content: str):
-            if not content:
-                return
-                
-            # Add section title
-            story.append(Paragraph(title.upper(), section_title_style))
-            
-            # Clean and process content
-            cleaned_content = clean_text_for_pdf(content)
-            
-            # Split into paragraphs and add each
-            for paragraph in cleaned_content.split('\n\n'):
-                if paragraph.strip():
-                    try:
-                        story.append(Paragraph(paragraph.strip(), normal_text_style))
-                    except Exception as e:
-                        print(f"Error processing paragraph: {e}")
-                        # Add as plain text if parsing fails
-                        story.append(Paragraph(str(paragraph.strip()), normal_text_style))
-            
-            story.append(Spacer(1, 12))
-
-        # Add document header
-        story.append(Paragraph("CLINICAL TRIAL CONSENT FORM", styles['Heading1']))
-        story.append(Spacer(1, 20))
-
-        # Add all sections
-        sections = [
-            ("SUMMARY", content.get("summary", "")),
-            ("BACKGROUND", content.get("background", "")),
-            ("NUMBER OF PARTICIPANTS", content.get("number_of_participants", "")),
-            ("STUDY PROCEDURES", content.get("study_procedures", "")),
-            ("ALTERNATIVE PROCEDURES", content.get("alt_procedures", "")),
-            ("RISKS", content.get("risks", "")),
-            ("BENEFITS", content.get("benefits", ""))
-        ]
-
-        for title, text in sections:
-            add_section(title, text)
-
-        # Add signature section
-        story.append(Spacer(1, 30))
-        story.append(Paragraph("SIGNATURES", section_title_style))
-        story.append(Spacer(1, 20))
-        
-        # Add signature lines
-        signature_text = """
-        Parent/Guardian Name: _______________________________
-        
-        Signature: _______________________________ Date: ____________
-        
-        Person Obtaining Consent: _______________________________
-        
-        Signature: _______________________________ Date: ____________
-        """
-        
-        story.append(Paragraph(signature_text, normal_text_style))
-
-        # Generate PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return StreamingResponse(
-            buffer,
+        _, pdf = await pdf_renderer.render(data['data'])
+        return Response(
+            content=pdf,
             media_type='application/pdf',
             headers={
                 "Content-Disposition": "attachment; filename=consent_form.pdf",
                 "Access-Control-Allow-Origin": "*"
             }
         )
-        
+
     except Exception as e:
-        print(f"Error generating PDF: {str(e)}")
+        logger.exception(f"Error generating PDF: {e}")
         return JSONResponse(
             {"error": f"Failed to generate PDF: {str(e)}"},
             status_code=500
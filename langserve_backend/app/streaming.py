@@ -0,0 +1,198 @@
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from .config import Config
+
+# SSE media type and headers shared by the streaming endpoints
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream",
+}
+
+
+def sse_event(event: str, data: dict) -> str:
+    """ Format one server-sent event with a JSON payload. """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class BoundedTokenHandler(AsyncCallbackHandler):
+    """
+    Callback handler that collects streamed LLM tokens in a bounded queue.
+
+    When ``max_pending`` tokens are unread the model's stream waits in
+    ``on_llm_new_token``, so a slow consumer throttles generation instead of
+    growing the queue.
+    """
+
+    def __init__(self, max_pending: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token:
+            await self.queue.put(token)
+
+
+async def coalesce_tokens(
+    queue: asyncio.Queue,
+    task: asyncio.Task,
+    flush_chars: int,
+    flush_seconds: float,
+) -> AsyncIterator[str]:
+    """
+    Yield the tokens put on ``queue`` until ``task`` finishes, joined into larger deltas.
+
+    A delta is flushed once it holds ``flush_chars`` characters or its first token
+    is ``flush_seconds`` old, whichever comes first; everything left is flushed when
+    the task is done. The task's own result or exception is left to the caller.
+    """
+    loop = asyncio.get_running_loop()
+    pending: List[str] = []
+    pending_chars = 0
+    deadline = None
+    get = None
+    try:
+        while True:
+            if get is None:
+                get = asyncio.ensure_future(queue.get())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({get, task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if get in done:
+                token = get.result()
+                get = None
+                pending.append(token)
+                pending_chars += len(token)
+                if deadline is None:
+                    deadline = loop.time() + flush_seconds
+                if pending_chars < flush_chars and loop.time() < deadline:
+                    continue
+            elif task in done:
+                # Generation finished; flush whatever is still queued
+                get.cancel()
+                get = None
+                while not queue.empty():
+                    pending.append(queue.get_nowait())
+                if pending:
+                    yield "".join(pending)
+                return
+
+            if pending:
+                yield "".join(pending)
+            pending = []
+            pending_chars = 0
+            deadline = None
+    finally:
+        if get is not None:
+            get.cancel()
+
+
+class SectionBuffers:
+    """
+    Server-side copy of the sections being streamed, rebuilt from deltas.
+
+    Pieces are kept in lists and only joined when a checkpoint or snapshot is
+    needed, so appending a delta is constant time.
+    """
+
+    def __init__(self, sections: Iterable[str]):
+        self.pieces: Dict[str, List[str]] = {section: [] for section in sections}
+        self.lengths: Dict[str, int] = {section: 0 for section in self.pieces}
+        self.completed: List[str] = []
+
+    def add(self, section: str, offset: int, delta: str):
+        self.pieces.setdefault(section, []).append(delta)
+        self.lengths[section] = offset + len(delta)
+
+    def complete(self, section: str, content: str):
+        """ Mark a section finished, taking the node's final text as authoritative. """
+        self.pieces[section] = [content]
+        self.lengths[section] = len(content)
+        if section not in self.completed:
+            self.completed.append(section)
+
+    def snapshot(self) -> Dict[str, str]:
+        return {section: "".join(pieces) for section, pieces in self.pieces.items()}
+
+    def checkpoint(self) -> dict:
+        return {"sections": self.snapshot(), "completed": list(self.completed)}
+
+
+def _completed_sections(update: dict, sections: Iterable[str]) -> Iterable[Tuple[str, str]]:
+    """ Yield (section, content) for each of ``sections`` in a graph "updates" chunk. """
+    for node_output in update.values():
+        for section, value in (node_output or {}).items():
+            if section in sections:
+                yield section, value[0] if isinstance(value, list) and value else value
+
+
+async def delta_events(
+    graph_stream: AsyncIterator[Tuple[str, dict]],
+    sections: Iterable[str],
+    checkpoint_seconds: float = Config.STREAM_CHECKPOINT_SECONDS,
+    on_complete: Optional[Callable[[Dict[str, str]], Awaitable[dict]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Turn the consent-form graph stream into SSE events.
+
+    ``delta`` events carry ``{section, offset, delta}`` for every coalesced delta, where
+    ``offset`` is the section length before the delta. ``checkpoint`` events carry
+    the full text of every section and the completed sections, at most every
+    ``checkpoint_seconds``, so clients can resynchronise. In shared-context mode a
+    ``context`` event reports ``shared_prefix_tokens`` first. The stream ends with a
+    ``complete`` event in the checkpoint format, or an ``error`` event. ``on_complete``
+    is awaited with the final sections and may return fields to add to ``complete``.
+    """
+    buffers = SectionBuffers(sections)
+    last_checkpoint = time.monotonic()
+    try:
+        async for mode, chunk in graph_stream:
+            if mode == "custom":
+                buffers.add(chunk["section"], chunk["offset"], chunk["delta"])
+                yield sse_event("delta", chunk)
+            elif mode == "updates":
+                context = chunk.get("shared_context_node") or {}
+                if "shared_context" in context:
+                    # Shared-context mode: report the size of the prefix every section reuses
+                    yield sse_event("context", {"shared_prefix_tokens": context["shared_prefix_tokens"]})
+                for section, content in _completed_sections(chunk, buffers.pieces):
+                    buffers.complete(section, content)
+            if time.monotonic() - last_checkpoint >= checkpoint_seconds:
+                last_checkpoint = time.monotonic()
+                yield sse_event("checkpoint", buffers.checkpoint())
+    except Exception as e:
+        yield sse_event("error", {"error": str(e)})
+        return
+    complete = buffers.checkpoint()
+    if on_complete:
+        complete.update(await on_complete(complete["sections"]) or {})
+    yield sse_event("complete", complete)
+
+
+async def snapshot_events(
+    graph_stream: AsyncIterator[Tuple[str, dict]],
+    sections: Iterable[str],
+    on_complete: Optional[Callable[[Dict[str, str]], Awaitable[dict]]] = None,
+) -> AsyncIterator[str]:
+    """ Compatibility mode: the JSON of every section after each delta, without SSE framing. """
+    buffers = SectionBuffers(sections)
+    try:
+        async for mode, chunk in graph_stream:
+            if mode == "custom":
+                buffers.add(chunk["section"], chunk["offset"], chunk["delta"])
+                yield json.dumps(buffers.snapshot())
+            elif mode == "updates":
+                for section, content in _completed_sections(chunk, buffers.pieces):
+                    buffers.complete(section, content)
+    except Exception as e:
+        yield json.dumps({'error': str(e)})
+    else:
+        if on_complete:
+            await on_complete(buffers.snapshot())
+
+    # Yield the final combined output
+    yield json.dumps(buffers.snapshot())
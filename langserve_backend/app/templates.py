@@ -14,6 +14,46 @@ Question:
 {question}
 """
 
+# Shared-context mode: the context for the whole form goes first, in a system message that is
+# byte-identical for all seven sections, so providers with prompt caching can reuse it
+shared_context_system_template = """\
+You are a helpful and polite and cheerful assistant who answers questions based solely on the provided context. 
+Use the context to answer the question and provide a  clear answer. Do not mention the document in your
+response.
+If there is no specific information
+relevant to the question, then tell the user that you can't answer based on the context.
+
+Context:
+{context}
+"""
+
+shared_context_question_template = """\
+Question:
+{question}
+"""
+
+# Reviewer revision of one section: the section's own retrieved context, its current draft and the
+# reviewer's instructions
+revision_prompt_template = """\
+You are a helpful and polite and cheerful assistant who revises a section of an informed consent
+document based solely on the provided context. Do not mention the document in your response.
+
+Context:
+{context}
+
+Instructions the section was written to:
+{question}
+
+Current draft of the section:
+{draft}
+
+Reviewer instructions:
+{instructions}
+
+Rewrite the section following the reviewer instructions. Keep everything in the current draft that
+the reviewer did not ask to change, and reply with the revised section only.
+"""
+
 
 heading = """\
 ## Parental Permission, Teen Assent and Authorization Document
@@ -0,0 +1,74 @@
+"""
+Compare the single-pass TokenChunker with the previous RecursiveCharacterTextSplitter
+setup, which re-created the tiktoken encoder and re-encoded every candidate piece.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_chunker --pages 300
+"""
+import argparse
+import json
+import time
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.config import Config
+from app.pdf_loader_chunker import TokenChunker, get_encoding
+from benchmarks.synthetic import synthetic_protocol
+
+
+def legacy_split(text: str, chunk_size: int, chunk_overlap: int):
+    def tiktoken_len(text: str) -> int:
+        tokens = tiktoken.encoding_for_model(Config.OPENAI_MODEL_NAME).encode(text)
+        return len(tokens)
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=tiktoken_len
+    )
+    return text_splitter.split_text(text)
+
+
+def measure(name: str, split, text: str, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = split(text)
+        best = min(best, time.perf_counter() - started)
+    encoding = get_encoding(Config.OPENAI_MODEL_NAME)
+    sizes = [len(encoding.encode(chunk, disallowed_special=())) for chunk in chunks]
+    return {
+        "splitter": name,
+        "seconds": round(best, 4),
+        "chunks": len(chunks),
+        "max_chunk_tokens": max(sizes),
+        "mean_chunk_tokens": round(sum(sizes) / len(sizes), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=Config.CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=Config.CHUNK_OVERLAP)
+    args = parser.parse_args()
+
+    text = synthetic_protocol(args.pages)
+    chunker = TokenChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    results = {
+        "pages": args.pages,
+        "characters": len(text),
+        "results": [
+            measure("token_chunker", chunker.split_text, text, args.repeat),
+            measure("legacy_recursive", lambda t: legacy_split(t, args.chunk_size, args.chunk_overlap), text, args.repeat),
+        ],
+    }
+    legacy, current = results["results"][1]["seconds"], results["results"][0]["seconds"]
+    results["speedup"] = round(legacy / current, 1) if current else None
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
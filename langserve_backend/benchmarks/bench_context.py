@@ -0,0 +1,78 @@
+"""
+Compare the prompt context sent per section before and after context packing: the
+previous chain stuffed all ``--k`` retrieved chunks into the prompt as a list of
+Documents, the ContextBuilder keeps the relevant ones and merges their overlap.
+
+Retrieval is simulated on a synthetic protocol: ``--adjacent`` runs of neighbouring
+chunks plus random ones, with random similarity scores.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_context --pages 200
+"""
+import argparse
+import json
+import random
+import time
+
+from langchain_core.documents import Document
+
+from app.config import Config
+from app.context_builder import ContextBuilder
+from app.pdf_loader_chunker import TokenChunker, get_encoding
+from benchmarks.synthetic import synthetic_protocol
+
+
+def simulated_retrieval(chunks, k: int, adjacent: int, rng: random.Random):
+    indexes = set()
+    while len(indexes) < min(adjacent * 3, k):
+        start = rng.randrange(len(chunks) - 2)
+        indexes.update(range(start, start + 3))
+    while len(indexes) < k:
+        indexes.add(rng.randrange(len(chunks)))
+    return [
+        Document(
+            page_content=chunks[index],
+            metadata={"document_title": "protocol.pdf", "chunk_index": index, "score": rng.uniform(0.2, 0.85)},
+        )
+        for index in sorted(indexes)[:k]
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--k", type=int, default=Config.RAG_CANDIDATE_K)
+    parser.add_argument("--adjacent", type=int, default=2, help="runs of three neighbouring chunks per query")
+    parser.add_argument("--queries", type=int, default=7)
+    parser.add_argument("--budget", type=int, default=Config.RAG_CONTEXT_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    chunks = TokenChunker(chunk_size=Config.CHUNK_SIZE, chunk_overlap=Config.CHUNK_OVERLAP).split_text(
+        synthetic_protocol(args.pages)
+    )
+    encoding = get_encoding(Config.OPENAI_MODEL_NAME)
+    builder = ContextBuilder(token_budget=args.budget)
+    rng = random.Random(0)
+
+    legacy_tokens, packed_tokens, build_seconds = [], [], []
+    for _ in range(args.queries):
+        documents = simulated_retrieval(chunks, args.k, args.adjacent, rng)
+        legacy_tokens.append(len(encoding.encode(str(documents), disallowed_special=())))
+        started = time.perf_counter()
+        context = builder.build(documents)
+        build_seconds.append(time.perf_counter() - started)
+        packed_tokens.append(len(encoding.encode(context, disallowed_special=())))
+
+    print(json.dumps({
+        "chunks": len(chunks),
+        "queries": args.queries,
+        "legacy_context_tokens_per_form": sum(legacy_tokens),
+        "packed_context_tokens_per_form": sum(packed_tokens),
+        "reduction": round(1 - sum(packed_tokens) / sum(legacy_tokens), 3),
+        "max_packed_tokens": max(packed_tokens),
+        "mean_build_ms": round(1000 * sum(build_seconds) / len(build_seconds), 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Filtered search latency against collection size, with and without the keyword
+payload indexes and HNSW settings the backend now applies.
+
+Each run fills a throwaway collection with ``--chunks-per-document`` random vectors
+per protocol and searches with a filter on ``--select`` document titles, the way
+get_retriever_with_filter does. Needs a Qdrant server (the embedded client
+ignores payload indexes and always scans); ``--url :memory:`` only smoke-tests.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_filtered_search --url http://localhost:6333 --documents 100,500,1000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    HnswConfigDiff,
+    KeywordIndexParams,
+    KeywordIndexType,
+    MatchAny,
+    PointStruct,
+    SearchParams,
+    VectorParams,
+)
+
+from app.config import Config
+from app.qdrant_retriever import PAYLOAD_INDEX_FIELDS, TENANT_FIELD
+
+UPLOAD_BATCH = 512
+
+
+def fill(client: QdrantClient, name: str, documents: int, chunks: int, dim: int, indexed: bool, rng: np.random.Generator):
+    client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+        hnsw_config=HnswConfigDiff(
+            m=Config.QDRANT_HNSW_M,
+            ef_construct=Config.QDRANT_HNSW_EF_CONSTRUCT,
+            payload_m=Config.QDRANT_HNSW_PAYLOAD_M,
+            full_scan_threshold=Config.QDRANT_FULL_SCAN_THRESHOLD_KB,
+        ) if indexed else None,
+    )
+    if indexed:
+        for field_name in PAYLOAD_INDEX_FIELDS:
+            client.create_payload_index(
+                collection_name=name,
+                field_name=field_name,
+                # The same layout as QdrantRetrieverClient._ensure_payload_indexes
+                field_schema=KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=field_name == TENANT_FIELD),
+                wait=True,
+            )
+    points = []
+    for document in range(documents):
+        vectors = rng.standard_normal((chunks, dim)).astype(np.float32)
+        for chunk_index, vector in enumerate(vectors):
+            points.append(PointStruct(
+                id=str(uuid.uuid4()),
+                vector=vector.tolist(),
+                payload={"metadata": {
+                    "document_title": f"protocol-{document}.pdf",
+                    "content_hash": f"{document:064x}",
+                    "chunk_index": chunk_index,
+                }},
+            ))
+            if len(points) >= UPLOAD_BATCH:
+                client.upsert(collection_name=name, points=points, wait=False)
+                points = []
+    if points:
+        client.upsert(collection_name=name, points=points, wait=True)
+    # Let the optimizer finish building the HNSW graph before measuring
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        if str(client.get_collection(name).status).lower().endswith("green"):
+            break
+        time.sleep(0.5)
+
+
+def measure(client: QdrantClient, name: str, documents: int, dim: int, queries: int, select: int, indexed: bool, rng):
+    titles = random.Random(0)
+    latencies = []
+    for _ in range(queries):
+        query_filter = Filter(must=[FieldCondition(
+            key="metadata.document_title",
+            match=MatchAny(any=[f"protocol-{titles.randrange(documents)}.pdf" for _ in range(select)]),
+        )])
+        vector = rng.standard_normal(dim).astype(np.float32).tolist()
+        started = time.perf_counter()
+        client.query_points(
+            collection_name=name,
+            query=vector,
+            query_filter=query_filter,
+            limit=Config.RAG_CANDIDATE_K,
+            search_params=SearchParams(hnsw_ef=Config.QDRANT_SEARCH_HNSW_EF) if indexed else None,
+        )
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "p50_ms": round(1000 * latencies[len(latencies) // 2], 2),
+        "p95_ms": round(1000 * latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=Config.QDRANT_URL)
+    parser.add_argument("--documents", default="100,500,1000", help="comma-separated collection sizes, in protocols")
+    parser.add_argument("--chunks-per-document", type=int, default=40)
+    parser.add_argument("--dim", type=int, default=Config.OPENAI_EMBEDDING_MODEL_DIMENSION)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--select", type=int, default=1, help="protocols per filter")
+    args = parser.parse_args()
+
+    client = QdrantClient(":memory:") if args.url == ":memory:" else QdrantClient(url=args.url)
+    rng = np.random.default_rng(0)
+    results = []
+    for documents in (int(size) for size in args.documents.split(",")):
+        row = {"documents": documents, "points": documents * args.chunks_per_document}
+        for indexed in (False, True):
+            name = f"bench-filtered-{documents}-{'indexed' if indexed else 'plain'}-{uuid.uuid4().hex[:6]}"
+            try:
+                fill(client, name, documents, args.chunks_per_document, args.dim, indexed, rng)
+                row["indexed" if indexed else "no_index"] = measure(
+                    client, name, documents, args.dim, args.queries, args.select, indexed, rng
+                )
+            finally:
+                client.delete_collection(name)
+        results.append(row)
+        print(json.dumps(row), flush=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
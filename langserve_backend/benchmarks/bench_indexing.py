@@ -0,0 +1,104 @@
+"""
+Index the chunks of a synthetic protocol the way ingestion did before (one batch
+after another through ``vectorstore.aadd_documents``, each waiting for Qdrant)
+and through the BatchIndexer at several concurrency levels, and compare chunks/s.
+
+Embeddings are faked with the latency of a remote API (``--request-ms`` per call
+plus ``--text-ms`` per chunk); the points go to a throwaway collection in the
+configured Qdrant (QDRANT_MODE=memory for a self-contained run).
+
+Usage (from langserve_backend/):
+    QDRANT_MODE=memory python -m benchmarks.bench_indexing --pages 300 --concurrency 1,2,4,8
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from langchain_core.documents import Document
+
+from app.config import Config
+from app.ingestion import BatchIndexer
+from app.pdf_loader_chunker import TokenChunker
+from app.qdrant_retriever import QdrantRetrieverClient
+from benchmarks.fakes import FakeEmbeddings
+from benchmarks.synthetic import synthetic_protocol
+
+
+def fresh_client(args) -> QdrantRetrieverClient:
+    client = QdrantRetrieverClient(collection_name=f"bench-indexing-{uuid.uuid4().hex[:8]}")
+    client.embebedding_model = FakeEmbeddings(
+        Config.OPENAI_EMBEDDING_MODEL_DIMENSION, args.request_ms / 1000, args.text_ms / 1000
+    )
+    return client
+
+
+async def sequential(client: QdrantRetrieverClient, docs, batch_size: int):
+    vectorstore = client.get_vectorstore()
+    for batch_start in range(0, len(docs), batch_size):
+        await vectorstore.aadd_documents(docs[batch_start:batch_start + batch_size])
+
+
+async def batched(client: QdrantRetrieverClient, docs, batch_size: int, concurrency: int, window: int):
+    indexer = BatchIndexer(client, batch_size, concurrency)
+    try:
+        # Chunks arrive a page window at a time, as they do from the parser
+        for window_start in range(0, len(docs), window):
+            await indexer.add(docs[window_start:window_start + window])
+        await indexer.finish()
+    finally:
+        indexer.cancel()
+
+
+def measure(name: str, args, docs, run) -> dict:
+    client = fresh_client(args)
+    try:
+        started = time.perf_counter()
+        asyncio.run(run(client))
+        seconds = time.perf_counter() - started
+        points = client.client.count(client.collection_name).count
+    finally:
+        client.client.delete_collection(client.collection_name)
+    return {
+        "mode": name,
+        "points": points,
+        "seconds": round(seconds, 3),
+        "chunks_per_second": round(len(docs) / seconds, 1),
+        "embedding_requests": client.embebedding_model.requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--batch-size", type=int, default=Config.EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", default="1,2,4,8", help="comma-separated batches in flight")
+    parser.add_argument("--request-ms", type=float, default=150.0, help="embedding API latency per request")
+    parser.add_argument("--text-ms", type=float, default=2.0, help="embedding API latency per chunk")
+    args = parser.parse_args()
+
+    chunks = TokenChunker(chunk_size=Config.CHUNK_SIZE, chunk_overlap=Config.CHUNK_OVERLAP).split_text(
+        synthetic_protocol(args.pages)
+    )
+    docs = [
+        Document(page_content=text, metadata={"document_title": "protocol.pdf", "chunk_index": index})
+        for index, text in enumerate(chunks)
+    ]
+    # Chunks per INGEST_PAGE_WINDOW pages
+    window = max(1, len(docs) * Config.INGEST_PAGE_WINDOW // args.pages)
+
+    results = [measure("sequential", args, docs, lambda client: sequential(client, docs, args.batch_size))]
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        results.append(measure(
+            f"batched_x{concurrency}", args, docs,
+            lambda client: batched(client, docs, args.batch_size, concurrency, window),
+        ))
+    baseline = results[0]["seconds"]
+    for result in results:
+        result["speedup"] = round(baseline / result["seconds"], 2)
+    print(json.dumps({"chunks": len(docs), "batch_size": args.batch_size, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
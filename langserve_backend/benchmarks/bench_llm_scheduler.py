@@ -0,0 +1,96 @@
+"""
+Fire consent-form-shaped bursts (``--sections`` concurrent calls per request) at a
+rate-limited fake provider, directly and through the LLMScheduler, and compare
+429s, failures, wall time and time to first token per priority.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_llm_scheduler --requests 10 --batch-requests 3
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from langchain_core.messages import HumanMessage
+
+from app.llm_scheduler import LLMScheduler, ScheduledChatModel
+from benchmarks.fakes import FakeProvider, FakeStreamingChat
+
+
+async def call(model, request_id: str, priority: str, first_token: list, failures: list):
+    started = time.perf_counter()
+    config = {"configurable": {"request_id": request_id, "llm_priority": priority}}
+    first = None
+    try:
+        async for _ in model.astream([HumanMessage(content="Summarize the protocol")], config):
+            if first is None:
+                first = time.perf_counter() - started
+        first_token.append((priority, first))
+    except Exception as e:
+        failures.append(type(e).__name__)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+
+async def run(scheduled: bool, args) -> dict:
+    provider = FakeProvider(args.provider_concurrency, args.provider_rpm)
+    model = FakeStreamingChat(provider=provider, output_tokens=args.output_tokens)
+    scheduler = None
+    if scheduled:
+        scheduler = LLMScheduler(
+            max_concurrency=args.provider_concurrency,
+            requests_per_minute=args.provider_rpm,
+            tokens_per_minute=0,
+            retry_base_seconds=0.05,
+            retry_max_seconds=1.0,
+        )
+        model = ScheduledChatModel(model, scheduler)
+
+    first_token, failures = [], []
+    calls = []
+    # Batch jobs arrive first, as when a nightly pre-generation overlaps office hours
+    for n in range(args.batch_requests):
+        calls += [call(model, f"batch-{n}", "batch", first_token, failures) for _ in range(args.sections)]
+    for n in range(args.requests):
+        calls += [call(model, f"ui-{n}", "interactive", first_token, failures) for _ in range(args.sections)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*calls)
+    result = {
+        "mode": "scheduled" if scheduled else "direct",
+        "calls": len(calls),
+        "completed": len(first_token),
+        "failed": len(failures),
+        "provider_429s": provider.rejected,
+        "wall_seconds": round(time.perf_counter() - started, 3),
+    }
+    for priority in ("interactive", "batch"):
+        latencies = [latency for p, latency in first_token if p == priority]
+        result[f"{priority}_first_token_p50"] = percentile(latencies, 0.5)
+        result[f"{priority}_first_token_p95"] = percentile(latencies, 0.95)
+    if scheduler:
+        result["scheduler"] = scheduler.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10, help="interactive consent-form requests")
+    parser.add_argument("--batch-requests", type=int, default=3)
+    parser.add_argument("--sections", type=int, default=7)
+    parser.add_argument("--output-tokens", type=int, default=30)
+    parser.add_argument("--provider-concurrency", type=int, default=8)
+    parser.add_argument("--provider-rpm", type=int, default=6000)
+    args = parser.parse_args()
+
+    results = [asyncio.run(run(False, args)), asyncio.run(run(True, args))]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Render throughput and event-loop stall of consent-form PDF downloads: rendering
+inline in the handler as before, through the PdfRenderer process pool, and
+repeated downloads served from its cache.
+
+A heartbeat task ticks every ``--tick-ms`` while ``--requests`` concurrent renders
+run; the stall is how late its ticks fire, i.e. how long every other stream on the
+worker would have been blocked.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_pdf_render --requests 16 --words 800 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from app.pdf_renderer import CONSENT_FORM_SECTIONS, PdfRenderer, _styles, render_consent_pdf
+from benchmarks.synthetic import synthetic_sentence
+
+
+def synthetic_form(words: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    content = {}
+    for field, _ in CONSENT_FORM_SECTIONS:
+        sentences = []
+        while sum(len(sentence.split()) for sentence in sentences) < words:
+            sentences.append(synthetic_sentence(rng))
+        content[field] = " ".join(sentences)
+    return content
+
+
+async def heartbeat(tick_seconds: float, lateness: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + tick_seconds
+        await asyncio.sleep(tick_seconds)
+        lateness.append(max(0.0, loop.time() - expected))
+
+
+async def inline_render(content: dict) -> bytes:
+    # What the handler did before: styles rebuilt and the layout run on the event loop
+    _styles.__wrapped__()
+    return render_consent_pdf(content)
+
+
+async def run(name: str, render, forms, tick_seconds: float) -> dict:
+    lateness, stop = [], asyncio.Event()
+    ticker = asyncio.create_task(heartbeat(tick_seconds, lateness, stop))
+    await asyncio.sleep(tick_seconds * 2)
+    started = time.perf_counter()
+    pdfs = await asyncio.gather(*(render(form) for form in forms))
+    seconds = time.perf_counter() - started
+    stop.set()
+    await ticker
+    lateness.sort()
+    return {
+        "mode": name,
+        "renders": len(forms),
+        "seconds": round(seconds, 3),
+        "renders_per_second": round(len(forms) / seconds, 1),
+        "mean_pdf_kb": round(sum(len(pdf) for pdf in pdfs) / len(pdfs) / 1024, 1),
+        "max_stall_ms": round(1000 * lateness[-1], 1) if lateness else None,
+        "p99_stall_ms": round(1000 * lateness[int(0.99 * (len(lateness) - 1))], 1) if lateness else None,
+    }
+
+
+async def main_async(args) -> dict:
+    forms = [synthetic_form(args.words, seed) for seed in range(args.requests)]
+    renderer = PdfRenderer(processes=args.processes, max_entries=args.requests)
+
+    async def pooled(form: dict) -> bytes:
+        _, pdf = await renderer.render(form)
+        return pdf
+
+    try:
+        # Start the worker processes outside the measurement
+        await asyncio.gather(*(renderer.render(synthetic_form(10, -1 - n)) for n in range(args.processes)))
+        results = [
+            await run("inline", inline_render, forms, args.tick_ms / 1000),
+            await run("process_pool", pooled, forms, args.tick_ms / 1000),
+            # The same drafts again, now in the cache
+            await run("cached", pooled, forms, args.tick_ms / 1000),
+        ]
+    finally:
+        renderer.stop()
+    return {"results": results, "cache": renderer.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--words", type=int, default=800, help="words per consent-form section")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--tick-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Memory footprint and recall@k of the QDRANT_QUANTIZATION modes against exact
+float32 search, with and without oversampling and rescoring.
+
+Search is simulated in numpy the way Qdrant does it: scalar int8 quantization
+with a 0.99 quantile clip, binary quantization as the sign bit scored by Hamming
+distance, ``oversampling * k`` candidates taken from the quantized vectors and,
+with rescore, re-ranked by their original vectors. Vectors are synthetic and
+clustered like chunks of a few hundred protocols; real embeddings cluster more,
+which favours binary quantization.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_quantization --points 50000 --oversampling 1,2,4,8
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.config import Config
+
+FLOAT_BYTES = 4
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def clustered_vectors(points: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    members = rng.integers(0, clusters, points)
+    return normalize(centers[members] + 0.6 * rng.standard_normal((points, dim)).astype(np.float32))
+
+
+class ScalarIndex:
+    """ int8 codes over the [q, 1-q] quantile range, scored by dot product of the codes. """
+
+    def __init__(self, vectors: np.ndarray, quantile: float = 0.99):
+        self.low = float(np.quantile(vectors, 1 - quantile))
+        self.high = float(np.quantile(vectors, quantile))
+        self.codes = self.encode(vectors)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        scaled = (np.clip(vectors, self.low, self.high) - self.low) / (self.high - self.low)
+        return np.round(scaled * 255 - 128).astype(np.int8)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        return self.codes.astype(np.int32) @ self.encode(query[None, :])[0].astype(np.int32)
+
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+class BinaryIndex:
+    """ One bit per dimension, scored by the number of matching bits. """
+
+    def __init__(self, vectors: np.ndarray):
+        self.dim = vectors.shape[1]
+        self.codes = np.packbits(vectors > 0, axis=1)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        query_bits = np.packbits(query > 0)
+        differing = np.unpackbits(np.bitwise_xor(self.codes, query_bits), axis=1).sum(axis=1)
+        return self.dim - differing.astype(np.int32)
+
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def recall(index, vectors, queries, exact, k: int, oversampling: float, rescore: bool):
+    limit = k if not rescore else max(k, int(round(k * oversampling)))
+    hits, seconds = 0, 0.0
+    for query, expected in zip(queries, exact):
+        started = time.perf_counter()
+        candidates = top_k(index.scores(query), limit)
+        if rescore:
+            candidates = candidates[top_k(vectors[candidates] @ query, k)]
+        seconds += time.perf_counter() - started
+        hits += len(set(candidates[:k].tolist()) & set(expected.tolist()))
+    return round(hits / (k * len(queries)), 4), round(1000 * seconds / len(queries), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=Config.OPENAI_EMBEDDING_MODEL_DIMENSION)
+    parser.add_argument("--clusters", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=Config.RAG_CANDIDATE_K)
+    parser.add_argument("--oversampling", default="1,2,4,8", help="comma-separated oversampling factors")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(args.points, args.dim, args.clusters, rng)
+    queries = normalize(vectors[rng.integers(0, args.points, args.queries)]
+                        + 0.3 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    exact = [top_k(vectors @ query, args.k) for query in queries]
+    original_bytes = args.points * args.dim * FLOAT_BYTES
+
+    results = [{
+        "mode": "none",
+        "ram_mb": round(original_bytes / 2 ** 20, 1),
+        "ram_mb_vectors_on_disk": round(original_bytes / 2 ** 20, 1),
+        "recall_at_k": 1.0,
+    }]
+    for mode, index in (("scalar", ScalarIndex(vectors)), ("binary", BinaryIndex(vectors))):
+        row = {
+            "mode": mode,
+            # Quantized vectors stay in RAM; originals too unless QDRANT_VECTORS_ON_DISK
+            "ram_mb": round((original_bytes + index.nbytes()) / 2 ** 20, 1),
+            "ram_mb_vectors_on_disk": round(index.nbytes() / 2 ** 20, 1),
+        }
+        row["recall_no_rescore"], row["ms_no_rescore"] = recall(
+            index, vectors, queries, exact, args.k, 1.0, rescore=False
+        )
+        for factor in (float(value) for value in args.oversampling.split(",")):
+            row[f"recall_rescore_x{factor:g}"], row[f"ms_rescore_x{factor:g}"] = recall(
+                index, vectors, queries, exact, args.k, factor, rescore=True
+            )
+        results.append(row)
+    print(json.dumps({"points": args.points, "dim": args.dim, "k": args.k, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Cold-start cost of the backend: how long ``import app.server`` takes in a fresh
+interpreter (and which heavy libraries it pulls in), and, for a uvicorn process
+started from scratch, the time until /health first answers and until /ready
+reports every required component started.
+
+Runs offline like benchmarks.run: Qdrant in memory, stores in a throwaway
+directory. No request reaches OpenAI during startup except the optional query
+embedding warm-up, which fails harmlessly without network access.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.run import isolate_environment
+
+HEAVY_MODULES = ("qdrant_client", "langchain_openai", "langgraph", "langserve", "reportlab", "markdown2", "pymupdf", "tiktoken")
+
+IMPORT_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import app.server
+seconds = time.perf_counter() - started
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(runs: int) -> dict:
+    samples, loaded = [], []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        samples.append(result["seconds"])
+        loaded = result["loaded"]
+    return {
+        "median_ms": round(1000 * statistics.median(samples), 1),
+        "max_ms": round(1000 * max(samples), 1),
+        "heavy_modules_loaded": loaded,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url: str):
+    """ Return (status, JSON body), or None while the server is not accepting connections. """
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return None
+
+
+def measure_first_request(timeout: float) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.server:app", "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        health_seconds = ready_seconds = None
+        report = None
+        while time.perf_counter() - started < timeout:
+            if health_seconds is None:
+                if get(f"{base}/health"):
+                    health_seconds = time.perf_counter() - started
+                    continue
+            else:
+                result = get(f"{base}/ready")
+                if result and result[0] == 200:
+                    ready_seconds = time.perf_counter() - started
+                    report = result[1]
+                    break
+            time.sleep(0.01)
+        return {
+            "first_health_ms": round(1000 * health_seconds, 1) if health_seconds is not None else None,
+            "ready_ms": round(1000 * ready_seconds, 1) if ready_seconds is not None else None,
+            "components_ms": {
+                name: round(1000 * component["seconds"], 1) if component["seconds"] is not None else None
+                for name, component in (report or {}).get("components", {}).items()
+            },
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time the import in")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for /ready")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="consent-startup-")
+    isolate_environment(workdir)
+    try:
+        results = {"import": measure_import(args.runs), "server": measure_first_request(args.timeout)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Local stand-ins for the OpenAI models, for benchmarks that must not touch the network."""
+import time
+import asyncio
+import hashlib
+from collections import deque
+from typing import Any, List, Optional
+
+import httpx
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeProvider:
+    """
+    Rate limits of a simulated model provider, shared by every fake model using it.
+
+    Calls beyond ``max_concurrency`` in flight or ``requests_per_minute`` in the
+    last minute are rejected with ``openai.RateLimitError`` (HTTP 429).
+    """
+
+    def __init__(self, max_concurrency: int = 8, requests_per_minute: int = 600):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.in_flight = 0
+        self.started = deque()
+        self.accepted = 0
+        self.rejected = 0
+
+    def admit(self):
+        now = time.monotonic()
+        while self.started and now - self.started[0] > 60:
+            self.started.popleft()
+        if self.in_flight >= self.max_concurrency or len(self.started) >= self.requests_per_minute:
+            self.rejected += 1
+            request = httpx.Request("POST", "https://fake-provider.local/v1/chat/completions")
+            response = httpx.Response(429, request=request, headers={"retry-after": "0"})
+            raise openai.RateLimitError("Rate limit reached (fake provider)", response=response, body=None)
+        self.started.append(now)
+        self.in_flight += 1
+        self.accepted += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+
+class FakeStreamingChat(BaseChatModel):
+    """ Chat model that streams ``output_tokens`` words at ``tokens_per_second`` after ``first_token_seconds``. """
+
+    provider: Optional[Any] = None
+    output_tokens: int = 30
+    tokens_per_second: float = 300.0
+    first_token_seconds: float = 0.05
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _text(self, messages: List[BaseMessage]) -> List[str]:
+        return [f"w{n} " for n in range(self.output_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._text(messages))))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = ""
+        async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+            text += chunk.message.content
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.provider:
+            self.provider.admit()
+        try:
+            await asyncio.sleep(self.first_token_seconds)
+            for token in self._text(messages):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    await run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+                await asyncio.sleep(1 / self.tokens_per_second)
+        finally:
+            if self.provider:
+                self.provider.release()
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic embeddings with the latency of a remote embedding API: each
+    request takes ``request_seconds`` plus ``seconds_per_text`` for every text.
+    """
+
+    def __init__(self, dimension: int, request_seconds: float = 0.15, seconds_per_text: float = 0.002):
+        self.dimension = dimension
+        self.request_seconds = request_seconds
+        self.seconds_per_text = seconds_per_text
+        self.requests = 0
+
+    def _vector(self, text: str) -> List[float]:
+        # Stable across processes, unlike hash(), so runs are reproducible
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+        return [((seed * (n + 1)) % 1000) / 1000 - 0.5 for n in range(self.dimension)]
+
+    def _latency(self, texts: List[str]) -> float:
+        self.requests += 1
+        return self.request_seconds + self.seconds_per_text * len(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._latency(texts))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._latency(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,302 @@
+"""
+Offline benchmark suite for ingestion, retrieval and generation.
+
+Runs the real backend (app.server, in-process) with no network access: embeddings
+and the chat model are replaced by the deterministic fakes in benchmarks.fakes,
+with configurable latency and tokens/s, Qdrant runs in memory, and every cache,
+upload folder and status database lives in a throwaway directory. Synthetic
+protocol PDFs of ``--pages`` sizes are generated first. Measured:
+
+- chunking: ``pdf_load_chunk`` pages/s and chunks/s per PDF size
+- indexing: chunks/s through the BatchIndexer, per PDF
+- search: filtered-search latency of ``QdrantRetrieverClient``, fresh and cached queries
+- generation: per-section time to first token and completion in ``ClinicalTrialGraph.astream``
+- streaming: bytes and events sent by ``/generate-consent-form`` in delta and snapshot mode
+
+Results are written as JSON; ``--compare`` prints the relative change of every
+metric against an earlier result, so regressions can be diffed between commits.
+Model names and other required settings come from the usual .env.
+
+Usage (from langserve_backend/):
+    python -m benchmarks.run --output bench-$(git rev-parse --short HEAD).json
+    python -m benchmarks.run --pages 10,100 --compare bench-abc1234.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Dict, List
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+
+def isolate_environment(workdir: str):
+    """ Point every store at ``workdir`` and turn off network use; must run before app.config is imported. """
+    for name in ("UPLOAD_FOLDER", "PROCESSED_FOLDER", "CACHE_DIR"):
+        path = os.path.join(workdir, name.lower())
+        os.makedirs(path)
+        # Config joins these onto the app directory
+        os.environ[name] = os.path.relpath(path, APP_DIR)
+    os.environ["DB_FILE"] = os.path.relpath(os.path.join(workdir, "file_status.json"), APP_DIR)
+    os.environ["STATUS_DB_FILE"] = os.path.join(workdir, "file_status.db")
+    os.environ["QDRANT_MODE"] = "memory"
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    # Never sent anywhere: both models are replaced by fakes
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+
+def wait_until_ready(client, timeout: float = 120.0):
+    """ Poll /ready until the server's components have started. """
+    deadline = time.monotonic() + timeout
+    while (response := client.get("/ready")).status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server not ready after {timeout:.0f}s: {response.json()}")
+        time.sleep(0.05)
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    ordered = sorted(seconds)
+    return {
+        "p50_ms": round(1000 * statistics.median(ordered), 2),
+        "p95_ms": round(1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 2),
+        "max_ms": round(1000 * ordered[-1], 2),
+    }
+
+
+def bench_chunking(pdfs: Dict[int, str]) -> List[dict]:
+    from app.pdf_loader_chunker import pdf_load_chunk
+
+    # Loads the tokenizer outside the measurement
+    pdf_load_chunk(next(iter(pdfs.values())))
+    rows = []
+    for pages, path in pdfs.items():
+        started = time.perf_counter()
+        docs = pdf_load_chunk(path)
+        seconds = time.perf_counter() - started
+        rows.append({
+            "pages": pages,
+            "pdf_kb": round(os.path.getsize(path) / 1024, 1),
+            "chunks": len(docs),
+            "seconds": round(seconds, 3),
+            "pages_per_second": round(pages / seconds, 1),
+            "chunks_per_second": round(len(docs) / seconds, 1),
+        })
+    return rows
+
+
+async def bench_indexing(retriever_client, pdfs: Dict[int, str]) -> List[dict]:
+    from app.ingestion import BatchIndexer
+    from app.pdf_loader_chunker import pdf_load_chunk
+
+    rows = []
+    for pages, path in pdfs.items():
+        docs = await asyncio.to_thread(pdf_load_chunk, path)
+        indexer = BatchIndexer(retriever_client)
+        started = time.perf_counter()
+        try:
+            await indexer.add(docs)
+            await indexer.finish()
+        finally:
+            indexer.cancel()
+        seconds = time.perf_counter() - started
+        rows.append({
+            "pages": pages,
+            "chunks": len(docs),
+            "seconds": round(seconds, 3),
+            "chunks_per_second": round(len(docs) / seconds, 1),
+        })
+    return rows
+
+
+async def bench_search(retriever_client, titles: List[str], queries: int) -> dict:
+    from benchmarks.synthetic import synthetic_sentence
+
+    rng = random.Random(7)
+    texts = [synthetic_sentence(rng) for _ in range(queries)]
+    fresh, cached = [], []
+    for title in titles:
+        retriever = retriever_client.get_retriever_with_filter([title])
+        for text in texts:
+            started = time.perf_counter()
+            await retriever.ainvoke(f"{title} {text}")
+            fresh.append(time.perf_counter() - started)
+        for text in texts:
+            started = time.perf_counter()
+            await retriever.ainvoke(f"{title} {text}")
+            cached.append(time.perf_counter() - started)
+    return {"queries": len(fresh), "fresh": percentiles(fresh), "cached": percentiles(cached)}
+
+
+async def bench_generation(graph, title: str) -> dict:
+    from app.config import Config
+    from app.queries import SECTION_QUERIES
+
+    run_config = {
+        "configurable": {
+            "files": [title],
+            "document_hashes": None,
+            "regenerate": True,
+            "request_id": "benchmark",
+            "llm_priority": "interactive",
+            "context_mode": Config.RAG_CONTEXT_MODE,
+        }
+    }
+    first_token, completed = {}, {}
+    started = time.perf_counter()
+    async for mode, chunk in graph.astream(run_config):
+        now = time.perf_counter() - started
+        if mode == "custom":
+            first_token.setdefault(chunk["section"], now)
+        elif mode == "updates":
+            for node_output in chunk.values():
+                for section in SECTION_QUERIES:
+                    if section in (node_output or {}):
+                        completed[section] = now
+    return {
+        "context_mode": Config.RAG_CONTEXT_MODE,
+        "seconds": round(time.perf_counter() - started, 3),
+        "sections": {
+            section: {
+                "first_token_ms": round(1000 * first_token[section], 1) if section in first_token else None,
+                "complete_ms": round(1000 * completed[section], 1) if section in completed else None,
+            }
+            for section in SECTION_QUERIES
+        },
+    }
+
+
+def bench_streaming(client, title: str) -> List[dict]:
+    # The test client delivers the response body in one piece, so only sizes are measured
+    rows = []
+    for mode in ("delta", "snapshot"):
+        body = {"files": [{"name": title}], "mode": mode, "regenerate": True}
+        started = time.perf_counter()
+        with client.stream("POST", "/generate-consent-form", json=body) as response:
+            payload = b"".join(response.iter_bytes())
+        rows.append({
+            "mode": mode,
+            "bytes": len(payload),
+            "sse_events": payload.count(b"\n\n") if mode == "delta" else None,
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+    return rows
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    """ Map every numeric leaf to a dotted path; list items are keyed by their pages/mode. """
+    if isinstance(value, bool):
+        return {}
+    if isinstance(value, (int, float)):
+        return {prefix: value}
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            label = child.get("pages", child.get("mode", index)) if isinstance(child, dict) else index
+            items.update(flatten(child, f"{prefix}[{label}]"))
+    return items
+
+
+def compare(baseline: dict, current: dict):
+    base, new = flatten(baseline["results"]), flatten(current["results"])
+    print(f"{'metric':60} {baseline['commit']:>12} {current['commit']:>12}  change")
+    for key in sorted(base.keys() & new.keys()):
+        change = f"{(new[key] - base[key]) / base[key]:+.1%}" if base[key] else ""
+        print(f"{key:60} {base[key]:>12} {new[key]:>12}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="10,100,500", help="comma-separated synthetic PDF sizes")
+    parser.add_argument("--queries", type=int, default=20, help="filtered searches per document")
+    parser.add_argument("--embed-request-ms", type=float, default=150.0, help="fake embedding latency per request")
+    parser.add_argument("--embed-text-ms", type=float, default=2.0, help="fake embedding latency per text")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="fake chat model time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=150.0)
+    parser.add_argument("--output-tokens", type=int, default=200, help="tokens per generated section")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="consent-bench-")
+    isolate_environment(workdir)
+    try:
+        from fastapi.testclient import TestClient
+
+        from app import qdrant_retriever, rag_builder
+        from app.config import Config
+        from benchmarks.fakes import FakeEmbeddings, FakeStreamingChat
+        from benchmarks.synthetic import write_synthetic_pdf
+
+        embeddings = FakeEmbeddings(
+            Config.OPENAI_EMBEDDING_MODEL_DIMENSION, args.embed_request_ms / 1000, args.embed_text_ms / 1000
+        )
+        chat = FakeStreamingChat(
+            output_tokens=args.output_tokens,
+            tokens_per_second=args.tokens_per_second,
+            first_token_seconds=args.first_token_ms / 1000,
+        )
+        # The server builds its clients on startup from these module names, so the fakes go in first
+        qdrant_retriever.OpenAIEmbeddings = lambda **kwargs: embeddings
+        rag_builder.ChatOpenAI = lambda **kwargs: chat
+        from app import server
+
+        sizes = [int(size) for size in args.pages.split(",")]
+        pdfs = {
+            pages: write_synthetic_pdf(os.path.join(Config.UPLOAD_FOLDER, f"protocol-{pages}p.pdf"), pages)
+            for pages in sizes
+        }
+        titles = [os.path.basename(path) for path in pdfs.values()]
+
+        results = {}
+        with TestClient(server.app) as client:
+            wait_until_ready(client)
+            retriever_client = server.components.get("vector_store")
+            # Async benchmarks run on the app's own event loop, as requests do
+            run = client.portal.call
+            results["chunking"] = bench_chunking(pdfs)
+            results["indexing"] = run(bench_indexing, retriever_client, pdfs)
+            # Searches measure Qdrant and the caches, not the embedding API
+            embeddings.request_seconds = embeddings.seconds_per_text = 0.0
+            results["search"] = run(bench_search, retriever_client, titles, args.queries)
+            results["generation"] = run(bench_generation, server.components.get("generation"), titles[-1])
+            results["streaming"] = bench_streaming(client, titles[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Deterministic synthetic clinical-trial protocol text and PDFs for the benchmarks."""
+import random
+from typing import List
+
+SECTION_TITLES = [
+    "Study Objectives",
+    "Background and Rationale",
+    "Study Design",
+    "Eligibility Criteria",
+    "Study Procedures",
+    "Risks and Adverse Events",
+    "Potential Benefits",
+    "Data Safety Monitoring",
+    "Statistical Analysis Plan",
+    "Informed Consent Process",
+]
+
+VOCABULARY = (
+    "patient participant child parent guardian investigator protocol randomized placebo "
+    "controlled trial sepsis immune monitoring inflammation intensive care unit dose "
+    "infusion blood draw sample laboratory analysis adverse event serious outcome mortality "
+    "enrollment eligibility criteria network hospital site coordinator consent assent "
+    "follow-up survey questionnaire pharmacokinetic biomarker cytokine interleukin day "
+    "baseline endpoint primary secondary safety efficacy data monitoring board review"
+).split()
+
+
+def synthetic_sentence(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 28))]
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_page(rng: random.Random, page_number: int, words_per_page: int = 450) -> str:
+    """ Return one page of protocol-like text with a heading and several paragraphs. """
+    lines = [f"{page_number // 10 + 1}.{page_number % 10} {rng.choice(SECTION_TITLES)}"]
+    word_count = 0
+    while word_count < words_per_page:
+        paragraph = " ".join(synthetic_sentence(rng) for _ in range(rng.randint(3, 7)))
+        word_count += len(paragraph.split())
+        # Like PyMuPDF's extraction: one line per printed line, rarely a blank line between paragraphs
+        lines.extend(paragraph[i:i + 95] for i in range(0, len(paragraph), 95))
+        if rng.random() < 0.2:
+            lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def synthetic_pages(pages: int, seed: int = 42) -> List[str]:
+    """ Return the text of a synthetic protocol with the given number of pages. """
+    rng = random.Random(seed)
+    return [synthetic_page(rng, page_number) for page_number in range(pages)]
+
+
+def synthetic_protocol(pages: int, seed: int = 42) -> str:
+    return "".join(synthetic_pages(pages, seed))
+
+
+def write_synthetic_pdf(path: str, pages: int, seed: int = 42) -> str:
+    """ Write a letter-size PDF with one synthetic protocol page per PDF page and return its path. """
+    import pymupdf
+
+    with pymupdf.open() as pdf:
+        for text in synthetic_pages(pages, seed):
+            page = pdf.new_page(width=612, height=792)
+            page.insert_textbox(pymupdf.Rect(54, 54, 558, 738), text, fontsize=8, fontname="helv")
+        pdf.save(path, garbage=3, deflate=True)
+    return path
@@ -0,0 +1,139 @@
+"""
+Shared test setup: every store in a throwaway directory, Qdrant in memory, a local
+tokenizer and the OpenAI models replaced by the offline fakes in benchmarks.fakes.
+
+Settings are read when app.config is imported, so the environment is set up here,
+before any test module imports the app.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+import tiktoken
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+
+def isolate_environment(workdir: str):
+    """ Point every store at ``workdir`` and turn off network use; must run before app.config is imported. """
+    for name in ("UPLOAD_FOLDER", "PROCESSED_FOLDER", "CACHE_DIR"):
+        path = os.path.join(workdir, name.lower())
+        os.makedirs(path)
+        # Config joins these onto the app directory
+        os.environ[name] = os.path.relpath(path, APP_DIR)
+    os.environ["DB_FILE"] = os.path.relpath(os.path.join(workdir, "file_status.json"), APP_DIR)
+    os.environ["STATUS_DB_FILE"] = os.path.join(workdir, "file_status.db")
+    os.environ["QDRANT_MODE"] = "memory"
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    # Never sent anywhere: both models are replaced by fakes
+    os.environ.setdefault("OPENAI_API_KEY", "offline-tests")
+
+
+def wait_until_ready(client, timeout: float = 120.0):
+    """ Poll /ready until the server's components have started. """
+    deadline = time.monotonic() + timeout
+    while (response := client.get("/ready")).status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server not ready after {timeout:.0f}s: {response.json()}")
+        time.sleep(0.05)
+
+
+# Required settings without a default, for runs without a .env; a .env or the environment wins
+for name, value in {
+    "OPENAI_MODEL_NAME": "gpt-4o",
+    "OPENAI_EMBEDDING_MODEL_NAME": "text-embedding-3-small",
+    "OPENAI_EMBEDDING_MODEL_DIMENSION": "1536",
+    "COLLECTION_NAME": "clinical-trials-test",
+    "QDRANT_URL": "http://localhost:6333",
+    "LANGCHAIN_PROJECT": "tests",
+    "LANGCHAIN_ENDPOINT": "http://localhost",
+    "CHUNK_SIZE": "2000",
+    "CHUNK_OVERLAP": "200",
+}.items():
+    os.environ.setdefault(name, value)
+
+WORKDIR = tempfile.mkdtemp(prefix="consent-tests-")
+isolate_environment(WORKDIR)
+atexit.register(shutil.rmtree, WORKDIR, ignore_errors=True)
+
+# Byte-level BPE: one token per UTF-8 byte, so token windows regularly split multibyte
+# characters. Built in memory, unlike the OpenAI encodings tiktoken downloads on first use.
+LOCAL_ENCODING = tiktoken.Encoding(
+    name="local_bytes",
+    pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+    mergeable_ranks={bytes([byte]): byte for byte in range(256)},
+    special_tokens={},
+)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def encoding():
+    """ Serve LOCAL_ENCODING for every model, so the suite never downloads a tokenizer. """
+    from app.pdf_loader_chunker import get_encoding
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(tiktoken, "encoding_for_model", lambda model_name: LOCAL_ENCODING)
+        patch.setattr(tiktoken, "get_encoding", lambda encoding_name: LOCAL_ENCODING)
+        get_encoding.cache_clear()
+        yield LOCAL_ENCODING
+    get_encoding.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def fake_models():
+    """ Deterministic, instant embeddings and chat model, installed where the server builds its clients. """
+    from app import qdrant_retriever, rag_builder
+    from app.config import Config
+    from benchmarks.fakes import FakeEmbeddings, FakeStreamingChat
+
+    class RecordingChat(FakeStreamingChat):
+        """ Records every prompt and answers with text that differs from call to call. """
+        prompts: List[str] = []
+
+        def _text(self, messages):
+            self.prompts.append(messages[-1].content)
+            return [f"answer{len(self.prompts)}-w{n} " for n in range(self.output_tokens)]
+
+    embeddings = FakeEmbeddings(Config.OPENAI_EMBEDDING_MODEL_DIMENSION, request_seconds=0.0, seconds_per_text=0.0)
+    chat = RecordingChat(output_tokens=20, tokens_per_second=10000.0, first_token_seconds=0.0)
+    qdrant_retriever.OpenAIEmbeddings = lambda **kwargs: embeddings
+    rag_builder.ChatOpenAI = lambda **kwargs: chat
+    return embeddings, chat
+
+
+@pytest.fixture(scope="session")
+def client(fake_models):
+    """ A TestClient on the real app, once every required component has started. """
+    from fastapi.testclient import TestClient
+    from app import server
+    from app.ingestion import IngestionQueue
+
+    with pytest.MonkeyPatch.context() as patch:
+        # Spawned parse processes would not see the local encoding; threads share it
+        patch.setattr(IngestionQueue, "_create_process_pool", lambda self: ThreadPoolExecutor(self.parse_processes))
+        with TestClient(server.app) as client:
+            wait_until_ready(client)
+            yield client
+
+
+@pytest.fixture(scope="session")
+def indexed_protocol(client):
+    """ Upload a small synthetic protocol and return its filename once it is indexed. """
+    from benchmarks.synthetic import write_synthetic_pdf
+
+    path = write_synthetic_pdf(os.path.join(WORKDIR, "protocol.pdf"), 3)
+    with open(path, "rb") as f:
+        response = client.post("/upload", files=[("files", ("protocol.pdf", f.read(), "application/pdf"))])
+    assert response.status_code == 200
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        records = {record["name"]: record for record in client.get("/existing-files").json()["files"]}
+        if records.get("protocol.pdf", {}).get("status") == "indexed":
+            return "protocol.pdf"
+        time.sleep(0.05)
+    raise AssertionError(f"protocol.pdf was not indexed: {records}")
@@ -0,0 +1,105 @@
+import pytest
+
+from app.pdf_loader_chunker import ChunkStreamState, TokenChunker
+
+PARAGRAPH = (
+    "Participants will receive the study drug once daily for twelve weeks. "
+    "Blood samples are taken at every visit to measure drug levels. "
+    "You may leave the study at any time without losing any benefits.\n\n"
+)
+
+
+def make_pages(count: int):
+    return [(number, f"Page {number} · µg.\n" + PARAGRAPH * (3 + number % 4)) for number in range(count)]
+
+
+@pytest.fixture
+def chunker():
+    return TokenChunker(chunk_size=120, chunk_overlap=20)
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TokenChunker(chunk_size=100, chunk_overlap=100)
+
+
+def test_split_text_respects_chunk_size(chunker):
+    chunks = chunker.split_text(PARAGRAPH * 20)
+    assert len(chunks) > 1
+    assert all(len(chunker.encoding.encode(chunk)) <= chunker.chunk_size for chunk in chunks)
+
+
+@pytest.mark.parametrize("text", [
+    pytest.param("Dose ≥ 5 µg/kg — Überwachung der Nüchternglukose ≤ 7 mmol/l; 副作用 selten. " * 40, id="prose"),
+    # Nothing to snap to, so windows end on raw token offsets
+    pytest.param("µg≥副" * 200, id="no-breaks"),
+])
+def test_chunks_of_non_ascii_text_round_trip(chunker, text):
+    # One token per byte, so windows end inside the two- to three-byte characters
+    data = text.encode("utf-8")
+
+    spans = chunker.split_offsets(data)
+
+    assert spans[0][0] == 0 and spans[-1][1] == len(data)
+    for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+        assert start <= previous_end
+    for start, end in spans:
+        # Strict decoding: no character is cut
+        assert data[start:end].decode("utf-8") in text
+    assert all(chunk in text for chunk in chunker.split_text(text))
+
+
+def test_feed_keeps_multibyte_characters_across_windows():
+    # Without overlap the chunks put the text back together exactly
+    chunker = TokenChunker(chunk_size=50, chunk_overlap=0)
+    pages = [(number, "µg≥副" * 37) for number in range(6)]
+    state = ChunkStreamState(document_title="protocol.pdf")
+    documents = []
+    for page in pages:
+        batch, state = chunker.feed(state, [page], final=page is pages[-1])
+        documents.extend(batch)
+
+    assert "".join(document.page_content for document in documents) == "".join(text for _, text in pages)
+    assert all(len(chunker.encoding.encode(document.page_content)) <= 50 for document in documents)
+
+
+@pytest.mark.parametrize("window", [1, 2, 5])
+def test_feed_in_windows_matches_whole_text(chunker, window):
+    pages = make_pages(9)
+    expected = chunker.split_text("".join(text for _, text in pages))
+
+    state = ChunkStreamState(document_title="protocol.pdf", content_hash="abc")
+    documents = []
+    for start in range(0, len(pages), window):
+        batch, state = chunker.feed(state, pages[start:start + window], final=start + window >= len(pages))
+        documents.extend(batch)
+
+    assert [document.page_content for document in documents] == expected
+    assert [document.metadata["chunk_index"] for document in documents] == list(range(len(expected)))
+    assert state.data == b""
+
+
+def test_feed_records_pages_and_document_metadata(chunker):
+    pages = make_pages(6)
+    documents, _ = chunker.feed(ChunkStreamState(document_title="protocol.pdf", content_hash="abc"), pages, final=True)
+
+    for document in documents:
+        metadata = document.metadata
+        assert metadata["document_title"] == "protocol.pdf"
+        assert metadata["content_hash"] == "abc"
+        assert metadata["page"] <= metadata["page_end"]
+        # The chunk starts with text from the page it is attributed to
+        assert document.page_content[:40] in pages[metadata["page"]][1]
+    assert documents[0].metadata["page"] == 0
+    assert documents[-1].metadata["page_end"] == 5
+
+
+def test_feed_keeps_incomplete_tail_until_final(chunker):
+    state = ChunkStreamState(document_title="protocol.pdf")
+    documents, state = chunker.feed(state, [(0, "A short page.")])
+    assert documents == []
+    assert state.data == b"A short page."
+
+    documents, state = chunker.feed(state, [], final=True)
+    assert [document.page_content for document in documents] == ["A short page."]
+    assert "content_hash" not in documents[0].metadata
@@ -0,0 +1,82 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.context_builder import PASSAGE_SEPARATOR, ContextBuilder, merge_adjacent, overlap_length
+from app.pdf_loader_chunker import get_encoding
+
+
+def chunk(text: str, chunk_index: int, score: float, title: str = "protocol.pdf") -> Document:
+    return Document(page_content=text, metadata={"document_title": title, "chunk_index": chunk_index, "score": score})
+
+
+@pytest.fixture
+def builder():
+    return ContextBuilder(token_budget=200, min_score=0.2, score_margin=0.15, min_k=2)
+
+
+def tokens(builder: ContextBuilder, text: str) -> int:
+    return len(get_encoding(builder.model_name).encode(text))
+
+
+def test_select_applies_score_cutoff_and_min_k(builder):
+    documents = [chunk("a", 0, 0.9), chunk("b", 1, 0.8), chunk("c", 2, 0.7), chunk("d", 3, 0.1)]
+    assert [doc.page_content for doc in builder.select(documents)] == ["a", "b"]
+    # Fewer than min_k above the cutoff: the best min_k are kept anyway
+    assert [doc.page_content for doc in builder.select([chunk("d", 3, 0.1), chunk("c", 2, 0.15)])] == ["c", "d"]
+    unscored = [Document(page_content="x"), Document(page_content="y")]
+    assert builder.select(unscored) == unscored
+
+
+# Adjacent chunks share CHUNK_OVERLAP tokens, longer than overlap_length's probe
+OVERLAP = "Blood samples are taken at every visit to measure how much of the drug is in your body. "
+
+
+def test_overlap_length():
+    assert overlap_length("The dose is 5 mg daily. " + OVERLAP, OVERLAP + "Take it with food.") == len(OVERLAP)
+    assert overlap_length("The dose is 5 mg daily.", "5 mg daily. Take it with food.", probe_chars=8) == 11
+    assert overlap_length("The dose is 5 mg.", "Take it with food.") == 0
+    assert overlap_length("anything", "") == 0
+
+
+def test_merge_adjacent_drops_shared_overlap_and_duplicates():
+    documents = [
+        chunk("Visits take place weekly. " + OVERLAP, 4, 0.5),
+        chunk(OVERLAP + "Results are shared with you.", 5, 0.8),
+        chunk(OVERLAP + "Results are shared with you.", 5, 0.6),
+        chunk("Unrelated text.", 9, 0.3),
+    ]
+    passages = merge_adjacent(documents)
+
+    assert [passage.text for passage in passages] == [
+        "Visits take place weekly. " + OVERLAP + "Results are shared with you.",
+        "Unrelated text.",
+    ]
+    assert (passages[0].first_chunk, passages[0].last_chunk, passages[0].score) == (4, 5, 0.8)
+
+
+def test_pack_stays_within_budget_best_first_in_document_order(builder):
+    documents = [
+        chunk("B" * 80, 7, 0.9),
+        chunk("A" * 80, 2, 0.8),
+        chunk("C" * 80, 12, 0.7),
+    ]
+    context = builder.build(documents)
+
+    # Two chunks and their separators fit in 200 tokens, the third does not
+    assert context == "A" * 80 + PASSAGE_SEPARATOR + "B" * 80
+    assert tokens(builder, context) <= builder.token_budget
+
+
+def test_pack_counts_the_overlap_of_adjacent_chunks_once(builder):
+    first = "x" * 40 + OVERLAP
+    second = OVERLAP + "y" * 40
+    passages = builder.pack([chunk(first, 0, 0.9), chunk(second, 1, 0.8)])
+
+    # Over the budget on their own, within it once the overlap is counted once
+    assert tokens(builder, first) + tokens(builder, second) > builder.token_budget
+    assert [passage.text for passage in passages] == ["x" * 40 + OVERLAP + "y" * 40]
+
+
+def test_pack_truncates_a_best_chunk_over_budget(builder):
+    passages = builder.pack([chunk("z" * 500, 0, 0.9)], token_budget=50)
+    assert [passage.text for passage in passages] == ["z" * 50]
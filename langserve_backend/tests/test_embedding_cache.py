@@ -0,0 +1,64 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.embedding_cache import CachedEmbeddings
+from benchmarks.fakes import FakeEmbeddings
+
+
+@pytest.fixture
+def underlying():
+    return FakeEmbeddings(8, request_seconds=0.0, seconds_per_text=0.0)
+
+
+def cached(underlying, tmp_path, max_bytes=1024 * 1024) -> CachedEmbeddings:
+    return CachedEmbeddings(underlying, "text-embedding-3-small", str(tmp_path), max_bytes)
+
+
+def test_only_uncached_texts_are_embedded(underlying, tmp_path):
+    embeddings = cached(underlying, tmp_path)
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = asyncio.run(embeddings.aembed_documents(["b", "c"]))
+
+    assert underlying.requests == 2
+    assert first[0] == first[2]
+    assert second[0] == pytest.approx(first[1])
+    # The repeated "a" and the second "b" are hits
+    assert (embeddings.stats()["hits"], embeddings.stats()["misses"]) == (2, 3)
+
+    # Vectors are on disk, so a new instance (or worker) reuses them
+    reloaded = cached(underlying, tmp_path)
+    for vector, expected in zip(reloaded.embed_documents(["a", "b", "c"]), [first[0], first[1], second[1]]):
+        assert vector == pytest.approx(expected)
+    assert underlying.requests == 2
+
+
+def test_least_recently_used_vectors_are_evicted(underlying, tmp_path):
+    # Room for two float32 vectors of 8 dimensions
+    embeddings = cached(underlying, tmp_path, max_bytes=64)
+    embeddings.embed_documents(["a", "b"])
+    embeddings.embed_documents(["a"])
+    embeddings.embed_documents(["c"])
+
+    stats = embeddings.stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 64)
+    misses = stats["misses"]
+    embeddings.embed_documents(["a", "c"])
+    assert embeddings.stats()["misses"] == misses
+    embeddings.embed_documents(["b"])
+    assert embeddings.stats()["misses"] == misses + 1
+
+
+def test_pinned_queries_count_every_hit(underlying, tmp_path):
+    embeddings = cached(underlying, tmp_path)
+    embeddings.precompute_queries(["What are the risks?"])
+    requests = underlying.requests
+    hits = embeddings.stats()["hits"]
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(embeddings.embed_query, ["What are the risks?"] * 2000))
+
+    assert underlying.requests == requests
+    assert embeddings.stats()["hits"] == hits + 2000
+    assert embeddings.stats()["pinned_queries"] == 1
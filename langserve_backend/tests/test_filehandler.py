@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import time
+
+import pytest
+
+from app.config import Config
+from app.filehandler import EMBEDDING, FAILED, INDEXED, PARSING, QUEUED, FileHandler
+
+
+@pytest.fixture
+def handler(tmp_path):
+    return FileHandler(str(tmp_path / "file_status.db"), str(tmp_path / "file_status.json"))
+
+
+def test_update_file_merges_fields(handler):
+    created = handler.update_file("protocol.pdf", status=QUEUED, size_bytes=10)
+    updated = handler.update_file("protocol.pdf", status=PARSING, page_count=3)
+
+    assert updated["status"] == PARSING
+    assert updated["size_bytes"] == 10
+    assert updated["page_count"] == 3
+    assert updated["created_at"] == created["created_at"]
+    assert updated["updated_at"] >= created["updated_at"]
+    assert handler.load_file_status() == {"protocol.pdf": PARSING}
+
+
+def test_update_file_rejects_unknown_fields(handler):
+    with pytest.raises(ValueError):
+        handler.update_file("protocol.pdf", colour="red")
+
+
+@pytest.mark.parametrize("records, expected", [
+    (
+        {"a.pdf": "processed", "b.pdf": "processing", "c.pdf": "Parse error"},
+        {"a.pdf": {"status": INDEXED}, "b.pdf": {"status": QUEUED}, "c.pdf": {"status": FAILED, "error": "Parse error"}},
+    ),
+    (
+        {"a.pdf": {"status": INDEXED, "chunk_count": 4, "unknown": 1}},
+        {"a.pdf": {"status": INDEXED, "chunk_count": 4}},
+    ),
+])
+def test_legacy_json_is_migrated_once(tmp_path, records, expected):
+    json_path = tmp_path / "file_status.json"
+    json_path.write_text(json.dumps(records))
+
+    handler = FileHandler(str(tmp_path / "file_status.db"), str(json_path))
+
+    files = handler.list_files()
+    for filename, fields in expected.items():
+        assert {key: files[filename].get(key) for key in fields} == fields
+    assert not json_path.exists()
+    assert (tmp_path / "file_status.json.migrated").exists()
+
+    # A JSON file that reappears is not imported over existing records
+    json_path.write_text(json.dumps({"d.pdf": "processed"}))
+    assert "d.pdf" not in FileHandler(str(tmp_path / "file_status.db"), str(json_path)).list_files()
+
+
+def test_claim_file_only_succeeds_from_allowed_states(handler):
+    assert handler.claim_file("protocol.pdf", QUEUED, (QUEUED, INDEXED, FAILED))
+    assert handler.claim_file("protocol.pdf", PARSING, (QUEUED,))
+    # A second worker cannot take the job while the first one holds it
+    assert not handler.claim_file("protocol.pdf", PARSING, (QUEUED,), stale_before=time.time() - 60)
+    assert not handler.claim_file("protocol.pdf", QUEUED, (QUEUED, INDEXED, FAILED))
+    assert handler.get_file("protocol.pdf")["status"] == PARSING
+
+
+def test_claim_file_takes_over_stale_active_jobs(handler):
+    handler.update_file("protocol.pdf", status=EMBEDDING, attempts=1)
+    assert handler.claim_file("protocol.pdf", PARSING, (QUEUED,), stale_before=time.time() + 1, attempts=2)
+    assert handler.get_file("protocol.pdf")["attempts"] == 2
+
+
+def test_find_by_hash_prefers_indexed_and_sees_in_progress(handler):
+    handler.update_file("failed.pdf", status=FAILED, content_hash="h")
+    assert handler.find_by_hash("h") is None
+
+    handler.update_file("queued.pdf", status=QUEUED, content_hash="h")
+    assert handler.find_by_hash("h")[0] == "queued.pdf"
+
+    handler.update_file("indexed.pdf", status=INDEXED, content_hash="h")
+    filename, record = handler.find_by_hash("h")
+    assert filename == "indexed.pdf"
+    assert record["status"] == INDEXED
+
+
+def test_get_content_hashes_hashes_legacy_uploads_once(handler):
+    content = b"%PDF-1.4 legacy upload"
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    with open(os.path.join(Config.UPLOAD_FOLDER, "legacy.pdf"), "wb") as f:
+        f.write(content)
+    handler.update_file("legacy.pdf", status=INDEXED)
+    handler.update_file("new.pdf", status=INDEXED, content_hash="stored")
+
+    assert handler.get_content_hashes(["new.pdf", "legacy.pdf"]) == ["stored", hashlib.sha256(content).hexdigest()]
+    assert handler.get_file("legacy.pdf")["content_hash"] == hashlib.sha256(content).hexdigest()
+    assert handler.get_content_hashes(["new.pdf", "missing.pdf"]) is None
@@ -0,0 +1,64 @@
+import pytest
+
+from app.form_store import FormStore
+from app.pdf_renderer import content_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FormStore(str(tmp_path / "forms.db"), ttl_seconds=60, max_versions=3)
+
+
+def test_versions_keep_sources_and_inherit_files(store):
+    form_id = store.new_form_id()
+    first = store.add_version(form_id, {"risks": "a", "benefits": "b"}, "generated", ["protocol.pdf"])
+    second = store.add_version(form_id, {"risks": "a2", "benefits": "b"}, "revised")
+
+    assert (first["version"], second["version"]) == (1, 2)
+    assert second["files"] == ["protocol.pdf"]
+    assert store.get(form_id)["sections"] == {"risks": "a2", "benefits": "b"}
+    assert store.get(form_id, 1)["sections"]["risks"] == "a"
+    assert [version["source"] for version in store.versions(form_id)] == ["generated", "revised"]
+    assert store.get("unknown") is None
+
+
+def test_content_key_is_shared_by_identical_sections(store):
+    form_id = store.new_form_id()
+    sections = {"risks": "a", "benefits": "b"}
+    first = store.add_version(form_id, sections, "generated")
+    edited = store.add_version(form_id, {"risks": "changed", "benefits": "b"}, "edited")
+    reverted = store.add_version(form_id, sections, "edited")
+
+    assert first["content_key"] == content_key(sections)
+    assert edited["content_key"] != first["content_key"]
+    assert reverted["content_key"] == first["content_key"]
+
+
+def test_oldest_versions_are_dropped_beyond_max_versions(store):
+    form_id = store.new_form_id()
+    for number in range(5):
+        store.add_version(form_id, {"risks": str(number)}, "edited")
+
+    assert [version["version"] for version in store.versions(form_id)] == [3, 4, 5]
+    assert store.get(form_id, 1) is None
+
+
+def test_forms_expire_together_after_their_latest_version(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.form_store.time.time", lambda: now[0])
+    form_id = store.new_form_id()
+    store.add_version(form_id, {"risks": "a"}, "generated")
+    now[0] += 50
+    store.add_version(form_id, {"risks": "b"}, "edited")
+
+    # The new version extends the expiry of the older one
+    now[0] += 50
+    assert store.get(form_id, 1) is not None
+    now[0] += 11
+    assert store.get(form_id) is None
+    assert store.versions(form_id) == []
+
+    # Expired forms are deleted on the next write
+    store.add_version(store.new_form_id(), {"risks": "c"}, "generated")
+    count = store._connection().execute("SELECT COUNT(*) FROM form_versions WHERE form_id = ?", (form_id,))
+    assert count.fetchone()[0] == 0
@@ -0,0 +1,166 @@
+import asyncio
+import os
+
+import pytest
+
+from app.config import Config
+from app.filehandler import EMBEDDING, FAILED, INDEXED, PARSING, QUEUED, FileHandler
+from app.ingestion import IngestionQueue
+
+
+class FakeRetrieverClient:
+    """ Records deletes and reports a fixed set of indexed documents. """
+
+    def __init__(self, indexed_titles=()):
+        self.indexed_titles = set(indexed_titles)
+        self.deleted = []
+
+    def get_indexed_document_titles(self):
+        return set(self.indexed_titles)
+
+    def delete_document(self, document_title):
+        self.deleted.append(document_title)
+
+    def invalidate_document(self, document_title):
+        pass
+
+
+@pytest.fixture
+def handler(tmp_path):
+    return FileHandler(str(tmp_path / "file_status.db"), str(tmp_path / "file_status.json"))
+
+
+def make_queue(handler, retriever_client=None, **kwargs) -> IngestionQueue:
+    # The worker tasks and parse processes of start() are left out; tests drive the steps
+    ingestion = IngestionQueue(handler, retriever_client or FakeRetrieverClient(), workers=1, **kwargs)
+    ingestion.queue = asyncio.Queue()
+    return ingestion
+
+
+def queued(ingestion: IngestionQueue):
+    return [ingestion.queue.get_nowait() for _ in range(ingestion.queue.qsize())]
+
+
+def upload(filename: str) -> str:
+    path = os.path.join(Config.UPLOAD_FOLDER, filename)
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4")
+    return path
+
+
+def test_only_one_worker_claims_a_job(handler):
+    async def run():
+        first, second = make_queue(handler), make_queue(handler)
+        assert await first.enqueue("protocol.pdf", content_hash="h")
+        assert await first._claim("protocol.pdf")
+        assert not await second._claim("protocol.pdf")
+        # The loser looks again once the lease can have expired
+        assert len(second.requeue_tasks) == 1
+        await second.stop()
+        assert not second.requeue_tasks
+
+    asyncio.run(run())
+    assert handler.get_file("protocol.pdf")["status"] == PARSING
+
+
+def test_enqueue_refuses_a_file_that_is_being_ingested(handler, tmp_path):
+    async def run():
+        ingestion = make_queue(handler)
+        handler.update_file("consent-amendment.pdf", status=EMBEDDING)
+        source = tmp_path / "consent-amendment.pdf.part"
+        source.write_bytes(b"%PDF-1.4 new")
+
+        assert not await ingestion.enqueue("consent-amendment.pdf", source_path=str(source))
+        assert source.exists()
+        assert queued(ingestion) == []
+
+        handler.update_file("consent-amendment.pdf", status=INDEXED)
+        assert await ingestion.enqueue("consent-amendment.pdf", source_path=str(source))
+        assert not source.exists()
+        assert queued(ingestion) == ["consent-amendment.pdf"]
+
+    asyncio.run(run())
+    assert handler.get_file("consent-amendment.pdf")["status"] == QUEUED
+
+
+def test_abandoned_job_is_claimed_after_its_lease(handler):
+    async def run():
+        ingestion = make_queue(handler, claim_lease_seconds=0.05)
+        handler.update_file("protocol.pdf", status=EMBEDDING)
+        assert not await ingestion._claim("protocol.pdf")
+        await asyncio.sleep(0.1)
+        assert await ingestion._claim("protocol.pdf")
+        await ingestion.stop()
+
+    asyncio.run(run())
+
+
+def test_running_job_keeps_its_claim(handler, monkeypatch):
+    async def ingest(filename):
+        await asyncio.sleep(0.2)
+
+    async def run():
+        owner, other = make_queue(handler, claim_lease_seconds=0.08), make_queue(handler, claim_lease_seconds=0.08)
+        monkeypatch.setattr(owner, "_ingest", ingest)
+        await owner.enqueue("protocol.pdf")
+        assert await owner._claim("protocol.pdf")
+        job = asyncio.create_task(owner._run_job("protocol.pdf"))
+        await asyncio.sleep(0.15)
+        # The heartbeat has refreshed the record, so the lease has not run out
+        assert not await other._claim("protocol.pdf")
+        await job
+        await other.stop()
+
+    asyncio.run(run())
+
+
+def test_failed_job_is_retried_then_marked_failed(handler):
+    async def run():
+        retriever_client = FakeRetrieverClient()
+        ingestion = make_queue(handler, retriever_client, max_retries=1)
+        handler.update_file("protocol.pdf", status=EMBEDDING)
+
+        await ingestion._handle_failure("protocol.pdf", RuntimeError("embedding API down"))
+        record = handler.get_file("protocol.pdf")
+        assert (record["status"], record["attempts"], record["error"]) == (QUEUED, 1, "embedding API down")
+        assert len(ingestion.requeue_tasks) == 1
+        assert retriever_client.deleted == []
+
+        await ingestion._handle_failure("protocol.pdf", RuntimeError("still down"))
+        record = handler.get_file("protocol.pdf")
+        assert (record["status"], record["attempts"]) == (FAILED, 2)
+        # Points upserted before the final failure are removed
+        assert retriever_client.deleted == ["protocol.pdf"]
+        await ingestion.stop()
+
+    asyncio.run(run())
+
+
+def test_reconcile_resumes_interrupted_and_missing_documents(handler):
+    for filename in ("parsing.pdf", "embedding.pdf", "queued.pdf", "no-points.pdf", "indexed.pdf", "empty.pdf"):
+        upload(filename)
+    handler.update_file("parsing.pdf", status=PARSING)
+    handler.update_file("embedding.pdf", status=EMBEDDING)
+    handler.update_file("queued.pdf", status=QUEUED)
+    handler.update_file("no-points.pdf", status=INDEXED, chunk_count=4)
+    handler.update_file("indexed.pdf", status=INDEXED, chunk_count=4)
+    handler.update_file("empty.pdf", status=INDEXED, chunk_count=0)
+    handler.update_file("gone.pdf", status=PARSING)
+    retriever_client = FakeRetrieverClient(["indexed.pdf", "untracked.pdf"])
+
+    async def run():
+        ingestion = make_queue(handler, retriever_client)
+        await ingestion.reconcile()
+        resumed = queued(ingestion)
+        # Interrupted jobs are reset to queued, so they are claimed at once rather than after the lease
+        for filename in resumed:
+            assert await ingestion._claim(filename)
+        return resumed
+
+    resumed = asyncio.run(run())
+    assert sorted(resumed) == ["embedding.pdf", "no-points.pdf", "parsing.pdf", "queued.pdf"]
+    statuses = handler.load_file_status()
+    assert statuses["indexed.pdf"] == INDEXED
+    assert statuses["empty.pdf"] == INDEXED
+    assert statuses["untracked.pdf"] == INDEXED
+    assert statuses["gone.pdf"] == FAILED
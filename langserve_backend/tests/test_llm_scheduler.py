@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from app.llm_scheduler import LLMScheduler, TokenBucket
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeModel:
+    """ Streams ``output`` word by word; ``failures`` are raised, one per call, before or after the first word. """
+
+    def __init__(self, output: str = "one two three", failures=(), fail_after_first_chunk: bool = False):
+        self.output = output
+        self.failures = list(failures)
+        self.fail_after_first_chunk = fail_after_first_chunk
+        self.started = []
+
+    async def astream(self, input, config=None, **kwargs):
+        self.started.append(input)
+        await asyncio.sleep(0.01)
+        for n, word in enumerate(self.output.split()):
+            if self.failures and n == (1 if self.fail_after_first_chunk else 0):
+                raise self.failures.pop(0)
+            yield AIMessageChunk(content=f"{word} ")
+
+
+def scheduler(**kwargs) -> LLMScheduler:
+    settings = {
+        "max_concurrency": 1,
+        "requests_per_minute": 0,
+        "tokens_per_minute": 0,
+        "output_tokens_estimate": 10,
+        "max_retries": 2,
+        "retry_base_seconds": 0.001,
+        "retry_max_seconds": 0.01,
+        **kwargs,
+    }
+    return LLMScheduler(**settings)
+
+
+async def call(scheduler: LLMScheduler, model: FakeModel, input: str, request_id: str, priority: str = "interactive"):
+    config = {"configurable": {"request_id": request_id, "llm_priority": priority}}
+    return "".join([chunk.content async for chunk in scheduler.astream(model, input, config)])
+
+
+def test_requests_are_served_round_robin():
+    async def run():
+        llm_scheduler, model = scheduler(), FakeModel()
+        calls = [call(llm_scheduler, model, f"{request}{n}", request) for request in "AB" for n in range(3)]
+        await asyncio.gather(*calls)
+        return model.started
+
+    # The first call of B is not held up behind every section of A
+    assert asyncio.run(run()) == ["A0", "B0", "A1", "B1", "A2", "B2"]
+
+
+def test_interactive_calls_go_before_batch_calls():
+    async def run():
+        llm_scheduler, model = scheduler(), FakeModel()
+        await asyncio.gather(
+            call(llm_scheduler, model, "running", "R"),
+            call(llm_scheduler, model, "batch", "B", priority="batch"),
+            call(llm_scheduler, model, "interactive", "I"),
+        )
+        return model.started
+
+    assert asyncio.run(run()) == ["running", "interactive", "batch"]
+
+
+def test_concurrency_limit():
+    async def run():
+        llm_scheduler = scheduler(max_concurrency=2)
+        running, peak = 0, 0
+
+        class CountingModel(FakeModel):
+            async def astream(self, input, config=None, **kwargs):
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                try:
+                    async for chunk in super().astream(input, config, **kwargs):
+                        yield chunk
+                finally:
+                    running -= 1
+
+        model = CountingModel()
+        await asyncio.gather(*(call(llm_scheduler, model, str(n), f"r{n}") for n in range(6)))
+        return peak, llm_scheduler.stats()
+
+    peak, stats = asyncio.run(run())
+    assert peak == 2
+    assert (stats["admitted"], stats["running"], stats["queued"]) == (6, 0, 0)
+
+
+def test_retryable_errors_before_output_are_retried():
+    async def run():
+        llm_scheduler = scheduler()
+        model = FakeModel(failures=[ProviderError(429), ProviderError(503)])
+        output = await call(llm_scheduler, model, "prompt", "A")
+        return output, model.started, llm_scheduler.stats()
+
+    output, started, stats = asyncio.run(run())
+    assert output == "one two three "
+    assert started == ["prompt"] * 3
+    assert (stats["retries"], stats["rate_limited"], stats["failed"]) == (2, 1, 0)
+
+
+@pytest.mark.parametrize("model", [
+    # Not a rate limit or server error
+    FakeModel(failures=[ProviderError(400)]),
+    # Output was already streamed to the client
+    FakeModel(failures=[ProviderError(503)], fail_after_first_chunk=True),
+    # Out of retries
+    FakeModel(failures=[ProviderError(503)] * 3),
+])
+def test_other_failures_are_raised(model):
+    llm_scheduler = scheduler()
+    with pytest.raises(ProviderError):
+        asyncio.run(call(llm_scheduler, model, "prompt", "A"))
+    assert llm_scheduler.stats()["failed"] == 1
+    assert llm_scheduler.stats()["running"] == 0
+
+
+def test_token_bucket_waits_consumes_and_refunds():
+    bucket = TokenBucket(per_minute=600)
+    now = bucket.updated
+    assert bucket.wait_time(600, now) == 0.0
+    bucket.consume(500, now)
+    assert bucket.wait_time(200, now) == pytest.approx(10.0)
+    bucket.refund(400)
+    assert bucket.level == 500
+    # Refills at per_minute / 60 per second, up to the capacity
+    assert bucket.wait_time(600, now + 5) == pytest.approx(5.0)
+    assert TokenBucket(per_minute=0).wait_time(10 ** 6, now) == 0.0
+
+
+def test_output_beyond_the_estimate_is_charged():
+    async def run():
+        llm_scheduler = scheduler(tokens_per_minute=6000, output_tokens_estimate=1)
+        await call(llm_scheduler, FakeModel(output="word " * 100), "prompt", "A")
+        return llm_scheduler._token_bucket.level
+
+    # "prompt" and the output, at one token per byte; refill over the call is at most a few tokens
+    assert asyncio.run(run()) == pytest.approx(6000 - len("prompt") - len("word " * 100), abs=10)
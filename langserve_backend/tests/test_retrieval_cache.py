@@ -0,0 +1,68 @@
+import pytest
+from langchain_core.documents import Document
+
+from app.retrieval_cache import RetrievalCache
+
+
+def documents(*texts):
+    return [Document(page_content=text) for text in texts]
+
+
+@pytest.fixture
+def cache():
+    return RetrievalCache(max_entries=3, ttl_seconds=300)
+
+
+def test_hit_is_independent_of_title_order(cache):
+    assert cache.get(["b.pdf", "a.pdf"], "risks") is None
+    cache.put(["b.pdf", "a.pdf"], "risks", documents("x"), cache.generation)
+
+    assert cache.get(["a.pdf", "b.pdf", "a.pdf"], "risks") == documents("x")
+    assert cache.get(["a.pdf", "b.pdf"], "benefits") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 2, 1 / 3)
+
+
+def test_invalidation_drops_every_result_that_used_the_document(cache):
+    cache.put(["a.pdf"], "risks", documents("a"), cache.generation)
+    cache.put(["a.pdf", "b.pdf"], "risks", documents("ab"), cache.generation)
+    cache.put(["b.pdf"], "risks", documents("b"), cache.generation)
+
+    cache.invalidate_documents(["a.pdf"])
+
+    assert cache.get(["a.pdf"], "risks") is None
+    assert cache.get(["a.pdf", "b.pdf"], "risks") is None
+    assert cache.get(["b.pdf"], "risks") == documents("b")
+    assert cache.stats()["invalidated"] == 2
+    assert len(cache) == 1
+
+
+def test_search_that_raced_with_an_invalidation_is_not_cached(cache):
+    generation = cache.generation
+    cache.invalidate_documents(["a.pdf"])
+    cache.put(["a.pdf"], "risks", documents("stale"), generation)
+    assert cache.get(["a.pdf"], "risks") is None
+
+
+def test_entries_expire_after_ttl(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.retrieval_cache.time.monotonic", lambda: now[0])
+    cache.put(["a.pdf"], "risks", documents("a"), cache.generation)
+
+    now[0] += 300
+    assert cache.get(["a.pdf"], "risks") == documents("a")
+    now[0] += 1
+    assert cache.get(["a.pdf"], "risks") is None
+    assert cache.stats()["expired"] == 1
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for query in ("q1", "q2", "q3"):
+        cache.put(["a.pdf"], query, documents(query), cache.generation)
+    cache.get(["a.pdf"], "q1")
+    cache.put(["a.pdf"], "q4", documents("q4"), cache.generation)
+
+    assert len(cache) == 3
+    assert cache.get(["a.pdf"], "q2") is None
+    assert cache.get(["a.pdf"], "q1") == documents("q1")
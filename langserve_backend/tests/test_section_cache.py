@@ -0,0 +1,52 @@
+import pytest
+
+from app.section_cache import SectionCache
+
+SETTINGS = {"token_budget": 3000, "min_score": 0.2, "score_margin": 0.15, "min_k": 2, "candidate_k": 8}
+
+
+def key(**overrides):
+    arguments = {
+        "document_hashes": ["h1", "h2"],
+        "query": "What are the risks?",
+        "prompt_template": "Context: {context}",
+        "model_name": "gpt-4o",
+        "context_settings": SETTINGS,
+        **overrides,
+    }
+    return SectionCache.key(**arguments)
+
+
+def test_key_is_stable_and_ignores_document_and_setting_order():
+    assert key() == key()
+    assert key(document_hashes=["h2", "h1"]) == key()
+    assert key(context_settings=dict(reversed(list(SETTINGS.items())))) == key()
+
+
+@pytest.mark.parametrize("overrides", [
+    {"document_hashes": ["h1"]},
+    {"query": "What are the benefits?"},
+    {"prompt_template": "Sources: {context}"},
+    {"model_name": "gpt-4o-mini"},
+    {"context_settings": {**SETTINGS, "token_budget": 1500}},
+    {"context_settings": {**SETTINGS, "shared_token_budget": 12000}},
+])
+def test_key_changes_with_every_input(overrides):
+    assert key(**overrides) != key()
+
+
+def test_put_get_and_eviction(tmp_path):
+    cache = SectionCache(str(tmp_path / "sections.db"), max_entries=2)
+    assert cache.get("k1") is None
+
+    cache.put("k1", "risks", "first")
+    cache.put("k2", "benefits", "second")
+    assert cache.get("k1") == "first"
+    cache.put("k3", "summary", "third")
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get("k3") == "third"
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # Entries are persistent and shared through the database file
+    assert SectionCache(str(tmp_path / "sections.db")).get("k3") == "third"
@@ -0,0 +1,109 @@
+import json
+import os
+
+import pytest
+
+from app.config import Config
+from benchmarks.synthetic import write_synthetic_pdf
+
+
+def complete_event(body: str) -> dict:
+    return json.loads(body.split("event: complete\ndata: ")[1].split("\n")[0])
+
+
+@pytest.fixture(scope="module")
+def form_id(client, indexed_protocol):
+    response = client.post("/generate-consent-form", json={"files": [{"name": indexed_protocol}]})
+    assert response.status_code == 200
+    assert "event: complete" in response.text
+    return response.headers["x-form-id"]
+
+
+def test_generated_form_is_stored(client, indexed_protocol, form_id):
+    form = client.get(f"/forms/{form_id}").json()
+    assert form["version"] == 1
+    assert form["source"] == "generated"
+    assert form["files"] == [indexed_protocol]
+    assert all(form["sections"].values())
+
+
+def test_revise_with_instructions_changes_only_that_section(client, fake_models, form_id):
+    _, chat = fake_models
+    before = client.get(f"/forms/{form_id}").json()
+
+    response = client.post("/revise", json={"form_id": form_id, "section": "risks", "instructions": "Use simpler words."})
+
+    assert response.status_code == 200
+    assert response.headers["x-form-id"] == form_id
+    complete = complete_event(response.text)
+    assert complete["form_id"] == form_id
+    assert list(complete["sections"]) == ["risks"]
+    # The model revises the stored draft following the reviewer's instructions
+    assert before["sections"]["risks"][:20] in chat.prompts[-1]
+    assert "Use simpler words." in chat.prompts[-1]
+
+    after = client.get(f"/forms/{form_id}").json()
+    assert after["version"] == before["version"] + 1
+    assert after["source"] == "revised"
+    assert after["sections"]["risks"] != before["sections"]["risks"]
+    assert {k: v for k, v in after["sections"].items() if k != "risks"} == {
+        k: v for k, v in before["sections"].items() if k != "risks"
+    }
+
+
+def test_revise_without_instructions_regenerates_the_section(client, fake_models, form_id):
+    _, chat = fake_models
+    before = client.get(f"/forms/{form_id}").json()
+    calls = len(chat.prompts)
+
+    client.post("/revise", json={"form_id": form_id, "section": "benefits"})
+
+    after = client.get(f"/forms/{form_id}").json()
+    assert len(chat.prompts) == calls + 1
+    assert after["source"] == "revised"
+    assert after["sections"]["risks"] == before["sections"]["risks"]
+    assert after["sections"]["benefits"] != before["sections"]["benefits"]
+
+
+def test_revise_rejects_bad_requests(client, form_id):
+    assert client.post("/revise", json={"section": "risks"}).status_code == 400
+    assert client.post("/revise", json={"form_id": form_id, "section": "nope"}).status_code == 400
+    assert client.post("/revise", json={"form_id": "unknown", "section": "risks"}).status_code == 404
+
+
+def test_forms_revalidate_with_etag(client, form_id):
+    response = client.get(f"/forms/{form_id}")
+    etag = response.headers["etag"]
+    assert client.get(f"/forms/{form_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    edited = client.put(f"/forms/{form_id}", json={"sections": {"summary": "Edited by a reviewer."}})
+    assert edited.headers["etag"] != etag
+    assert client.get(f"/forms/{form_id}", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_form_pdf_revalidates_with_content_etag(client, form_id):
+    response = client.get(f"/forms/{form_id}/pdf")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    etag = response.headers["etag"]
+    assert client.get(f"/forms/{form_id}/pdf", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+
+def test_duplicate_uploads_are_not_queued_twice(client, indexed_protocol, tmp_path):
+    with open(os.path.join(Config.UPLOAD_FOLDER, indexed_protocol), "rb") as f:
+        indexed = f.read()
+    with open(write_synthetic_pdf(str(tmp_path / "amendment.pdf"), 2), "rb") as f:
+        amendment = f.read()
+
+    response = client.post("/upload", files=[
+        ("files", ("protocol-copy.pdf", indexed, "application/pdf")),
+        ("files", ("amendment.pdf", amendment, "application/pdf")),
+        ("files", ("amendment-copy.pdf", amendment, "application/pdf")),
+    ])
+
+    statuses = {result["name"]: result["status"] for result in response.json()["files"]}
+    assert statuses == {
+        "protocol-copy.pdf": "already processed",
+        "amendment.pdf": "queued",
+        "amendment-copy.pdf": "already queued",
+    }
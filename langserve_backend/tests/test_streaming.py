@@ -0,0 +1,162 @@
+import asyncio
+import json
+
+import pytest
+
+from app.streaming import BoundedTokenHandler, coalesce_tokens, delta_events, snapshot_events
+
+
+def parse(events):
+    """ (event, data) of every SSE event. """
+    parsed = []
+    for event in events:
+        name, data = event.strip().split("\n")
+        parsed.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return parsed
+
+
+async def graph_stream(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+async def collect(events):
+    return [event async for event in events]
+
+
+SECTION_CHUNKS = [
+    ("custom", {"section": "risks", "offset": 0, "delta": "Some "}),
+    ("custom", {"section": "benefits", "offset": 0, "delta": "None"}),
+    ("custom", {"section": "risks", "offset": 5, "delta": "risks"}),
+    ("updates", {"risks_node": {"risks": ["Some risks."]}}),
+    ("updates", {"benefits_node": {"benefits": ["None expected."]}}),
+]
+
+
+def test_delta_events_stream_offsets_and_complete_with_final_text():
+    async def on_complete(sections):
+        assert sections == {"risks": "Some risks.", "benefits": "None expected."}
+        return {"form_id": "f1", "version": 1}
+
+    events = parse(asyncio.run(collect(delta_events(
+        graph_stream(SECTION_CHUNKS), ["risks", "benefits"], checkpoint_seconds=3600, on_complete=on_complete
+    ))))
+
+    assert [data for name, data in events if name == "delta"] == [chunk for mode, chunk in SECTION_CHUNKS if mode == "custom"]
+    name, complete = events[-1]
+    assert name == "complete"
+    # The nodes' final text replaces the streamed deltas
+    assert complete == {
+        "sections": {"risks": "Some risks.", "benefits": "None expected."},
+        "completed": ["risks", "benefits"],
+        "form_id": "f1",
+        "version": 1,
+    }
+
+
+def test_delta_events_checkpoint_the_streamed_text():
+    events = parse(asyncio.run(collect(delta_events(graph_stream(SECTION_CHUNKS[:3]), ["risks", "benefits"], 0))))
+
+    checkpoints = [data for name, data in events if name == "checkpoint"]
+    assert len(checkpoints) == 3
+    assert checkpoints[-1] == {"sections": {"risks": "Some risks", "benefits": "None"}, "completed": []}
+
+
+def test_delta_events_report_the_shared_context_size():
+    chunks = [("updates", {"shared_context_node": {"shared_context": "...", "shared_prefix_tokens": 1234}})]
+    events = parse(asyncio.run(collect(delta_events(graph_stream(chunks), ["risks"], 3600))))
+    assert events[0] == ("context", {"shared_prefix_tokens": 1234})
+
+
+def test_delta_events_end_with_an_error_event():
+    completed = []
+
+    async def on_complete(sections):
+        completed.append(sections)
+
+    chunks = [SECTION_CHUNKS[0], RuntimeError("model unavailable")]
+    events = parse(asyncio.run(collect(delta_events(graph_stream(chunks), ["risks"], 3600, on_complete))))
+
+    assert events[-1] == ("error", {"error": "model unavailable"})
+    assert "complete" not in [name for name, _ in events]
+    assert completed == []
+
+
+def test_snapshot_events_yield_every_section_after_each_delta():
+    snapshots = [json.loads(event) for event in asyncio.run(collect(
+        snapshot_events(graph_stream(SECTION_CHUNKS), ["risks", "benefits"])
+    ))]
+
+    assert snapshots[0] == {"risks": "Some ", "benefits": ""}
+    assert snapshots[2] == {"risks": "Some risks", "benefits": "None"}
+    assert snapshots[-1] == {"risks": "Some risks.", "benefits": "None expected."}
+
+
+async def coalesced(tokens, flush_chars, flush_seconds, pause=0.0):
+    """ Deltas from coalesce_tokens while a producer puts ``tokens``, pausing ``pause`` seconds after each. """
+    queue = asyncio.Queue()
+
+    async def produce():
+        for token in tokens:
+            await queue.put(token)
+            await asyncio.sleep(pause)
+
+    task = asyncio.create_task(produce())
+    deltas = [delta async for delta in coalesce_tokens(queue, task, flush_chars, flush_seconds)]
+    await task
+    return deltas
+
+
+def test_coalesce_flushes_on_size():
+    deltas = asyncio.run(coalesced(["abcd", "efgh", "ij", "kl", "m"], flush_chars=10, flush_seconds=60))
+    assert deltas == ["abcdefghij", "klm"]
+
+
+def test_coalesce_flushes_on_time():
+    deltas = asyncio.run(coalesced(["a", "b", "c"], flush_chars=1000, flush_seconds=0.02, pause=0.2))
+    assert deltas == ["a", "b", "c"]
+
+
+def test_coalesce_flushes_what_is_left_when_generation_ends():
+    async def run():
+        queue = asyncio.Queue()
+        for token in ("Hello", ", ", "world"):
+            queue.put_nowait(token)
+        task = asyncio.create_task(asyncio.sleep(0))
+        await task
+        return [delta async for delta in coalesce_tokens(queue, task, flush_chars=1000, flush_seconds=60)]
+
+    assert "".join(asyncio.run(run())) == "Hello, world"
+
+
+def test_coalesce_leaves_the_generation_error_to_the_caller():
+    async def run():
+        async def fail():
+            raise RuntimeError("rate limited")
+
+        task = asyncio.create_task(fail())
+        deltas = [delta async for delta in coalesce_tokens(asyncio.Queue(), task, 10, 1.0)]
+        assert deltas == []
+        with pytest.raises(RuntimeError):
+            await task
+
+    asyncio.run(run())
+
+
+def test_token_handler_applies_backpressure():
+    async def run():
+        handler = BoundedTokenHandler(max_pending=2)
+        await handler.on_llm_new_token("")
+        await handler.on_llm_new_token("a")
+        await handler.on_llm_new_token("b")
+        # The model's stream waits until the consumer reads a token
+        blocked = asyncio.create_task(handler.on_llm_new_token("c"))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert handler.queue.get_nowait() == "a"
+        await asyncio.wait_for(blocked, 1)
+        return [handler.queue.get_nowait() for _ in range(handler.queue.qsize())]
+
+    assert asyncio.run(run()) == ["b", "c"]